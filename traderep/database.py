@@ -0,0 +1,140 @@
+import asyncio
+from contextlib import contextmanager
+import queue
+import sqlite3
+import threading
+import time
+
+
+class Database:
+    """The traderep SQLite file, only ever touched from one thread that
+    owns the connection. Commands await their queries instead of running
+    them on the event loop, so a slow report or a locked file never stalls
+    the bot. At most max_queue queries wait at once, anything past that
+    waits its turn on the event loop without taking a slot"""
+
+    def __init__(self, path, max_queue: int = 64):
+        self.path = path
+        self._jobs = queue.SimpleQueue()
+        self._slots = asyncio.Semaphore(max_queue)
+        self._thread = None
+        self._broken = None  # Why the connection couldn't be opened
+        self.max_queue = max_queue
+        self.queries = 0
+        self.waiting = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.busy_total = 0.0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._work, name="traderep-db", daemon=True)
+            self._thread.start()
+
+    def _work(self):
+        try:
+            con = self._open()
+        except Exception as e:  # pylint: disable=broad-except
+            # Fail everything that's waiting, and everything after, rather
+            # than leave it waiting for a thread that's gone
+            self._broken = e
+            self._fail(e)
+            return
+        try:
+            while True:
+                job = self._jobs.get()
+                if job is None:
+                    return
+                loop, future, func, args, queued = job
+                started = time.monotonic()
+                try:
+                    result = func(con, *args)
+                except Exception as e:  # pylint: disable=broad-except
+                    loop.call_soon_threadsafe(_settle, future, None, e)
+                else:
+                    loop.call_soon_threadsafe(_settle, future, result, None)
+                finished = time.monotonic()
+                self._record(started - queued, finished - started)
+        finally:
+            con.close()
+
+    def _open(self):
+        con = sqlite3.connect(str(self.path))
+        try:
+            con.isolation_level = None
+            # Writes append to the log and are only synced at checkpoints, which
+            # can lose the last commits on power loss but never corrupts the file
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.execute("PRAGMA cache_size=-8000")
+            con.execute("PRAGMA busy_timeout=5000")
+        except BaseException:
+            con.close()
+            raise
+        return con
+
+    def _fail(self, error):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            loop, future, _func, _args, _queued = job
+            loop.call_soon_threadsafe(_settle, future, None, error)
+
+    def _record(self, waited, busy):
+        self.queries += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        self.busy_total += busy
+
+    async def run(self, func, *args):
+        """Runs func(connection, *args) on the database thread and returns
+        its result, raising whatever it raised"""
+        if self._broken is not None:
+            raise self._broken
+        queued = time.monotonic()
+        self.waiting += 1
+        try:
+            async with self._slots:
+                loop = asyncio.get_running_loop()
+                future = loop.create_future()
+                self._jobs.put((loop, future, func, args, queued))
+                return await future
+        finally:
+            self.waiting -= 1
+
+    async def close(self):
+        """Lets queued queries finish then closes the connection"""
+        if self._thread is not None:
+            self._jobs.put(None)
+            await asyncio.get_running_loop().run_in_executor(None, self._thread.join)
+            self._thread = None
+
+    def stats(self):
+        average = (1000.0 * self.wait_total / self.queries) if self.queries else 0.0
+        busy = (1000.0 * self.busy_total / self.queries) if self.queries else 0.0
+        return ("{} queries, {} waiting (of {}), queue wait {:.1f}ms average {:.1f}ms worst, "
+                "{:.1f}ms average query").format(self.queries, self.waiting, self.max_queue,
+                                                 average, 1000.0 * self.wait_max, busy)
+
+
+@contextmanager
+def transaction(con):
+    """Everything in the block is committed together, or rolled back if it raises"""
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        yield con
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    con.execute("COMMIT")
+
+
+def _settle(future, result, error):
+    # The command may have been cancelled while its query ran
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
@@ -0,0 +1,105 @@
+import asyncio
+from collections import OrderedDict
+import time
+
+import discord
+
+
+class MemberResolver:
+    """Turns the user ids stored with trades into members or users for
+    reports. The gateway's member cache answers first, then one member
+    chunk request for everything it didn't have, and only what's left is
+    fetched over REST a few at a time. Answers are remembered for ttl
+    seconds and people Discord says are gone for missing_ttl"""
+
+    def __init__(self, ttl: float = 600, missing_ttl: float = 3600, concurrency: int = 4,
+                 maxsize: int = 2048):
+        self.ttl = ttl
+        self.missing_ttl = missing_ttl
+        self.maxsize = maxsize
+        self._fetching = asyncio.Semaphore(concurrency)
+        self._cache = OrderedDict()  # (guild id, user id) -> (expires, member or user, None if gone)
+        self.gateway = 0
+        self.cached = 0
+        self.chunked = 0
+        self.fetched = 0
+        self.missing = 0
+
+    async def resolve(self, guild: discord.Guild, bot, ids) -> dict:
+        """Maps each id to a member, a user who isn't in the guild any more,
+        or None when nobody could be found"""
+        found = {}
+        wanted = []
+        now = time.monotonic()
+        for user_id in {int(user_id) for user_id in ids}:
+            member = guild.get_member(user_id)
+            if member is not None:
+                self.gateway += 1
+                found[user_id] = member
+                continue
+            entry = self._cache.get((guild.id, user_id))
+            if entry is not None and entry[0] > now:
+                self._cache.move_to_end((guild.id, user_id))
+                self.cached += 1
+                found[user_id] = entry[1]
+                continue
+            wanted.append(user_id)
+
+        if wanted and not guild.chunked:
+            for member in await self._query(guild, wanted):
+                self.chunked += 1
+                found[member.id] = member
+                self._remember(guild.id, member.id, member, self.ttl)
+            wanted = [user_id for user_id in wanted if user_id not in found]
+
+        if wanted:
+            users = await asyncio.gather(*(self._fetch(guild, bot, user_id) for user_id in wanted))
+            found.update(zip(wanted, users))
+        return found
+
+    async def get(self, guild: discord.Guild, bot, user_id):
+        return (await self.resolve(guild, bot, [user_id])).get(int(user_id))
+
+    async def _query(self, guild, wanted):
+        """One gateway request for up to 100 members at a time"""
+        members = []
+        for start in range(0, len(wanted), 100):
+            try:
+                members += await guild.query_members(user_ids=wanted[start:start + 100],
+                                                     limit=100, cache=True)
+            except (discord.ClientException, asyncio.TimeoutError):
+                # No members intent or the gateway is slow, fetch them instead
+                break
+        return members
+
+    async def _fetch(self, guild, bot, user_id):
+        async with self._fetching:
+            try:
+                user = await guild.fetch_member(user_id)
+            except discord.NotFound:
+                user = None
+            except discord.HTTPException:
+                return None
+            if user is None:
+                try:
+                    user = await bot.fetch_user(user_id)
+                except discord.NotFound:
+                    self.missing += 1
+                    self._remember(guild.id, user_id, None, self.missing_ttl)
+                    return None
+                except discord.HTTPException:
+                    return None
+            self.fetched += 1
+            self._remember(guild.id, user_id, user, self.ttl)
+            return user
+
+    def _remember(self, guild_id, user_id, user, ttl):
+        self._cache[(guild_id, user_id)] = (time.monotonic() + ttl, user)
+        self._cache.move_to_end((guild_id, user_id))
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    def stats(self):
+        return ("{} remembered, {} from the gateway cache, {} remembered answers, {} from member chunks, "
+                "{} fetched, {} gone").format(len(self._cache), self.gateway, self.cached, self.chunked,
+                                              self.fetched, self.missing)
@@ -5,11 +5,121 @@ from redbot.core import checks
 from redbot.core import Config
 import sqlite3
 import os
+
+from .database import Database, transaction
+from .members import MemberResolver
 #import ptvsd
 
 # noinspection PyUnresolvedReferences
 
-db_version = 1.0
+# The queries every report and trade command runs, written once so the
+# plans command can check that each one is answered from an index
+OPEN_TRADE_WITH = ("SELECT count(*) from tradeperson tp join trade t on t.tradenum = tp.tradenum "
+                   "WHERE tp.person = ? and tp.partner = ? and t.status is null")
+# One person's rep_summary row worked out from the trades, {0} is who
+SUMMARY_SELECT = (
+    "SELECT {0},"
+    " (SELECT coalesce(sum(tp.rep), 0) from tradeperson tp join trade t on t.tradenum = tp.tradenum"
+    "  where tp.partner = {0} and tp.rep is not null and t.status = 1),"
+    " (SELECT count(*) from tradeperson tp join trade t on t.tradenum = tp.tradenum"
+    "  where tp.partner = {0} and tp.rep is not null and t.status = 1),"
+    " (SELECT count(*) from tradeperson tp join trade t on t.tradenum = tp.tradenum"
+    "  where tp.person = {0} and t.status is null),"
+    " (SELECT count(*) from tradeperson tp join trade t on t.tradenum = tp.tradenum"
+    "  where tp.person = {0} and t.status = 1 and tp.rep is null),"
+    " (SELECT count(*) from tradeperson tp join trade t on t.tradenum = tp.tradenum"
+    "  where tp.partner = {0} and t.status = 1 and tp.rep is null),"
+    " (SELECT count(*) from tradeperson tp join trade t on t.tradenum = tp.tradenum"
+    "  where tp.person = {0} and (t.status is null or t.status = 1)),"
+    " (SELECT max(t.start_time) from tradeperson tp join trade t on t.tradenum = tp.tradenum"
+    "  where tp.person = {0})")
+SUMMARY_COLUMNS = "person, rep, repped, open, waiting_on_me, waiting_on_them, total, last_trade"
+REFRESH_SUMMARY = SUMMARY_SELECT.format(":person")
+REBUILD_SUMMARY = ("INSERT INTO rep_summary (" + SUMMARY_COLUMNS + ") " + SUMMARY_SELECT.format("p.person") +
+                   " from (SELECT DISTINCT person from tradeperson) p")
+REPORT_SUMMARY = ("SELECT rep, repped, open, waiting_on_me, waiting_on_them, total, last_trade "
+                  "from rep_summary where person = ?")
+OPEN_PARTNERS = ("SELECT t.tradenum, tp.partner from trade t join tradeperson tp on tp.tradenum = t.tradenum"
+                 " where t.status is null and tp.person = ? order by t.start_time desc")
+REPPED_PARTNERS = ("SELECT tp.tradenum, tp.person, tp.rep from tradeperson tp WHERE tp.partner = ? "
+                   "and tp.rep is not null order by tp.rep_time desc")
+UNREPPED_PARTNERS = ("SELECT tp.partner, tp.tradenum from trade t join tradeperson tp on tp.tradenum = t.tradenum"
+                     " where t.status = 1 and tp.rep is null and tp.person = ?")
+WAITING_PARTNERS = ("SELECT tp.person, tp.tradenum from trade t join tradeperson tp on tp.tradenum = t.tradenum"
+                    " where t.status = 1 and tp.rep is null and tp.partner = ?")
+OPEN_TRADE_BY_PARTNER = ("SELECT partner, t.tradenum from tradeperson tp join trade t on t.tradenum = tp.tradenum "
+                         "where tp.person = ? and tp.partner = ? and t.status is null")
+OPEN_TRADE_BY_NUMBER = ("SELECT partner, t.tradenum from tradeperson tp join trade t on t.tradenum = tp.tradenum "
+                        "where t.tradenum = ? and tp.person = ? and t.status is null")
+OLDEST_OPEN_TRADE = ("SELECT tp.tradenum, partner from tradeperson tp join trade t on t.tradenum = tp.tradenum"
+                     " where person = ? and partner = ? and t.status is null order by start_time asc")
+# The unary + keeps SQLite from walking every closed trade through
+# trade_status, so the join starts from the pair's own trades
+OLDEST_UNREPPED_TRADE = ("SELECT tp.tradenum, partner from tradeperson tp join trade t on t.tradenum = tp.tradenum"
+                         " where person = ? and partner = ? and +t.status = 1 and tp.rep is null order by "
+                         "t.start_time asc")
+OLDEST_CLOSED_TRADE = ("SELECT tp.tradenum, partner from tradeperson tp join trade t on t.tradenum = tp.tradenum"
+                       " where person = ? and partner = ? and +t.status = 1 order by t.start_time asc")
+TRADE_PARTNER = ("SELECT tp.tradenum, partner from tradeperson tp join trade t on t.tradenum = tp.tradenum"
+                 " where tp.tradenum = ? and person = ? and (t.status is null or tp.rep is null)"
+                 " order by t.start_time asc")
+
+HOT_QUERIES = (
+    ("open trade with", OPEN_TRADE_WITH, (1, 2)),
+    ("report summary", REPORT_SUMMARY, (1,)),
+    ("refresh summary", REFRESH_SUMMARY, {"person": 1}),
+    ("open partners", OPEN_PARTNERS, (1,)),
+    ("repped partners", REPPED_PARTNERS, (1,)),
+    ("unrepped partners", UNREPPED_PARTNERS, (1,)),
+    ("waiting partners", WAITING_PARTNERS, (1,)),
+    ("trade partner", TRADE_PARTNER, (1, 2)),
+    ("open trade by partner", OPEN_TRADE_BY_PARTNER, (1, 2)),
+    ("open trade by number", OPEN_TRADE_BY_NUMBER, (1, 2)),
+    ("oldest open trade", OLDEST_OPEN_TRADE, (1, 2)),
+    ("oldest unrepped trade", OLDEST_UNREPPED_TRADE, (1, 2)),
+    ("oldest closed trade", OLDEST_CLOSED_TRADE, (1, 2)),
+)
+
+# Schema changes in the order they were made: (level, what it does, statements).
+# Each runs in its own transaction together with recording its level, so a
+# database is always at exactly one of these levels
+MIGRATIONS = (
+    (1.0, "first release", ()),
+    (2.0, "index trades by person, partner and status", (
+        # Open trade checks, rep lookups and report counts by person
+        "CREATE INDEX IF NOT EXISTS tradeperson_person ON tradeperson (person, partner, tradenum, rep)",
+        # Rep received, newest first, and trades waiting on a partner
+        "CREATE INDEX IF NOT EXISTS tradeperson_partner ON tradeperson "
+        "(partner, rep, rep_time, tradenum, person)",
+        "CREATE INDEX IF NOT EXISTS trade_status ON trade (status, start_time)",
+    )),
+    (3.0, "allow one open trade per pair of people", (
+        "ALTER TABLE trade ADD COLUMN pair text",
+        "UPDATE trade SET pair = (SELECT min(person) || '-' || max(person) FROM tradeperson tp "
+        "WHERE tp.tradenum = trade.tradenum) WHERE status is null",
+        # Pairs that already have more than one open keep them, only the oldest counts
+        "UPDATE trade SET pair = null WHERE status is null and tradenum NOT IN (SELECT min(tradenum) "
+        "FROM trade WHERE status is null and pair is not null GROUP BY pair)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS trade_open_pair ON trade (pair) WHERE status is null",
+    )),
+    (4.0, "keep a summary of each person's rep for reports", (
+        "CREATE TABLE IF NOT EXISTS rep_summary (person text primary key, rep integer not null, "
+        "repped integer not null, open integer not null, waiting_on_me integer not null, "
+        "waiting_on_them integer not null, total integer not null, last_trade text) WITHOUT ROWID",
+        REBUILD_SUMMARY,
+    )),
+)
+
+db_version = MIGRATIONS[-1][0]
+
+# Queries waiting on the database thread before commands have to queue up
+DB_MAX_QUEUE = 64
+
+# How long a looked up member is remembered, how long someone Discord says
+# doesn't exist is, and how many lookups go to Discord at once
+MEMBER_TTL = 600
+MEMBER_MISSING_TTL = 3600
+MEMBER_FETCH_CONCURRENCY = 4
 
 """
 !traderep start @person -- Signifies an agreement has been made between the person mentioned and the person running
@@ -30,13 +140,19 @@ class Traderep(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.path = cog_data_path(self)
-        self.db = self.path / "traderep.db"
-        check_files(self.db)
 #        print("Waiting for debugger attach")
 #        ptvsd.enable_attach(address=('localhost', 5678), redirect_output=True)
 #        ptvsd.wait_for_attach()
-        self.connection = sqlite3.connect(self.db)
-        self.connection.isolation_level = None
+        self.db = Database(self.path / "traderep.db", DB_MAX_QUEUE)
+        self.members = MemberResolver(MEMBER_TTL, MEMBER_MISSING_TTL, MEMBER_FETCH_CONCURRENCY)
+
+    async def cog_load(self):
+        """Starts the database thread and brings the schema up to date"""
+        self.db.start()
+        await self.db.run(check_database)
+
+    async def cog_unload(self):
+        await self.db.close()
 
     @commands.group(no_pm=False, invoke_without_command=False,
                     pass_context=True)
@@ -50,37 +166,20 @@ class Traderep(commands.Cog):
         if partner.id == ctx.message.author.id:
             await ctx.send("You can't trade with yourself, that's a 0-sum game!")
             return
-        cur = self.connection.cursor()
-        cur.execute("SELECT count(*) from tradeperson tp join trade t on t.tradenum = tp.tradenum "
-                    "WHERE tp.person = ? and tp.partner = ? and t.status is null", (ctx.message.author.id, partner.id))
-        counts = cur.fetchone()
+        counts = await self.db.run(fetch_one, OPEN_TRADE_WITH, (ctx.message.author.id, partner.id))
         if counts[0] >= 1:
             await ctx.send("You already have a trade open with {}".format(partner.display_name))
             return
         try:
-            cur.execute("INSERT INTO trade(initiator, start_time) values ({}, DateTime('now'))"
-                        .format(ctx.message.author.id))
+            trade_num = await self.db.run(start_trade, ctx.message.author.id, partner.id)
         except sqlite3.OperationalError as e:
             await ctx.send("There's a problem right now: {}".format(e))
             return
-        trade_num = cur.lastrowid
         if trade_num:
-            try:
-                cur.execute("INSERT INTO tradeperson (tradenum, person, partner) values (?, ?, ?)",
-                            (trade_num, partner.id, ctx.message.author.id))
-                cur.execute("INSERT INTO tradeperson (tradenum, person, partner) values (?, ?, ?)",
-                            (trade_num, ctx.message.author.id, partner.id))
-                cur.execute("INSERT INTO tradelog (logtime, who, tradenum, what) values (DateTime('now'), ?, ?, ?)",
-                            (ctx.message.author.id, trade_num, "Author initiated trade with {}".format(
-                                partner.id
-                            )))
-            except sqlite3.OperationalError as e:
-                await ctx.send("There's a problem right now: {}".format(e))
-                return
             await ctx.send("Trade between {} and {} initiated as trade id: **{}**".format(
                 partner.mention, ctx.message.author.mention, trade_num))
         else:
-            await ctx.send("Something very bad happened and I didn't get a trade number, try again?")
+            await ctx.send("You already have a trade open with {}".format(partner.display_name))
 
     @traderep.command(name="cancel", aliases=["stop"], pass_context=True, no_pm=True)
     async def trade_stop(self, ctx, arg):
@@ -94,27 +193,18 @@ class Traderep(commands.Cog):
             trade_who = arg.id
         elif mentions and isinstance(mentions, list) and isinstance(mentions[0], discord.Member):
             trade_who = mentions[0].id
-        cur = self.connection.cursor()
         if trade_who:
             trade_person = await self.get_user_by_id(ctx, trade_who)
-            cur.execute("SELECT partner, t.tradenum from tradeperson tp join trade t on t.tradenum = tp.tradenum "
-                        "where tp.person = ? and tp.partner = ? and t.status is null",
-                        (ctx.message.author.id, trade_who))
+            row = await self.db.run(fetch_one, OPEN_TRADE_BY_PARTNER, (ctx.message.author.id, trade_who))
         elif trade_num:
-            cur.execute("SELECT partner, t.tradenum from tradeperson tp join trade t on t.tradenum = tp.tradenum "
-                        "where t.tradenum = ? and tp.person = ? and t.status is null",
-                        (trade_num, ctx.message.author.id))
+            row = await self.db.run(fetch_one, OPEN_TRADE_BY_NUMBER, (trade_num, ctx.message.author.id))
         else:
             await ctx.send("You must provide a trade number and it can't be 0")
             return
-        row = cur.fetchone()
         if row:
             trade_who, trade_num = row[0], row[1]
             if row[0]:
-                cur.execute("update trade set end_time = DateTime('now'), status = -1 where tradenum = {}".format(
-                    trade_num
-                ))
-                if cur.rowcount == 1:
+                if await self.db.run(cancel_trade, trade_num, ctx.message.author.id, row[0]):
                     if ctx.guild:
                         partner = await self.get_user_by_id(ctx, trade_who)
                     else:
@@ -127,12 +217,9 @@ class Traderep(commands.Cog):
                     else:
                         await ctx.send("Trade {} between you and {} was cancelled but I could not find a name "
                                        "for that person".format(trade_num, trade_who))
-                    cur.execute("INSERT INTO tradelog (logtime, who, tradenum, what) values (DateTime('now'), ?, ?, ?)",
-                                (ctx.message.author.id, trade_num, "Author cancelled trade {} with {}".format(
-                                    trade_num, row[0]
-                                )))
                 else:
-                    await ctx.send("I was unable to cancel trade number {}".format(trade_num))
+                    await ctx.send("I was unable to cancel trade number {}, it isn't open any more".format(
+                        trade_num))
             else:
                 await ctx.send("Either trade {} didn't involve you or it isn't open".format(trade_num))
         else:
@@ -181,27 +268,14 @@ class Traderep(commands.Cog):
         if not id_to_use:
             id_to_use = ctx.message.author.id
 
-        user = await self.get_user_by_id(ctx, id_to_use)
-        cur = self.connection.cursor()
-        cur.execute("SELECT count(t.tradenum), sum(rep) from tradeperson tp join trade t on t.tradenum = tp.tradenum"
-                    " where partner = {} and rep is not null and t.status = 1".format(id_to_use))
-        (repped_trades, rep) = cur.fetchone()
-        cur.execute("SELECT count(t.tradenum) from trade t join tradeperson tp on tp.tradenum = t.tradenum"
-                    " where t.status is null and tp.person = {}".format(id_to_use))
-        row = cur.fetchone()
-        open_trades = row[0]
-        cur.execute("SELECT count(t.tradenum) from trade t join tradeperson tp on tp.tradenum = t.tradenum"
-                    " where t.status = 1 and tp.rep is null and tp.person = {}".format(id_to_use))
-        row = cur.fetchone()
-        closed_unrepped_trades = row[0]
-        cur.execute("SELECT count(t.tradenum) from trade t join tradeperson tp on tp.tradenum = t.tradenum"
-                    " where t.status = 1 and tp.rep is null and tp.partner = {}".format(id_to_use))
-        row = cur.fetchone()
-        closed_waiting_trade = row[0]
-        cur.execute("SELECT count(t.tradenum) from trade t join tradeperson tp on tp.tradenum = t.tradenum"
-                    " where tp.person = {} and (t.status is null or t.status = 1)".format(id_to_use))
-        row = cur.fetchone()
-        total_trades = row[0]
+        counts, lists = await self.db.run(report_rows, id_to_use)
+        # Everyone the report names, looked up together
+        users = await self.members.resolve(ctx.guild, ctx.bot, [id_to_use] + [
+            row[1] for row in lists["open"] + lists["repped"]] + [
+            row[0] for row in lists["unrepped"] + lists["waiting"]])
+        user = users.get(int(id_to_use))
+        (rep, repped_trades, open_trades, closed_unrepped_trades, closed_waiting_trade,
+         total_trades, last_trade) = counts
         name_to_use = id_to_use
         if user:
             name_to_use = user.display_name
@@ -214,14 +288,14 @@ class Traderep(commands.Cog):
         else:
             status_str += "Has no rep. "
 
+        if last_trade:
+            report_str += "Last trade started {} UTC\n".format(last_trade)
+
         if open_trades:
             report_str += "Open trades ({}) with: ".format(open_trades)
-            cur.execute("SELECT t.tradenum, tp.partner from trade t join tradeperson tp on tp.tradenum = t.tradenum"
-                        " where t.status is null and tp.person = {} order by t.start_time desc".format(id_to_use))
-            rows = cur.fetchmany(size=10)
             name_str = ""
-            for row in rows:
-                user = await self.get_user_by_id(ctx, row[1])
+            for row in lists["open"]:
+                user = users.get(int(row[1]))
                 if user:
                     name_str += "{} ({}), ".format(user.display_name, row[0])
                 else:
@@ -233,14 +307,9 @@ class Traderep(commands.Cog):
 
         if repped_trades:
             report_str += "Most recent repped trades: "
-            cur.execute("SELECT tp.tradenum, tp.person, tp.rep from tradeperson tp WHERE tp.partner = {} and tp.rep is not null "
-                        "order by tp.rep_time desc"
-                        .format(id_to_use))
-            rows = cur.fetchmany(size=10)
             name_str = ""
-            for row in rows:
-                # user = await self.bot.fetch_user(row[1])
-                user = await self.get_user_by_id(ctx, row[1])
+            for row in lists["repped"]:
+                user = users.get(int(row[1]))
 
                 if user:
                     name_str += "{} ({}), ".format(user.display_name, row[0])
@@ -253,12 +322,9 @@ class Traderep(commands.Cog):
 
         if closed_unrepped_trades:
             report_str += "Partners waiting on rep: "
-            cur.execute("SELECT tp.partner, tp.tradenum from trade t join tradeperson tp on tp.tradenum = t.tradenum"
-                        " where t.status = 1 and tp.rep is null and tp.person = {}".format(id_to_use))
-            rows = cur.fetchmany(size=10)
             name_str = ""
-            for row in rows:
-                user = await self.get_user_by_id(ctx, row[0])
+            for row in lists["unrepped"]:
+                user = users.get(int(row[0]))
                 if user:
                     name_str += "{} ({}), ".format(user.display_name, row[1])
                 else:
@@ -270,12 +336,9 @@ class Traderep(commands.Cog):
 
         if closed_waiting_trade:
             report_str += "{} is waiting on rep from: ".format(name_to_use)
-            cur.execute("SELECT tp.person, tp.tradenum from trade t join tradeperson tp on tp.tradenum = t.tradenum"
-                        " where t.status = 1 and tp.rep is null and tp.partner = {}".format(id_to_use))
-            rows = cur.fetchmany(size=10)
             name_str = ""
-            for row in rows:
-                user = await self.get_user_by_id(ctx, row[0])
+            for row in lists["waiting"]:
+                user = users.get(int(row[0]))
                 if user:
                     name_str += "{} ({}), ".format(user.display_name, row[1])
                 else:
@@ -288,21 +351,32 @@ class Traderep(commands.Cog):
         report_str += status_str
         await ctx.send(report_str)
 
+    @traderep.command(name="plans", pass_context=True)
+    @checks.is_owner()
+    async def plans(self, ctx):
+        """Shows how SQLite answers the queries reports and trades run"""
+        plan_str = ""
+        for name, plan in await self.db.run(lambda con: list(query_plans(con))):
+            plan_str += "{}:\n  {}\n".format(name, "\n  ".join(plan))
+        await ctx.send("```\n{}```".format(plan_str[:1900]))
+
+    @traderep.command(name="rebuild", pass_context=True)
+    @checks.is_owner()
+    async def rebuild(self, ctx):
+        """Works out everyone's rep summary again from their trades"""
+        await ctx.channel.typing()
+        people = await self.db.run(rebuild_summary)
+        await ctx.send("Rebuilt the rep summary for {} people".format(people))
+
+    @traderep.command(name="dbstats", pass_context=True)
+    @checks.is_owner()
+    async def dbstats(self, ctx):
+        """Shows how long commands wait on the database and how member lookups go"""
+        await ctx.send("```\nDatabase: {}\nMembers: {}\n```".format(self.db.stats(), self.members.stats()))
+
     async def get_user_by_id(self, ctx, id_to_find):
         """Takes an ID and tries multiple ways to get the user"""
-        user = ctx.guild.get_member(id_to_find)
-        if not user:
-            try:
-                user = await ctx.guild.fetch_member(id_to_find)
-            except discord.errors.NotFound:
-                pass
-        if not user:
-            try:
-                user = await ctx.bot.fetch_user(id_to_find)
-            except discord.errors.NotFound:
-                pass
-
-        return user
+        return await self.members.get(ctx.guild, ctx.bot, id_to_find)
 
 
 async def repmod(self, ctx, arg, mod):
@@ -314,49 +388,20 @@ async def repmod(self, ctx, arg, mod):
     else:
         mod_word = "derepped"
     mentions = ctx.message.mentions
-    cur = self.connection.cursor()
     trade_who, trade_num = None, None
     if arg.isdigit():
         trade_num = arg
     elif mentions and isinstance(mentions, list) and isinstance(mentions[0], discord.Member):
         trade_who = mentions[0].id
-        # First look to close a trade
-        cur.execute("SELECT tp.tradenum, partner from tradeperson tp join trade t on t.tradenum = tp.tradenum"
-                    " where person = ? and partner = ? and t.status is null order by start_time asc",
-                    (ctx.message.author.id, trade_who))
-        row = cur.fetchone()
-        if row and row[0]:
-            trade_num = row[0]
-        else:
-            # Look for an unrepped trade
-            cur.execute("SELECT tp.tradenum, partner from tradeperson tp join trade t on t.tradenum = tp.tradenum"
-                        " where person = ? and partner = ? and t.status = 1 and tp.rep is null order by "
-                        "t.start_time asc",
-                        (ctx.message.author.id, trade_who))
-            row = cur.fetchone()
-            if row and row[0]:
-                trade_num = row[0]
-            else:
-                # Use least recent started trade
-                cur.execute(
-                    "SELECT tp.tradenum, partner from tradeperson tp join trade t on t.tradenum = tp.tradenum"
-                    " where person = ? and partner = ? and t.status = 1 order by t.start_time asc",
-                    (ctx.message.author.id, trade_who))
-                row = cur.fetchone()
-                if row and row[0]:
-                    trade_num = row[0]
-                else:
-                    await ctx.send("I tried but couldn't figure out which trade you meant")
-                    return
+        trade_num = await self.db.run(trade_to_rep, ctx.message.author.id, trade_who)
+        if not trade_num:
+            await ctx.send("I tried but couldn't figure out which trade you meant")
+            return
     else:
         await ctx.send("I don't know what you're trying to do.")
         return
     # Find the open trade number
-    cur.execute("SELECT tp.tradenum, partner from tradeperson tp join trade t on t.tradenum = tp.tradenum"
-                " where tp.tradenum = ? and person = ? and (t.status is null or tp.rep is null)"
-                " order by t.start_time asc",
-                (trade_num, ctx.message.author.id))
-    row = cur.fetchone()
+    row = await self.db.run(fetch_one, TRADE_PARTNER, (trade_num, ctx.message.author.id))
     if row:
         trade_num, trade_who = row[0], row[1]
         if ctx.guild:
@@ -365,18 +410,10 @@ async def repmod(self, ctx, arg, mod):
             await ctx.send("This command doesn't work in PM")
             return
         if row[0]:
-            did_close = False
-            try:
-                cur.execute("update trade set status = 1, end_time = DateTime('now') where tradenum = {} and status is null"
-                            .format(trade_num))
-            except sqlite3.OperationalError as e:
-                await ctx.send("There's a problem right now: {}".format(e))
-                return
-            if cur.rowcount == 1:
-                did_close = True
+            with_bot = str(self.bot.user.id) == str(trade_who)
             try:
-                cur.execute("update tradeperson set rep = ?, rep_time = DateTime('now') where tradenum = ? and "
-                            "person = ? and partner = ?", (mod, trade_num, ctx.message.author.id, row[1]))
+                did_close = await self.db.run(rep_trade, trade_num, ctx.message.author.id, trade_who, mod,
+                                              mod_word, with_bot)
             except sqlite3.OperationalError as e:
                 await ctx.send("There's a problem right now: {}".format(e))
                 return
@@ -391,31 +428,123 @@ async def repmod(self, ctx, arg, mod):
             else:
                 await ctx.send("get_user_by_id failed, yell at someone! {} {} {}"
                                .format(ctx, trade_who, self))
-            try:
-                cur.execute("INSERT INTO tradelog (logtime, who, tradenum, what) values (DateTime('now'), ?, ?, ?)",
-                            (ctx.message.author.id, trade_num, "Author {} {} for trade {}".format(mod_word, partner.id, trade_num)))
-            except sqlite3.OperationalError as e:
-                await ctx.send("There's a problem right now: {}".format(e))
-                return
-            if self.bot.user.id == partner.id:
-                await keep_bot_in_check(ctx, trade_num, cur, partner.id)
+            if with_bot:
+                await ctx.send("Closed 🤖 end of trade")
         else:
             await ctx.send("I didn't find a trade matching that description which involved you")
     else:
         await ctx.send("I didn't find a trade matching that description which involved you")
 
 
-async def keep_bot_in_check(ctx, trade_num, cur, bot_id):
-    await ctx.send("Closed 🤖 end of trade")
+# Everything below that takes a connection runs on the database thread, and
+# each command's writes go in one transaction so they land together or not at all
+
+def fetch_one(con, query, params):
+    return con.execute(query, params).fetchone()
+
+
+def trade_pair(person, partner):
+    """The same key for a pair of people whichever of them is asking"""
+    return "-".join(sorted((str(person), str(partner))))
+
+
+def start_trade(con, author_id, partner_id):
+    """Opens a trade between two people and returns its number, or None if
+    they already have one open"""
     try:
-        cur.execute("update tradeperson set rep = ?, rep_time = DateTime('now') where tradenum = ? and "
-                    "person = ? and partner = ?", (0, trade_num, bot_id, ctx.message.author.id))
-        cur.execute("INSERT INTO tradelog (logtime, who, tradenum, what) values (DateTime('now'), ?, ?, ?)",
-                    (ctx.message.author.id, trade_num, "Author added 0 rep to self {} for bot trade {}".format(
-                        bot_id, trade_num)))
-    except sqlite3.OperationalError as e:
-        await ctx.send("There's a problem right now: {}".format(e))
-        return
+        with transaction(con):
+            cur = con.cursor()
+            cur.execute("INSERT INTO trade(initiator, start_time, pair) values (?, DateTime('now'), ?)",
+                        (author_id, trade_pair(author_id, partner_id)))
+            trade_num = cur.lastrowid
+            cur.execute("INSERT INTO tradeperson (tradenum, person, partner) values (?, ?, ?)",
+                        (trade_num, partner_id, author_id))
+            cur.execute("INSERT INTO tradeperson (tradenum, person, partner) values (?, ?, ?)",
+                        (trade_num, author_id, partner_id))
+            log_trade(con, author_id, trade_num, "Author initiated trade with {}".format(partner_id))
+            refresh_summary(con, author_id, partner_id)
+    except sqlite3.IntegrityError:
+        # trade_open_pair, they beat us to it
+        return None
+    return trade_num
+
+
+def cancel_trade(con, trade_num, author_id, partner_id):
+    """True if the trade was still open to cancel, False if the partner
+    closed it first"""
+    with transaction(con):
+        if con.execute("update trade set end_time = DateTime('now'), status = -1 where tradenum = ? "
+                       "and status is null", (trade_num,)).rowcount != 1:
+            return False
+        log_trade(con, author_id, trade_num, "Author cancelled trade {} with {}".format(trade_num, partner_id))
+        refresh_summary(con, author_id, partner_id)
+    return True
+
+
+def rep_trade(con, trade_num, author_id, partner_id, mod, mod_word, with_bot):
+    """Closes the author's end of a trade with their rep for the partner.
+    True if this closed the trade, False if it was already closed"""
+    with transaction(con):
+        did_close = con.execute("update trade set status = 1, end_time = DateTime('now') where tradenum = ? "
+                                "and status is null", (trade_num,)).rowcount == 1
+        set_rep(con, mod, trade_num, author_id, partner_id)
+        log_trade(con, author_id, trade_num, "Author {} {} for trade {}".format(mod_word, partner_id, trade_num))
+        if with_bot:
+            keep_bot_in_check(con, trade_num, partner_id, author_id)
+        refresh_summary(con, author_id, partner_id)
+    return did_close
+
+
+def keep_bot_in_check(con, trade_num, bot_id, author_id):
+    set_rep(con, 0, trade_num, bot_id, author_id)
+    log_trade(con, author_id, trade_num, "Author added 0 rep to self {} for bot trade {}".format(
+        bot_id, trade_num))
+
+
+def set_rep(con, mod, trade_num, person, partner):
+    con.execute("update tradeperson set rep = ?, rep_time = DateTime('now') where tradenum = ? and "
+                "person = ? and partner = ?", (mod, trade_num, person, partner))
+
+
+def log_trade(con, who, trade_num, what):
+    con.execute("INSERT INTO tradelog (logtime, who, tradenum, what) values (DateTime('now'), ?, ?, ?)",
+                (who, trade_num, what))
+
+
+def trade_to_rep(con, author_id, partner_id):
+    """The trade with a partner someone most likely means to rep"""
+    # First look to close a trade, then for an unrepped trade, then use the least recent started trade
+    for query in (OLDEST_OPEN_TRADE, OLDEST_UNREPPED_TRADE, OLDEST_CLOSED_TRADE):
+        row = con.execute(query, (author_id, partner_id)).fetchone()
+        if row and row[0]:
+            return row[0]
+    return None
+
+
+def report_rows(con, user_id):
+    """The summary and the ten most relevant partners of each kind a report shows"""
+    counts = con.execute(REPORT_SUMMARY, (str(user_id),)).fetchone() or (0, 0, 0, 0, 0, 0, None)
+    lists = {}
+    for kind, query, count in (("open", OPEN_PARTNERS, counts[2]), ("repped", REPPED_PARTNERS, counts[1]),
+                               ("unrepped", UNREPPED_PARTNERS, counts[3]),
+                               ("waiting", WAITING_PARTNERS, counts[4])):
+        lists[kind] = con.execute(query, (user_id,)).fetchmany(size=10) if count else []
+    return counts, lists
+
+
+def refresh_summary(con, *people):
+    """Brings the rep_summary rows of people whose trades just changed up to date"""
+    for person in people:
+        row = con.execute(REFRESH_SUMMARY, {"person": str(person)}).fetchone()
+        con.execute("INSERT OR REPLACE INTO rep_summary (" + SUMMARY_COLUMNS + ") "
+                    "values (?, ?, ?, ?, ?, ?, ?, ?)", row)
+
+
+def rebuild_summary(con):
+    """Replaces every rep_summary row, returns how many people have one"""
+    with transaction(con):
+        con.execute("DELETE FROM rep_summary")
+        return con.execute(REBUILD_SUMMARY).rowcount
 
 
 def check_folders():
@@ -424,26 +553,22 @@ def check_folders():
         os.makedirs("data/traderep")
 
 
-def check_files(file):
-    if os.path.exists(file):
-        con = sqlite3.connect(file)
-        cursor = con.cursor()
-        cursor.execute("select max(level) from version")
-        indb_version = cursor.fetchone()
-        if indb_version[0] < db_version:
-            db_upgrade(con, indb_version)
-    else:
-        con = sqlite3.connect(file)
-        con.isolation_level = None
+def check_database(con):
+    """Creates or upgrades the tables then checks the queries use indexes"""
+    cursor = con.cursor()
+    cursor.execute("SELECT count(*) FROM sqlite_master WHERE type = 'table' and name = 'version'")
+    if not cursor.fetchone()[0]:
         new_database(con)
+    db_upgrade(con)
+    for name in slow_queries(con):
+        print("Traderep query '{}' isn't using an index".format(name))
 
 
 def new_database(con):
     """Uses the database connection to create the tables needed"""
     cursor = con.cursor()
     cursor.execute("CREATE TABLE version (level real not null)")
-    print("Using database version: {}".format(db_version))
-    cursor.execute("INSERT INTO version values ({})".format(db_version))
+    cursor.execute("INSERT INTO version values (1.0)")
     cursor.execute("CREATE TABLE trade (tradenum integer primary key asc, initiator text, start_time text, "
                    "end_time text, status integer)")
     cursor.execute("CREATE TABLE tradeperson (tradenum integer, person text, partner text, rep integer, "
@@ -452,15 +577,38 @@ def new_database(con):
         "CREATE TABLE tradelog (logtime text, who integer, tradenum integer, what text)")
 
 
-def db_upgrade(con, old_version):
-    """Takes the old version and applies logic to get to the highest version"""
-    if old_version < 1.0:
-        cursor = con.cursor()
-        cursor.execute("DELETE FROM version where 1=1")
-        cursor.execute("INSERT INTO version values(1.0)")
-        cursor.execute("COMMIT TRANSACTION")
-        old_version = 1.0
-    # Note for future: create a new table, copy /change data to it, drop old table, create table, copy data
-    if old_version < db_version:
-        print("Database is at {} but don't know how to upgrade to {}".format(
-            old_version, db_version))
+def db_upgrade(con):
+    """Applies every migration newer than the database, in order"""
+    cursor = con.cursor()
+    cursor.execute("select max(level) from version")
+    old_version = cursor.fetchone()[0] or 0
+    for level, what, statements in MIGRATIONS:
+        if level <= old_version:
+            continue
+        with transaction(con):
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute("DELETE FROM version where 1=1")
+            cursor.execute("INSERT INTO version values (?)", (level,))
+        print("Upgraded traderep database to {}: {}".format(level, what))
+    print("Using database version: {}".format(max(old_version, db_version)))
+
+
+def query_plans(con):
+    """Yields the name and EXPLAIN QUERY PLAN lines of each hot query"""
+    cursor = con.cursor()
+    for name, query, params in HOT_QUERIES:
+        cursor.execute("EXPLAIN QUERY PLAN " + query, params)
+        yield name, [row[3] for row in cursor.fetchall()]
+
+
+def slow_queries(con):
+    """Names of the hot queries that would read a whole table or index,
+    or every trade with a status, which is most of them"""
+    return [name for name, plan in query_plans(con) if any(map(_slow_step, plan))]
+
+
+def _slow_step(step):
+    if step.startswith("SCAN "):
+        return step != "SCAN CONSTANT ROW"
+    return "INDEX trade_status " in step and "tradenum=" not in step and "person=" not in step
@@ -0,0 +1,142 @@
+import re
+import sqlite3
+import time
+
+from .storage import Database
+
+
+def fold_name(text):
+    """Lowercases and drops punctuation so "Heady-Topper" matches "heady topper" """
+    return " ".join(re.findall(r"\w+", str(text).replace("+", " ").lower()))
+
+
+class BeerIndex:
+    """A full text index of every beer the cog has seen in a beer/info or
+    search/beer response, by beer name, brewery name and style. A search
+    that names exactly one beer and its brewery can skip asking Untappd,
+    anything less certain still goes to the API. The index only knows
+    beers the bot has already seen, so a bare beer name is never enough.
+
+    The table is made on first use rather than with add_schema, so a
+    SQLite built without FTS5 only turns the index off instead of breaking
+    everything else in the database"""
+
+    SCHEMA = """
+        CREATE VIRTUAL TABLE IF NOT EXISTS beer_index USING fts5 (
+            beer_name,
+            brewery_name,
+            style,
+            homebrew UNINDEXED,
+            seen UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2');
+    """
+
+    def __init__(self, db: Database, candidates: int = 20):
+        self.db = db
+        self.candidates = candidates
+        self.local = 0
+        self.remote = 0
+        self.available = None  # Whether FTS5 works, None until first used
+
+    def _ready(self, con):
+        """Makes the table the first time through, on the database thread"""
+        if self.available is None:
+            try:
+                con.execute(self.SCHEMA)
+            except sqlite3.OperationalError as e:
+                if "no such module" not in str(e):
+                    raise
+                # Everything just goes to Untappd
+                self.available = False
+            else:
+                self.available = True
+        return self.available
+
+    def _write(self, con, rows):
+        if self._ready(con):
+            _index_write(con, rows)
+
+    def _search(self, con, match, homebrew, limit):
+        if not self._ready(con):
+            return None
+        return _index_search(con, match, homebrew, limit)
+
+    def _size(self, con):
+        return _index_size(con) if self._ready(con) else None
+
+    def add_beer(self, beer: dict):
+        """Indexes a beer/info response"""
+        if self.available is False:
+            return
+        brewery = beer.get("brewery") or {}
+        self.db.submit(self._write, [(
+            beer["bid"], beer.get("beer_name", ""), brewery.get("brewery_name", ""),
+            beer.get("beer_style", ""), int(bool(beer.get("is_homebrew"))), time.time()
+        )])
+
+    def add_search(self, items: list, homebrew: bool = False):
+        """Indexes the items of a search/beer section"""
+        if self.available is False:
+            return
+        now = time.time()
+        rows = [(item["beer"]["bid"], item["beer"].get("beer_name", ""),
+                 item.get("brewery", {}).get("brewery_name", ""),
+                 item["beer"].get("beer_style", ""), int(homebrew), now)
+                for item in items if "beer" in item]
+        if rows:
+            self.db.submit(self._write, rows)
+
+    async def find(self, query, homebrew: bool = False):
+        """The id of the one beer the query names, or None when the index
+        isn't sure. A beer is named when the query is its brewery's name
+        and its own, either way round, and no other beer in the index is
+        named that too"""
+        wanted = fold_name(query)
+        if not wanted or self.available is False:
+            return None
+        match = "{beer_name brewery_name} : (" + " ".join(
+            '"{!s}"'.format(word) for word in wanted.split()) + ")"
+        rows = await self.db.run(self._search, match, int(homebrew), self.candidates)
+        if rows is None:
+            return None
+        if len(rows) >= self.candidates:
+            # Too common to be sure no other beer has the same name
+            self.remote += 1
+            return None
+        named = set()
+        for bid, beer_name, brewery_name in rows:
+            beer_name, brewery_name = fold_name(beer_name), fold_name(brewery_name)
+            if brewery_name and wanted in ("{!s} {!s}".format(brewery_name, beer_name),
+                                           "{!s} {!s}".format(beer_name, brewery_name)):
+                named.add(bid)
+        if len(named) != 1:
+            self.remote += 1
+            return None
+        self.local += 1
+        return named.pop()
+
+    async def stats(self):
+        beers = await self.db.run(self._size)
+        if beers is None:
+            return "Beer index off, this SQLite has no FTS5"
+        lookups = self.local + self.remote
+        rate = (100.0 * self.local / lookups) if lookups else 0.0
+        return "{!s} beers, {!s} searches answered locally, {!s} by Untappd ({:.1f}%)".format(
+            beers, self.local, self.remote, rate
+        )
+
+
+def _index_write(con, rows):
+    # The beer id is the rowid so seeing a beer again replaces it
+    con.executemany("INSERT OR REPLACE INTO beer_index (rowid, beer_name, brewery_name, style, "
+                    "homebrew, seen) VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+
+def _index_search(con, match, homebrew, limit):
+    return con.execute("SELECT rowid, beer_name, brewery_name FROM beer_index "
+                       "WHERE beer_index MATCH ? AND homebrew = ? ORDER BY bm25(beer_index) LIMIT ?",
+                       (match, homebrew, limit)).fetchall()
+
+
+def _index_size(con):
+    return con.execute("SELECT count(*) FROM beer_index").fetchone()[0]
@@ -0,0 +1,139 @@
+from collections import OrderedDict
+import copy
+import time
+
+
+class TTLCache:
+    """Bounded mapping that forgets entries after a time to live and drops
+    the least recently used entry when it is full"""
+
+    def __init__(self, maxsize: int = 256, ttl: float = 600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (expires, value)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def get(self, key, default=None):
+        """Returns the cached value or default, counting the hit or miss"""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        if entry[0] <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value, ttl: float = None):
+        """Stores a value, evicting the least recently used entries if needed"""
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return default
+        return entry[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        """Returns a one line summary of the cache's effectiveness"""
+        lookups = self.hits + self.misses
+        rate = (100.0 * self.hits / lookups) if lookups else 0.0
+        return "{!s}/{!s} entries, ttl {!s}s, {!s} hits, {!s} misses ({:.1f}%)".format(
+            len(self._data), self.maxsize, int(self.ttl), self.hits, self.misses, rate
+        )
+
+
+def normalize_query(query):
+    """Folds the ways people type the same search into one string.
+    "Heady+Topper" and "heady  topper" are the same search"""
+    return " ".join(str(query).replace("+", " ").lower().split())
+
+
+# Fields of a beer/info response that depend on who asked. Everything else
+# is the same for every user and can be shared between them.
+PERSONAL_BEER_FIELDS = {"auth_rating": 0, "wish_list": False}
+PERSONAL_BEER_STATS = {"user_count": 0}
+
+
+class BeerCache:
+    """Caches beer/info responses, keeping the shared beer data apart from
+    the fields that belong to the user who made the request"""
+
+    def __init__(self, maxsize: int = 512, ttl: float = 1800, personal_ttl: float = 300):
+        self.shared = TTLCache(maxsize, ttl)
+        self.personal = TTLCache(maxsize * 4, personal_ttl)
+        self.hits = 0
+        self.misses = 0
+
+    def store(self, beer: dict, user_key=None):
+        """Caches a beer. user_key identifies the authorized user whose
+        rating and counts are in the response, None if nobody was"""
+        if not isinstance(beer, dict) or "bid" not in beer:
+            return
+        shared = copy.deepcopy(beer)
+        personal = {}
+        for field, default in PERSONAL_BEER_FIELDS.items():
+            personal[field] = shared.pop(field, default)
+        if isinstance(shared.get("stats"), dict):
+            personal["stats"] = {}
+            for field, default in PERSONAL_BEER_STATS.items():
+                personal["stats"][field] = shared["stats"].pop(field, default)
+        bid = int(beer["bid"])
+        self.shared.set(bid, shared)
+        if user_key is not None:
+            self.personal.set((bid, user_key), personal)
+
+    def get(self, beerid, user_key=None, personal: bool = True):
+        """Returns a copy of a cached beer or None. When personal is set and
+        user_key is given the user's own fields must be cached as well"""
+        bid = int(beerid)
+        shared = self.shared.get(bid)
+        overlay = None
+        if shared is not None and personal and user_key is not None:
+            overlay = self.personal.get((bid, user_key))
+            if overlay is None:
+                shared = None
+        if shared is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        beer = copy.deepcopy(shared)
+        beer.update(PERSONAL_BEER_FIELDS)
+        if isinstance(beer.get("stats"), dict):
+            beer["stats"].update(PERSONAL_BEER_STATS)
+        if overlay:
+            stats = overlay.get("stats")
+            beer.update({k: v for k, v in overlay.items() if k != "stats"})
+            if stats and isinstance(beer.get("stats"), dict):
+                beer["stats"].update(stats)
+        return beer
+
+    def clear(self):
+        self.shared.clear()
+        self.personal.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        rate = (100.0 * self.hits / lookups) if lookups else 0.0
+        return ("{!s} hits, {!s} misses ({:.1f}%)\n"
+                "Shared: {!s}\nPersonal: {!s}").format(
+            self.hits, self.misses, rate, self.shared.stats(), self.personal.stats()
+        )
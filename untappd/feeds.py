@@ -0,0 +1,131 @@
+import random
+import time
+
+from .storage import Database
+
+
+class Subscription:
+    """A member who wants their checkins posted in a guild's feed channel"""
+
+    __slots__ = ("guild_id", "user_id", "profile", "cursor", "interval", "next_poll")
+
+    def __init__(self, guild_id, user_id, profile, cursor=None, interval=0.0, next_poll=0.0):
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.profile = profile
+        self.cursor = cursor  # Newest checkin id seen, None until the first poll
+        self.interval = interval
+        self.next_poll = next_poll
+
+
+class Feeds:
+    """Everyone subscribed to checkin feeds, with when each is due to be
+    polled. People who check in often are polled more often, down to
+    min_interval, and quiet ones drift out to max_interval. Polls are at
+    least spacing seconds apart however many are due, which keeps them to
+    polls_per_hour and spreads them out instead of bunching them up"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS feed_subscriptions (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            profile TEXT NOT NULL,
+            cursor INTEGER,
+            interval REAL NOT NULL,
+            next_poll REAL NOT NULL,
+            PRIMARY KEY (guild_id, user_id));
+    """
+
+    def __init__(self, db: Database, min_interval: float = 300, max_interval: float = 21600,
+                 polls_per_hour: int = 30):
+        self.db = db
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.spacing = 3600.0 / polls_per_hour
+        self._subscriptions = {}  # (guild id, user id) -> Subscription
+        self.polls = 0
+        self.posted = 0
+        self.failed = 0
+        db.add_schema(self.SCHEMA)
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    async def load(self):
+        for row in await self.db.run(_feeds_read):
+            self._subscriptions.setdefault((row[0], row[1]), Subscription(*row))
+
+    def get(self, guild_id, user_id):
+        return self._subscriptions.get((guild_id, user_id))
+
+    def subscribe(self, guild_id, user_id, profile):
+        """Starts or updates a subscription. The first poll only finds
+        where the feed starts so nothing old gets posted"""
+        subscription = self._subscriptions.get((guild_id, user_id))
+        if subscription is None or subscription.profile != profile:
+            # Spread new subscriptions out rather than polling them all at once
+            subscription = Subscription(guild_id, user_id, profile, None, self.min_interval,
+                                        time.time() + random.uniform(0, self.min_interval))
+            self._subscriptions[(guild_id, user_id)] = subscription
+            self._save(subscription)
+        return subscription
+
+    def unsubscribe(self, guild_id, user_id):
+        if self._subscriptions.pop((guild_id, user_id), None) is None:
+            return False
+        self.db.submit(_feeds_delete, guild_id, user_id)
+        return True
+
+    def next_due(self):
+        """The subscription that is due soonest, or None"""
+        if not self._subscriptions:
+            return None
+        return min(self._subscriptions.values(), key=lambda subscription: subscription.next_poll)
+
+    def polled(self, subscription: Subscription, cursor, found):
+        """Schedules a subscription's next poll. found is how many new
+        checkins turned up, None if the poll failed"""
+        self.polls += 1
+        if found is None:
+            self.failed += 1
+            interval = subscription.interval * 2
+        elif found:
+            self.posted += found
+            interval = subscription.interval / 2
+        else:
+            interval = subscription.interval * 1.5
+        subscription.interval = min(self.max_interval, max(self.min_interval, interval))
+        # A little jitter keeps polls that were due together from staying together
+        subscription.next_poll = time.time() + subscription.interval * random.uniform(0.9, 1.1)
+        if cursor is not None:
+            subscription.cursor = cursor
+        if self._subscriptions.get((subscription.guild_id, subscription.user_id)) is subscription:
+            self._save(subscription)
+
+    def _save(self, subscription):
+        self.db.submit(_feeds_write, subscription.guild_id, subscription.user_id, subscription.profile,
+                       subscription.cursor, subscription.interval, subscription.next_poll)
+
+    def stats(self):
+        due = ""
+        upcoming = self.next_due()
+        if upcoming is not None:
+            due = ", next poll in {!s}s".format(max(0, int(upcoming.next_poll - time.time())))
+        return "{!s} subscribed{!s}, {!s} polls, {!s} checkins posted, {!s} failed polls".format(
+            len(self._subscriptions), due, self.polls, self.posted, self.failed
+        )
+
+
+def _feeds_read(con):
+    return con.execute("SELECT guild_id, user_id, profile, cursor, interval, next_poll "
+                       "FROM feed_subscriptions").fetchall()
+
+
+def _feeds_write(con, guild_id, user_id, profile, cursor, interval, next_poll):
+    con.execute("INSERT OR REPLACE INTO feed_subscriptions (guild_id, user_id, profile, cursor, "
+                "interval, next_poll) VALUES (?, ?, ?, ?, ?, ?)",
+                (guild_id, user_id, profile, cursor, interval, next_poll))
+
+
+def _feeds_delete(con, guild_id, user_id):
+    con.execute("DELETE FROM feed_subscriptions WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
@@ -0,0 +1,225 @@
+from datetime import datetime
+import json
+import time
+import zlib
+
+from .storage import Database
+
+
+class HistoryRange:
+    """The run of a user's checkins the mirror holds without gaps, as seen
+    by one viewer"""
+
+    __slots__ = ("username", "owner", "own", "newest", "oldest", "complete", "synced")
+
+    def __init__(self, username, owner=0, own=False, newest=0, oldest=0, complete=False, synced=0.0):
+        self.username = username
+        self.owner = owner  # The Discord user whose token reads it, 0 for no token
+        self.own = bool(own)  # They're the owner's own checkins
+        self.newest = newest
+        self.oldest = oldest
+        self.complete = bool(complete)  # oldest is their first checkin
+        self.synced = synced  # When newest was last checked against Untappd
+
+
+class CheckinHistory:
+    """A copy of people's Untappd checkins, filled from the user/checkins
+    pages the cog fetches anyway plus a slow backfill for people who
+    authorized the bot. For each user it knows which run of checkins it
+    holds without gaps, so a page can be served from here whenever it
+    falls inside that run, and a delta fetch by min_id keeps the top of it
+    current.
+
+    A token can see profiles that are hidden from everyone else, so runs
+    are kept per owner of the token that read them and only ever served
+    back to that owner. Pages read without a token are owner 0 and are
+    served to anyone who has no token either"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS checkin_history (
+            checkin_id INTEGER PRIMARY KEY,
+            username TEXT NOT NULL COLLATE NOCASE,
+            bid INTEGER NOT NULL,
+            created REAL NOT NULL,
+            rating REAL,
+            body BLOB NOT NULL);
+        CREATE INDEX IF NOT EXISTS checkin_history_user ON checkin_history (username, checkin_id);
+        CREATE INDEX IF NOT EXISTS checkin_history_beer ON checkin_history (username, bid);
+        CREATE INDEX IF NOT EXISTS checkin_history_created ON checkin_history (username, created);
+        CREATE TABLE IF NOT EXISTS checkin_history_runs (
+            username TEXT NOT NULL COLLATE NOCASE,
+            owner INTEGER NOT NULL,
+            own INTEGER NOT NULL,
+            newest INTEGER NOT NULL,
+            oldest INTEGER NOT NULL,
+            complete INTEGER NOT NULL,
+            synced REAL NOT NULL,
+            PRIMARY KEY (username, owner));
+    """
+
+    def __init__(self, db: Database, fresh: float = 120):
+        self.db = db
+        self.fresh = fresh
+        self._ranges = {}  # (lowercased username, owner) -> HistoryRange
+        self.local = 0
+        db.add_schema(self.SCHEMA)
+
+    async def load(self):
+        for row in await self.db.run(_ranges_read):
+            self._ranges.setdefault((row[0].lower(), row[1]), HistoryRange(*row))
+
+    def range(self, username, owner=0):
+        return self._ranges.get((str(username).lower(), owner))
+
+    def range_for(self, user_id):
+        """The range of a Discord user's own checkins, read with their token"""
+        for history in self._ranges.values():
+            if history.owner == user_id and history.own:
+                return history
+        return None
+
+    def is_fresh(self, history: HistoryRange):
+        return history.synced >= time.time() - self.fresh
+
+    def record_page(self, username, items: list, min_id=None, max_id=None, limit: int = 25,
+                    owner=0, own=False):
+        """Folds a page of user/checkins into the mirror. min_id and max_id
+        are what the page was asked for, limit is how many it could hold and
+        owner is who the token that read it belongs to, 0 for none. own says
+        the page was asked for by the token alone, so it's the owner's own"""
+        key = (str(username).lower(), owner)
+        history = self._ranges.get(key)
+        ids = [checkin["checkin_id"] for checkin in items]
+        top = max(ids) if ids else None
+        bottom = min(ids) if ids else None
+        more = len(items) >= limit  # There could be more past the end of the page
+        now = time.time()
+
+        if max_id is not None:
+            # An older page only extends the run if it starts where the run ends
+            if history is not None and history.oldest - 1 <= int(max_id) <= history.oldest:
+                if bottom is not None:
+                    history.oldest = min(history.oldest, bottom)
+                history.complete = not more
+            else:
+                history = None
+        elif min_id is not None:
+            if history is None:
+                if ids:
+                    history = self._restart(key, username, top, bottom, False, now)
+            elif (not more and int(min_id) <= history.newest) or (ids and bottom <= history.newest):
+                # Everything since the top of the run is here
+                history.newest = max(history.newest, top or 0)
+                history.synced = now
+            elif int(min_id) == history.newest:
+                # More checkins than fit on a page since last time, start over from the top
+                history = self._restart(key, username, top, bottom, False, now)
+        elif history is not None and bottom is not None and bottom <= history.newest:
+            # The first page overlaps what's here
+            history.newest = max(history.newest, top)
+            history.synced = now
+            if not more:
+                history.oldest, history.complete = bottom, True
+        else:
+            history = self._restart(key, username, top, bottom, not more, now)
+
+        rows = [_row(key[0], checkin) for checkin in items]
+        if history is not None:
+            history.own = history.own or own
+            self.db.submit(_history_write, rows, _range_row(history))
+        elif items:
+            self.db.submit(_history_write, rows, None)
+        return history
+
+    def _restart(self, key, username, top, bottom, complete, now):
+        history = HistoryRange(str(username), key[1], False, top or 0, bottom or 0, complete, now)
+        self._ranges[key] = history
+        return history
+
+    async def recent(self, username, count: int, max_id=None, owner=0):
+        """Up to count checkins, newest first, from max_id down, as owner
+        would see them. None when the mirror can't say for sure what they are"""
+        history = self.range(username, owner)
+        if history is None:
+            return None
+        top = history.newest if max_id is None else min(int(max_id), history.newest)
+        bodies = await self.db.run(_history_recent, history.username, top, history.oldest, count)
+        if len(bodies) < count and not history.complete:
+            return None
+        self.local += 1
+        return [json.loads(zlib.decompress(body)) for body in bodies]
+
+    async def had(self, history: HistoryRange, bid):
+        """(times had, latest rating) for a beer from a complete history"""
+        if not history.complete:
+            return None
+        self.local += 1
+        return await self.db.run(_history_had, history.username, int(bid))
+
+    def forget(self, user_id):
+        """Drops everything read with someone's token, ie. when they unauth"""
+        for key in [key for key in self._ranges if key[1] == user_id]:
+            del self._ranges[key]
+        self.db.submit(_ranges_forget, user_id)
+
+    async def stats(self):
+        checkins = await self.db.run(_history_size)
+        complete = sum(1 for history in self._ranges.values() if history.complete)
+        return "{!s} checkins from {!s} people ({!s} complete), {!s} answered locally".format(
+            checkins, len(self._ranges), complete, self.local
+        )
+
+
+def _range_row(history):
+    return (history.username.lower(), history.owner, int(history.own), history.newest,
+            history.oldest, int(history.complete), history.synced)
+
+
+def _row(username, checkin):
+    try:
+        created = datetime.strptime(checkin["created_at"], "%a, %d %b %Y %H:%M:%S %z").timestamp()
+    except (KeyError, ValueError):
+        created = 0.0
+    body = zlib.compress(json.dumps(checkin, separators=(",", ":")).encode())
+    return (checkin["checkin_id"], username, checkin["beer"]["bid"], created,
+            checkin.get("rating_score") or None, body)
+
+
+def _history_write(con, rows, history):
+    con.executemany("INSERT OR REPLACE INTO checkin_history (checkin_id, username, bid, created, "
+                    "rating, body) VALUES (?, ?, ?, ?, ?, ?)", rows)
+    if history is not None:
+        _range_write(con, history)
+
+
+def _range_write(con, history):
+    con.execute("INSERT OR REPLACE INTO checkin_history_runs (username, owner, own, newest, oldest, "
+                "complete, synced) VALUES (?, ?, ?, ?, ?, ?, ?)", history)
+
+
+def _ranges_read(con):
+    return con.execute("SELECT username, owner, own, newest, oldest, complete, synced "
+                       "FROM checkin_history_runs").fetchall()
+
+
+def _ranges_forget(con, owner):
+    con.execute("DELETE FROM checkin_history_runs WHERE owner = ?", (owner,))
+
+
+def _history_recent(con, username, top, bottom, count):
+    return [row[0] for row in con.execute(
+        "SELECT body FROM checkin_history WHERE username = ? AND checkin_id <= ? AND checkin_id >= ? "
+        "ORDER BY checkin_id DESC LIMIT ?", (username, top, bottom, count))]
+
+
+def _history_had(con, username, bid):
+    count = con.execute("SELECT count(*) FROM checkin_history WHERE username = ? AND bid = ?",
+                        (username, bid)).fetchone()[0]
+    rating = con.execute("SELECT rating FROM checkin_history WHERE username = ? AND bid = ? "
+                         "AND rating IS NOT NULL ORDER BY checkin_id DESC LIMIT 1",
+                         (username, bid)).fetchone()
+    return count, rating[0] if rating else 0
+
+
+def _history_size(con):
+    return con.execute("SELECT count(*) FROM checkin_history").fetchone()[0]
@@ -0,0 +1,243 @@
+import time
+
+from .storage import Database
+
+
+class ProjectLedger:
+    """A local copy of what each guild's drinking project knows, built
+    from the answers to the submissions the cog delivers. It holds who
+    drank and found which beers plus the last points and counts the sheet
+    gave for each person, so ddpstats and whodrank don't need the sheet.
+
+    The points are the sheet's to work out, so a status is only ever a
+    copy of its last answer. An accepted action that comes back without
+    one drops the copy until the sheet is asked again. The sheet can also
+    change behind the cog's back, so a status is only used while it's
+    fresh and a beer's drinkers only once the sheet's own list for it has
+    been folded in"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS project_ledger (
+            guild_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            username TEXT NOT NULL COLLATE NOCASE,
+            bid INTEGER NOT NULL,
+            checkin_id INTEGER NOT NULL,
+            brewery_id INTEGER,
+            added REAL NOT NULL,
+            PRIMARY KEY (guild_id, kind, username, bid, checkin_id));
+        CREATE INDEX IF NOT EXISTS project_ledger_username ON project_ledger (guild_id, username);
+        CREATE INDEX IF NOT EXISTS project_ledger_bid ON project_ledger (guild_id, bid);
+        CREATE INDEX IF NOT EXISTS project_ledger_brewery ON project_ledger (guild_id, brewery_id);
+        CREATE INDEX IF NOT EXISTS project_ledger_checkin ON project_ledger (guild_id, checkin_id);
+        CREATE TABLE IF NOT EXISTS project_status (
+            guild_id INTEGER NOT NULL,
+            username TEXT NOT NULL COLLATE NOCASE,
+            points NUMERIC NOT NULL,
+            checkins INTEGER NOT NULL,
+            found INTEGER NOT NULL,
+            updated REAL NOT NULL,
+            used REAL NOT NULL,
+            PRIMARY KEY (guild_id, username));
+        CREATE INDEX IF NOT EXISTS project_status_updated ON project_status (updated);
+        CREATE TABLE IF NOT EXISTS project_synced (
+            guild_id INTEGER NOT NULL,
+            bid INTEGER NOT NULL,
+            synced REAL NOT NULL,
+            PRIMARY KEY (guild_id, bid));
+    """
+
+    def __init__(self, db: Database, max_age: float = 21600):
+        self.db = db
+        self.max_age = max_age
+        self.local = 0
+        self.remote = 0
+        self.corrected = 0
+        db.add_schema(self.SCHEMA)
+
+    def record(self, guild_id, payload: dict, answer: dict):
+        """Mirrors a submission the project accepted"""
+        if answer.get("result") != "success":
+            return
+        action = payload["action"]
+        now = time.time()
+        username = payload.get("username") or answer.get("username")
+        stats = _answer_stats(answer)
+        if action == "undrank":
+            # Whose checkin it was is only known from the ledger
+            self.db.submit(_ledger_undrank, guild_id, int(payload["checkin"]), username, stats, now)
+            return
+        if action == "drank":
+            self.db.submit(_ledger_drank, guild_id, payload["username"], int(payload["bid"]),
+                           int(payload["checkin"]), payload["brewery_id"], now)
+        elif action == "found":
+            self.db.submit(_ledger_found, guild_id, payload["username"], int(payload["bid"]),
+                           payload["brewery_id"], now)
+        elif action == "unfind":
+            self.db.submit(_ledger_unfind, guild_id, payload["username"], int(payload["beerid"]))
+        if username:
+            self.db.submit(_status_update, guild_id, username, stats, now)
+
+    def set_status(self, guild_id, username, answer: dict):
+        """Stores the points and counts from a project answer with hasStats"""
+        self.db.submit(_status_update, guild_id, username, _answer_stats(answer), time.time())
+
+    async def status(self, guild_id, username):
+        """(points, checkins, found) for a person if the sheet gave them
+        recently enough, otherwise None"""
+        row = await self.db.run(_status_read, guild_id, username, time.time())
+        if row is None or row[3] < time.time() - self.max_age:
+            self.remote += 1
+            return None
+        self.local += 1
+        return row[:3]
+
+    async def drinkers(self, guild_id, bid):
+        """Who added a beer, None if the sheet's list for it isn't fresh"""
+        names = await self.db.run(_drinkers_read, guild_id, int(bid), time.time() - self.max_age)
+        if names is None:
+            self.remote += 1
+        else:
+            self.local += 1
+        return names
+
+    def sync_drinkers(self, guild_id, bid, names: list):
+        """Folds in the sheet's own list of who added a beer"""
+        self.db.submit(_drinkers_write, guild_id, int(bid), names, time.time())
+
+    async def stale(self, limit: int = 10, active: float = 30 * 86400):
+        """(guild, username) pairs whose status is due a check with the
+        sheet, for people who used the project in the last active seconds"""
+        now = time.time()
+        return await self.db.run(_status_stale, now - self.max_age / 2, now - active, limit)
+
+    async def reconcile(self, guild_id, username, answer: dict):
+        """Replaces a status with the sheet's, counting it if they differed"""
+        if await self.db.run(_status_reconcile, guild_id, username, answer["points"],
+                             answer["checkins"], answer["found"], time.time()):
+            self.corrected += 1
+
+    def forget(self, guild_id):
+        """Drops a guild's copy, ie. when it moves to a new project"""
+        self.db.submit(_ledger_forget, guild_id)
+
+    async def stats(self):
+        rows, people = await self.db.run(_ledger_size)
+        lookups = self.local + self.remote
+        rate = (100.0 * self.local / lookups) if lookups else 0.0
+        return ("{!s} actions, {!s} people, {!s} answered locally, {!s} from the sheet ({:.1f}%), "
+                "{!s} corrected").format(rows, people, self.local, self.remote, rate, self.corrected)
+
+
+def _ledger_drank(con, guild_id, username, bid, checkin_id, brewery_id, now):
+    con.execute("INSERT OR REPLACE INTO project_ledger (guild_id, kind, username, bid, checkin_id, "
+                "brewery_id, added) VALUES (?, 'drank', ?, ?, ?, ?, ?)",
+                (guild_id, username, bid, checkin_id, brewery_id, now))
+    # A drinker learned from the sheet's list now has a checkin to go with it
+    con.execute("DELETE FROM project_ledger WHERE guild_id = ? AND kind = 'drank' AND username = ? "
+                "AND bid = ? AND checkin_id = 0", (guild_id, username, bid))
+
+
+def _answer_stats(answer):
+    """(points, checkins, found) from a project answer, None if it has none"""
+    if "hasStats" not in answer:
+        return None
+    return answer["points"], answer["checkins"], answer["found"]
+
+
+def _ledger_undrank(con, guild_id, checkin_id, username, stats, now):
+    names = [row[0] for row in con.execute(
+        "SELECT DISTINCT username FROM project_ledger WHERE guild_id = ? AND checkin_id = ? "
+        "AND kind = 'drank'", (guild_id, checkin_id))]
+    con.execute("DELETE FROM project_ledger WHERE guild_id = ? AND checkin_id = ? AND kind = 'drank'",
+                (guild_id, checkin_id))
+    for name in names or ([username] if username else []):
+        _status_update(con, guild_id, name, stats, now)
+
+
+def _ledger_found(con, guild_id, username, bid, brewery_id, now):
+    con.execute("INSERT OR REPLACE INTO project_ledger (guild_id, kind, username, bid, checkin_id, "
+                "brewery_id, added) VALUES (?, 'found', ?, ?, 0, ?, ?)",
+                (guild_id, username, bid, brewery_id, now))
+
+
+def _ledger_unfind(con, guild_id, username, bid):
+    con.execute("DELETE FROM project_ledger WHERE guild_id = ? AND kind = 'found' AND username = ? "
+                "AND bid = ?", (guild_id, username, bid))
+
+
+def _status_update(con, guild_id, username, stats, now):
+    if stats is None:
+        # The action changed their points but the sheet didn't say to what
+        con.execute("DELETE FROM project_status WHERE guild_id = ? AND username = ?",
+                    (guild_id, username))
+    else:
+        _status_write(con, guild_id, username, *stats, now)
+
+
+def _status_write(con, guild_id, username, points, checkins, found, now):
+    con.execute("INSERT OR REPLACE INTO project_status (guild_id, username, points, checkins, found, "
+                "updated, used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (guild_id, username, points, checkins, found, now, now))
+
+
+def _status_read(con, guild_id, username, now):
+    row = con.execute("SELECT points, checkins, found, updated FROM project_status "
+                      "WHERE guild_id = ? AND username = ?", (guild_id, username)).fetchone()
+    if row is not None:
+        con.execute("UPDATE project_status SET used = ? WHERE guild_id = ? AND username = ?",
+                    (now, guild_id, username))
+    return row
+
+
+def _status_stale(con, updated_before, used_after, limit):
+    return con.execute("SELECT guild_id, username FROM project_status WHERE updated < ? AND used > ? "
+                       "ORDER BY updated LIMIT ?", (updated_before, used_after, limit)).fetchall()
+
+
+def _status_reconcile(con, guild_id, username, points, checkins, found, now):
+    row = con.execute("SELECT points, checkins, found FROM project_status "
+                      "WHERE guild_id = ? AND username = ?", (guild_id, username)).fetchone()
+    con.execute("UPDATE project_status SET points = ?, checkins = ?, found = ?, updated = ? "
+                "WHERE guild_id = ? AND username = ?",
+                (points, checkins, found, now, guild_id, username))
+    return row is not None and tuple(row) != (points, checkins, found)
+
+
+def _drinkers_read(con, guild_id, bid, synced_after):
+    synced = con.execute("SELECT synced FROM project_synced WHERE guild_id = ? AND bid = ?",
+                         (guild_id, bid)).fetchone()
+    if synced is None or synced[0] < synced_after:
+        return None
+    rows = con.execute("SELECT DISTINCT username FROM project_ledger "
+                       "WHERE guild_id = ? AND bid = ? AND kind = 'drank' ORDER BY added",
+                       (guild_id, bid)).fetchall()
+    return [row[0] for row in rows]
+
+
+def _drinkers_write(con, guild_id, bid, names, now):
+    # The sheet's list wins, anyone it doesn't have is dropped
+    known = set()
+    for username, in con.execute("SELECT DISTINCT username FROM project_ledger "
+                                 "WHERE guild_id = ? AND bid = ? AND kind = 'drank'", (guild_id, bid)):
+        if username.lower() in {name.lower() for name in names}:
+            known.add(username.lower())
+        else:
+            con.execute("DELETE FROM project_ledger WHERE guild_id = ? AND bid = ? AND kind = 'drank' "
+                        "AND username = ?", (guild_id, bid, username))
+    con.executemany("INSERT OR IGNORE INTO project_ledger (guild_id, kind, username, bid, checkin_id, "
+                    "brewery_id, added) VALUES (?, 'drank', ?, ?, 0, NULL, ?)",
+                    [(guild_id, name, bid, now) for name in names if name.lower() not in known])
+    con.execute("INSERT OR REPLACE INTO project_synced (guild_id, bid, synced) VALUES (?, ?, ?)",
+                (guild_id, bid, now))
+
+
+def _ledger_forget(con, guild_id):
+    for table in ("project_ledger", "project_status", "project_synced"):
+        con.execute("DELETE FROM {!s} WHERE guild_id = ?".format(table), (guild_id,))
+
+
+def _ledger_size(con):
+    rows = con.execute("SELECT count(*) FROM project_ledger").fetchone()[0]
+    people = con.execute("SELECT count(*) FROM project_status").fetchone()[0]
+    return rows, people
@@ -0,0 +1,102 @@
+import asyncio
+import math
+
+
+class Menu:
+    """One open reaction menu"""
+
+    __slots__ = ("message_id", "author_id", "choices", "future", "rounds")
+
+    def __init__(self, message_id, author_id, choices, future, rounds):
+        self.message_id = message_id
+        self.author_id = author_id
+        self.choices = choices  # emoji -> position in the menu
+        self.future = future
+        self.rounds = rounds  # laps of the wheel left before it expires
+
+
+class MenuRegistry:
+    """Every open reaction menu, keyed by the id of the message it's on.
+    The reaction listener hands each reaction to dispatch, which finds its
+    menu with one dict lookup, and a single timer wheel expires all of the
+    menus instead of each one waiting on its own timeout"""
+
+    def __init__(self, tick: float = 1.0, slots: int = 64):
+        self.tick = tick
+        self._menus = {}  # message id -> Menu
+        self._wheel = [set() for _ in range(slots)]  # menus by expiry slot
+        self._cursor = 0
+        self._ticker = None
+        self.picked = 0
+        self.expired = 0
+
+    def __len__(self):
+        return len(self._menus)
+
+    def open(self, message_id, author_id, emoji: list, timeout: float):
+        """Starts listening for author_id to pick one of emoji on a message.
+        Returns a future with the position of the pick, or None if nothing
+        was picked in time"""
+        self.close(message_id)
+        future = asyncio.get_running_loop().create_future()
+        ticks = max(1, math.ceil(timeout / self.tick))
+        rounds, offset = divmod(ticks, len(self._wheel))
+        if not offset:
+            rounds, offset = rounds - 1, len(self._wheel)
+        menu = Menu(message_id, author_id, {e: n for n, e in enumerate(emoji)}, future, rounds)
+        self._menus[message_id] = menu
+        self._wheel[(self._cursor + offset) % len(self._wheel)].add(menu)
+        if self._ticker is None or self._ticker.done():
+            self._ticker = asyncio.create_task(self._turn())
+        return future
+
+    def close(self, message_id):
+        """Stops listening on a message without an answer"""
+        menu = self._menus.pop(message_id, None)
+        if menu is not None and not menu.future.done():
+            menu.future.set_result(None)
+
+    def dispatch(self, message_id, user_id, emoji: str) -> bool:
+        """Feeds a reaction to the menu on its message. Returns whether the
+        reaction was on a menu at all"""
+        menu = self._menus.get(message_id)
+        if menu is None:
+            return False
+        if user_id != menu.author_id or emoji not in menu.choices:
+            return True
+        del self._menus[message_id]
+        if not menu.future.done():
+            menu.future.set_result(menu.choices[emoji])
+        self.picked += 1
+        return True
+
+    async def _turn(self):
+        # Slots still hold menus that were picked or closed, they are just
+        # dropped when their slot comes round
+        while self._menus:
+            await asyncio.sleep(self.tick)
+            self._cursor = (self._cursor + 1) % len(self._wheel)
+            slot = self._wheel[self._cursor]
+            for menu in list(slot):
+                is_open = self._menus.get(menu.message_id) is menu
+                if is_open and menu.rounds > 0:
+                    menu.rounds -= 1
+                    continue
+                slot.discard(menu)
+                if is_open:
+                    self.expired += 1
+                    self.close(menu.message_id)
+        for slot in self._wheel:
+            slot.clear()
+
+    def stop(self):
+        """Closes every menu"""
+        if self._ticker is not None:
+            self._ticker.cancel()
+        for message_id in list(self._menus):
+            self.close(message_id)
+
+    def stats(self):
+        return "{!s} open, {!s} picked, {!s} timed out".format(
+            len(self._menus), self.picked, self.expired
+        )
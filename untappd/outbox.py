@@ -0,0 +1,230 @@
+import asyncio
+from collections import OrderedDict
+import json
+import time
+
+from .storage import Database
+
+
+class Submission:
+    """One drinking project submission waiting to be delivered"""
+
+    __slots__ = ("id", "user_id", "channel_id", "message_id", "url", "payload",
+                 "attempts", "next_try", "created", "on_settle")
+
+    def __init__(self, id_, user_id, channel_id, message_id, url, payload,
+                 attempts=0, next_try=0.0, created=0.0):
+        self.id = id_
+        self.user_id = user_id
+        self.channel_id = channel_id
+        self.message_id = message_id  # The acknowledgement to edit with the result
+        self.url = url
+        self.payload = payload
+        self.attempts = attempts
+        self.next_try = next_try
+        self.created = created
+        self.on_settle = None  # Reports this one instead of the outbox's settle
+
+
+class Outbox:
+    """Drinking project submissions are written here before anyone is told
+    they were received, then delivered by a few background workers. Each
+    person's submissions go out one at a time in the order they were made,
+    failed deliveries are retried with backoff and anything still waiting
+    at unload is picked up again on the next load.
+
+    post(url, payload) returns the project's answer or None to try again
+    settle(submission, answer) reports an answer, None when it never came"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            message_id INTEGER,
+            url TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_try REAL NOT NULL,
+            created REAL NOT NULL);
+    """
+
+    def __init__(self, db: Database, post, settle, workers: int = 2, retries: int = 8,
+                 backoff: float = 5.0, max_backoff: float = 600.0):
+        self.db = db
+        self._post = post
+        self._settle = settle
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._entries = OrderedDict()  # id -> Submission, oldest first
+        self._busy = set()  # users with a delivery running
+        self._claimed = set()  # ids stored by add but not passed to send yet
+        self._loaded = False  # nothing goes out until what was left over is queued
+        self._wake = None
+        self._runner = None
+        self._tasks = set()
+        self.delivered = 0
+        self.failed = 0
+        self.retried = 0
+        db.add_schema(self.SCHEMA)
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def add(self, user_id, channel_id, url, payload: dict) -> Submission:
+        """Stores a submission. Nothing is sent until it's passed to send"""
+        now = time.time()
+        entry_id = await self.db.run(_outbox_insert, user_id, channel_id, url,
+                                     json.dumps(payload), now)
+        self._claimed.add(entry_id)
+        return Submission(entry_id, user_id, channel_id, None, url, payload,
+                          next_try=now, created=now)
+
+    async def add_many(self, user_id, channel_id, url, payloads: list) -> list:
+        """add for a lot of submissions at once, in one transaction"""
+        now = time.time()
+        ids = await self.db.run(_outbox_insert_many, user_id, channel_id, url,
+                                [json.dumps(payload) for payload in payloads], now)
+        self._claimed.update(ids)
+        return [Submission(entry_id, user_id, channel_id, None, url, payload,
+                           next_try=now, created=now)
+                for entry_id, payload in zip(ids, payloads)]
+
+    def send(self, entry: Submission, message_id=None, on_settle=None):
+        """Queues a stored submission, message_id is the acknowledgement that
+        gets the result. on_settle(submission, answer) reports it instead of
+        the usual settle, as long as the cog isn't reloaded before then"""
+        if message_id:
+            entry.message_id = message_id
+            self.db.submit(_outbox_set_message, entry.id, message_id)
+        entry.on_settle = on_settle
+        self._claimed.discard(entry.id)
+        self._entries[entry.id] = entry
+        if self._wake is not None:
+            self._wake.set()
+
+    async def load(self):
+        """Queues whatever was still waiting when the cog was unloaded.
+        Deliveries wait for this so older submissions go first"""
+        try:
+            for row in await self.db.run(_outbox_read):
+                # Rows stored since the cog loaded are queued by their own send
+                if row[0] in self._claimed or row[0] in self._entries:
+                    continue
+                self._entries[row[0]] = Submission(row[0], row[1], row[2], row[3], row[4],
+                                                   json.loads(row[5]), row[6], row[7], row[8])
+            self._entries = OrderedDict(sorted(self._entries.items()))
+        finally:
+            self._loaded = True
+            if self._wake is not None:
+                self._wake.set()
+
+    def start(self):
+        self._wake = asyncio.Event()
+        self._runner = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops delivering. Undelivered submissions stay on disk"""
+        tasks = list(self._tasks)
+        if self._runner is not None:
+            tasks.append(self._runner)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            if not self._loaded:
+                await self._wake.wait()
+                continue
+            now = time.time()
+            next_try = None
+            seen = set()
+            for entry in list(self._entries.values()):
+                # Only someone's oldest submission can go, which keeps theirs in order
+                if entry.user_id in seen:
+                    continue
+                seen.add(entry.user_id)
+                if entry.user_id in self._busy:
+                    continue
+                if len(self._busy) >= self.workers:
+                    break
+                if entry.next_try > now:
+                    next_try = entry.next_try if next_try is None else min(next_try, entry.next_try)
+                    continue
+                self._busy.add(entry.user_id)
+                task = asyncio.create_task(self._deliver(entry))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            timeout = None if next_try is None else max(0.0, next_try - now)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, entry: Submission):
+        try:
+            try:
+                answer = await self._post(entry.url, entry.payload)
+            except Exception:  # pylint: disable=broad-except
+                answer = None
+            entry.attempts += 1
+            if answer is None and entry.attempts < self.retries:
+                self.retried += 1
+                entry.next_try = time.time() + min(self.max_backoff,
+                                                   self.backoff * 2 ** (entry.attempts - 1))
+                self.db.submit(_outbox_retry, entry.id, entry.attempts, entry.next_try)
+                return
+            del self._entries[entry.id]
+            self.db.submit(_outbox_delete, entry.id)
+            if answer is None:
+                self.failed += 1
+            else:
+                self.delivered += 1
+            try:
+                await (entry.on_settle or self._settle)(entry, answer)
+            except Exception:  # pylint: disable=broad-except
+                pass
+        finally:
+            self._busy.discard(entry.user_id)
+            self._wake.set()
+
+    def stats(self):
+        oldest = ""
+        if self._entries:
+            first = next(iter(self._entries.values()))
+            oldest = ", oldest waiting {!s}s".format(int(time.time() - first.created))
+        return ("{!s} waiting from {!s} people{!s}, {!s} delivered, {!s} retries, "
+                "{!s} given up on").format(
+            len(self._entries), len({e.user_id for e in self._entries.values()}), oldest,
+            self.delivered, self.retried, self.failed
+        )
+
+
+def _outbox_insert(con, user_id, channel_id, url, payload, now):
+    return con.execute("INSERT INTO outbox (user_id, channel_id, url, payload, next_try, created) "
+                       "VALUES (?, ?, ?, ?, ?, ?)", (user_id, channel_id, url, payload, now, now)).lastrowid
+
+
+def _outbox_insert_many(con, user_id, channel_id, url, payloads, now):
+    return [_outbox_insert(con, user_id, channel_id, url, payload, now) for payload in payloads]
+
+
+def _outbox_set_message(con, entry_id, message_id):
+    con.execute("UPDATE outbox SET message_id = ? WHERE id = ?", (message_id, entry_id))
+
+
+def _outbox_retry(con, entry_id, attempts, next_try):
+    con.execute("UPDATE outbox SET attempts = ?, next_try = ? WHERE id = ?", (attempts, next_try, entry_id))
+
+
+def _outbox_delete(con, entry_id):
+    con.execute("DELETE FROM outbox WHERE id = ?", (entry_id,))
+
+
+def _outbox_read(con):
+    return con.execute("SELECT id, user_id, channel_id, message_id, url, payload, attempts, "
+                       "next_try, created FROM outbox ORDER BY id").fetchall()
@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+import discord
+
+
+class ProgressMessage:
+    """A message kept up to date with how a long job is going. Updates
+    are folded together so it's edited at most once every interval seconds
+    no matter how often the job reports"""
+
+    def __init__(self, message: discord.Message, interval: float = 2.0):
+        self.message = message
+        self.interval = interval
+        self._text = None
+        self._edited = 0.0
+        self._pending = None  # An update waiting for its turn
+        self._editing = asyncio.Lock()
+        self._finished = False
+
+    def update(self, text: str):
+        """Shows text soon, replacing anything not shown yet"""
+        self._text = text
+        if self._pending is None:
+            self._pending = asyncio.ensure_future(self._edit_later())
+
+    async def _edit_later(self):
+        try:
+            await asyncio.sleep(max(0.0, self._edited + self.interval - time.monotonic()))
+        finally:
+            self._pending = None
+        await self._edit(self._text)
+
+    async def finish(self, text: str):
+        """Shows text now, dropping any update still waiting. An update
+        that's already being shown finishes first so it can't land after"""
+        self._finished = True
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
+        await self._edit(text, final=True)
+
+    async def _edit(self, text, final: bool = False):
+        async with self._editing:
+            if self._finished and not final:
+                return
+            self._edited = time.monotonic()
+            try:
+                await self.message.edit(content=text[:2000])
+            except discord.HTTPException:
+                pass
@@ -0,0 +1,146 @@
+from typing import Optional
+
+
+class Settings:
+    """A copy of the cog's Config kept in memory. It is loaded once and the
+    setters write through to Config, so the lookups every command makes
+    (API keys, tokens, nicks, list sizes) don't have to await the Config
+    driver.
+
+    Everything lives in the global scope: guilds and users are keyed by
+    their id, ie. config[guild_id][user_id]["nick"] and config[user_id]["token"]
+
+    Nicks are also indexed both ways per guild, so finding the member
+    behind an Untappd name doesn't mean walking every member's settings.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._data = {}
+        self._nicks = {}  # guild id -> {member id: nick}
+        self._nick_owners = {}  # guild id -> {lowercased nick: member id}
+
+    async def load(self):
+        """Reads the whole of Config into memory"""
+        self._data = await self.config.all()
+        self._nicks = {}
+        self._nick_owners = {}
+        for guild_id, section in self._data.items():
+            if not isinstance(section, dict):
+                continue
+            for member_id, member in section.items():
+                if isinstance(member, dict) and member.get("nick"):
+                    self._index_nick(guild_id, member_id, member["nick"])
+
+    def _index_nick(self, guild_id, member_id, nick):
+        guild_id, member_id = str(guild_id), str(member_id)
+        nicks = self._nicks.setdefault(guild_id, {})
+        owners = self._nick_owners.setdefault(guild_id, {})
+        old = nicks.pop(member_id, None)
+        if old and owners.get(old.lower()) == member_id:
+            del owners[old.lower()]
+        if nick:
+            nicks[member_id] = nick
+            owners[str(nick).lower()] = member_id
+
+    async def set_raw(self, *identifiers, value):
+        """Config.set_raw that keeps the copy up to date"""
+        await self.config.set_raw(*identifiers, value=value)
+        node = self._data
+        for identifier in identifiers[:-1]:
+            child = node.get(str(identifier))
+            if not isinstance(child, dict):
+                child = node[str(identifier)] = {}
+            node = child
+        node[str(identifiers[-1])] = value
+        if len(identifiers) == 3 and identifiers[2] == "nick":
+            self._index_nick(identifiers[0], identifiers[1], value)
+
+    async def clear_raw(self, *identifiers):
+        """Config.clear_raw that keeps the copy up to date"""
+        await self.config.clear_raw(*identifiers)
+        if len(identifiers) == 3 and identifiers[2] == "nick":
+            self._index_nick(identifiers[0], identifiers[1], None)
+        node = self._data
+        for identifier in identifiers[:-1]:
+            node = node.get(str(identifier))
+            if not isinstance(node, dict):
+                return
+        node.pop(str(identifiers[-1]), None)
+
+    def _section(self, identifier) -> dict:
+        section = self._data.get(str(identifier))
+        return section if isinstance(section, dict) else {}
+
+    @property
+    def client_id(self) -> str:
+        return self._data.get("client_id", "")
+
+    @property
+    def client_secret(self) -> str:
+        return self._data.get("client_secret", "")
+
+    @property
+    def supporter_emoji(self) -> str:
+        return self._data.get("supporter_emoji", "")
+
+    @property
+    def moderator_emoji(self) -> str:
+        return self._data.get("moderator_emoji", "")
+
+    @property
+    def app_emoji(self) -> str:
+        return self._data.get("app_emoji", "")
+
+    @property
+    def toast_emoji(self) -> str:
+        return self._data.get("toast_emoji", "")
+
+    def token(self, user_id) -> Optional[str]:
+        """The user's Untappd access token if they authorized the bot"""
+        return self._section(user_id).get("token") or None
+
+    def token_holders(self) -> list:
+        """The ids of everyone who authorized the bot"""
+        return [int(user_id) for user_id, section in self._data.items()
+                if str(user_id).isdigit() and isinstance(section, dict) and section.get("token")]
+
+    def nick(self, guild_id, user_id) -> Optional[str]:
+        """The Untappd name a member set with setnick in a guild"""
+        if not guild_id:
+            return None
+        return self._nicks.get(str(guild_id), {}).get(str(user_id))
+
+    def nick_owner(self, guild_id, nick: str) -> Optional[int]:
+        """The id of the member who set an Untappd name in a guild"""
+        if not guild_id or not nick:
+            return None
+        member_id = self._nick_owners.get(str(guild_id), {}).get(str(nick).lower())
+        return int(member_id) if member_id else None
+
+    def profile(self, guild_id, member) -> str:
+        """The Untappd name to use for a Discord member: their nick in the
+        guild if they set one, otherwise their display name"""
+        return self.nick(guild_id, member.id) or member.display_name
+
+    def friendme(self, guild_id, user_id) -> bool:
+        member = self._section(guild_id).get(str(user_id))
+        return isinstance(member, dict) and member.get("friendme") == 1
+
+    def project_url(self, guild_id) -> str:
+        """The drinking project endpoint for a guild, empty if there isn't one"""
+        if not guild_id:
+            return ""
+        return self._section(guild_id).get("project_url") or ""
+
+    def feed_channel(self, guild_id) -> Optional[int]:
+        """The channel a guild's checkin feed is posted in, if it has one"""
+        channel_id = self._section(guild_id).get("feed_channel") if guild_id else None
+        return int(channel_id) if channel_id else None
+
+    def list_size(self, guild_id=None) -> int:
+        """The list size for a guild or the default size"""
+        size = self._section(guild_id).get("max_items_in_list") if guild_id else None
+        if size is None:
+            size = self._data.get("max_items_in_list", 5)
+        return size
@@ -0,0 +1,410 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import json
+import sqlite3
+import time
+import zlib
+
+
+class Database:
+    """A SQLite file that is only touched from one worker thread, so slow
+    disks never stall the event loop. Nothing is opened until the first
+    query and each store adds the tables it needs with add_schema"""
+
+    def __init__(self, path):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="untappd-db")
+        self._connection = None
+        self._schemas = []
+        self._applied = 0
+        self._pending = set()
+
+    def add_schema(self, sql: str):
+        """Registers CREATE ... IF NOT EXISTS statements to run before the
+        next query"""
+        self._schemas.append(sql)
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+        while self._applied < len(self._schemas):
+            self._connection.executescript(self._schemas[self._applied])
+            self._applied += 1
+        return self._connection
+
+    def _call(self, func, args):
+        con = self._connect()
+        with con:
+            return func(con, *args)
+
+    async def run(self, func, *args):
+        """Runs func(connection, *args) in one transaction on the worker
+        thread and returns its result"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, func, args)
+
+    def submit(self, func, *args):
+        """Like run but doesn't wait, for writes nobody needs to see finish.
+        It is queued straight away so later reads see it"""
+        loop = asyncio.get_running_loop()
+        task = loop.run_in_executor(self._executor, self._call, func, args)
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+        return task
+
+    async def flush(self):
+        """Waits for everything submitted so far"""
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+
+    def _close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    async def close(self):
+        await self.flush()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._close)
+        self._executor.shutdown(wait=False)
+
+
+def key_string(key):
+    """Flattens a transport.request_key into a string to store"""
+    endpoint, params = key
+    return endpoint + "?" + "&".join("{!s}={!s}".format(k, v) for k, v in params)
+
+
+class ApiCache:
+    """Compressed copies of Untappd responses kept on disk so a restart
+    doesn't have to download everything again. Reads go through before the
+    network, writes happen in the background and the oldest entries are
+    dropped once the table grows past max_bytes. How big the table is
+    gets counted once and then kept up to date on the database thread"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS api_cache (
+            key TEXT PRIMARY KEY,
+            endpoint TEXT NOT NULL,
+            fetched REAL NOT NULL,
+            size INTEGER NOT NULL,
+            body BLOB NOT NULL);
+        CREATE INDEX IF NOT EXISTS api_cache_fetched ON api_cache (fetched);
+    """
+
+    def __init__(self, db: Database, max_ages: dict, personal_max_age: float,
+                 max_bytes: int = 32 * 1024 * 1024):
+        self.db = db
+        self.max_ages = max_ages
+        self.personal_max_age = personal_max_age
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._bytes = None  # Bytes of bodies stored, None until first counted
+        db.add_schema(self.SCHEMA)
+
+    def max_age(self, key):
+        """How old a stored response may be, None if it isn't kept at all"""
+        endpoint, params = key
+        for prefix, age in self.max_ages.items():
+            if endpoint.startswith(prefix):
+                if any(name == "access_token" for name, _ in params):
+                    return min(age, self.personal_max_age)
+                return age
+        return None
+
+    async def get(self, key):
+        """Returns the stored response for a request key if it's fresh enough"""
+        max_age = self.max_age(key)
+        if max_age is None:
+            return None
+        row = await self.db.run(_cache_read, key_string(key))
+        if row is None or row[0] < time.time() - max_age:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(zlib.decompress(row[1]))
+
+    def put(self, key, response):
+        """Stores a response in the background"""
+        if self.max_age(key) is None:
+            return
+        body = zlib.compress(json.dumps(response, separators=(",", ":")).encode())
+        self.db.submit(self._write, key_string(key), key[0], time.time(), body)
+        self.writes += 1
+
+    def _write(self, con, key, endpoint, fetched, body):
+        if self._bytes is None:
+            self._bytes = _cache_size(con)[1]
+        self._bytes += _cache_write(con, key, endpoint, fetched, body)
+        if self._bytes > self.max_bytes:
+            # Trim to 80% so eviction doesn't run on every write
+            self._bytes -= _cache_evict(con, self._bytes - int(self.max_bytes * 0.8))
+
+    def _purge(self, con):
+        dropped = _cache_purge(con)
+        self._bytes = 0
+        return dropped
+
+    async def purge(self):
+        """Forgets everything, returns how many responses were dropped"""
+        await self.db.flush()
+        return await self.db.run(self._purge)
+
+    async def stats(self):
+        count, size = await self.db.run(_cache_size)
+        lookups = self.hits + self.misses
+        rate = (100.0 * self.hits / lookups) if lookups else 0.0
+        return "{!s} responses, {:.1f}/{:.0f} MiB, {!s} hits, {!s} misses ({:.1f}%)".format(
+            count, size / 1048576, self.max_bytes / 1048576, self.hits, self.misses, rate
+        )
+
+
+def _cache_read(con, key):
+    return con.execute("SELECT fetched, body FROM api_cache WHERE key = ?", (key,)).fetchone()
+
+
+def _cache_write(con, key, endpoint, fetched, body):
+    """Stores a body, returns how many bytes the table grew by"""
+    old = con.execute("SELECT size FROM api_cache WHERE key = ?", (key,)).fetchone()
+    con.execute("INSERT OR REPLACE INTO api_cache (key, endpoint, fetched, size, body) "
+                "VALUES (?, ?, ?, ?, ?)", (key, endpoint, fetched, len(body), body))
+    return len(body) - (old[0] if old else 0)
+
+
+def _cache_evict(con, excess):
+    """Drops the oldest bodies until excess bytes are gone, returns how many were"""
+    doomed = []
+    freed = 0
+    for old_key, size in con.execute("SELECT key, size FROM api_cache ORDER BY fetched"):
+        doomed.append((old_key,))
+        freed += size
+        if freed >= excess:
+            break
+    con.executemany("DELETE FROM api_cache WHERE key = ?", doomed)
+    return freed
+
+
+def _cache_purge(con):
+    return con.execute("DELETE FROM api_cache").rowcount
+
+
+def _cache_size(con):
+    return con.execute("SELECT count(*), coalesce(sum(size), 0) FROM api_cache").fetchone()
+
+
+class CheckinMessages:
+    """Remembers which of the bot's messages show which checkin. The newest
+    max_size are kept in memory and on disk, so a reaction can be matched
+    to its checkin with one dict lookup, even on a message discord.py has
+    long since dropped from its cache"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS checkin_messages (
+            message_id INTEGER PRIMARY KEY,
+            checkin_id INTEGER NOT NULL,
+            posted REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS checkin_messages_posted ON checkin_messages (posted);
+    """
+
+    def __init__(self, db: Database, max_size: int = 10000):
+        self.db = db
+        self.max_size = max_size
+        self._index = OrderedDict()
+        self._writes = 0
+        db.add_schema(self.SCHEMA)
+
+    def __len__(self):
+        return len(self._index)
+
+    def get(self, message_id):
+        """The checkin id a message shows, None if it isn't one of ours"""
+        return self._index.get(message_id)
+
+    def add(self, message_id, checkin_id):
+        self._index[message_id] = int(checkin_id)
+        self._index.move_to_end(message_id)
+        while len(self._index) > self.max_size:
+            self._index.popitem(last=False)
+        # The table is trimmed back to max_size now and then, not every write
+        self._writes += 1
+        trim = self._writes % 500 == 0
+        self.db.submit(_messages_write, message_id, int(checkin_id), time.time(), self.max_size, trim)
+
+    async def load(self):
+        """Reads the saved index, keeping anything added in the meantime"""
+        rows = await self.db.run(_messages_read, self.max_size)
+        index = OrderedDict(rows)
+        for message_id, checkin_id in self._index.items():
+            index.pop(message_id, None)
+            index[message_id] = checkin_id
+        while len(index) > self.max_size:
+            index.popitem(last=False)
+        self._index = index
+
+
+def _messages_write(con, message_id, checkin_id, posted, max_size, trim):
+    con.execute("INSERT OR REPLACE INTO checkin_messages (message_id, checkin_id, posted) "
+                "VALUES (?, ?, ?)", (message_id, checkin_id, posted))
+    if trim:
+        con.execute("DELETE FROM checkin_messages WHERE message_id NOT IN "
+                    "(SELECT message_id FROM checkin_messages ORDER BY posted DESC LIMIT ?)", (max_size,))
+
+
+def _messages_read(con, max_size):
+    rows = con.execute("SELECT message_id, checkin_id FROM checkin_messages "
+                       "ORDER BY posted DESC LIMIT ?", (max_size,)).fetchall()
+    rows.reverse()
+    return rows
+
+
+class ChannelContext:
+    """What a channel was last shown"""
+
+    __slots__ = ("beer", "checkin", "updated")
+
+    def __init__(self, beer=None, checkin=None, updated=0.0):
+        self.beer = beer
+        self.checkin = checkin
+        self.updated = updated
+
+
+class ChannelContexts:
+    """The last beer and checkin shown in each channel, so commands can
+    default to them. The max_size most recently used channels are kept in
+    memory, changes are written out together every flush_delay seconds and
+    a channel is only read back from disk the first time it's asked about
+    after a restart"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS channel_context (
+            channel_id INTEGER PRIMARY KEY,
+            beer_id INTEGER,
+            checkin_id INTEGER,
+            updated REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS channel_context_updated ON channel_context (updated);
+    """
+
+    def __init__(self, db: Database, max_size: int = 5000, max_stored: int = 50000,
+                 flush_delay: float = 30.0):
+        self.db = db
+        self.max_size = max_size
+        self.max_stored = max_stored
+        self.flush_delay = flush_delay
+        self._contexts = OrderedDict()  # channel id -> ChannelContext
+        self._dirty = set()
+        self._partial = set()  # remembered without reading what was saved first
+        self._flusher = None
+        self.loaded = 0
+        db.add_schema(self.SCHEMA)
+
+    def __len__(self):
+        return len(self._contexts)
+
+    async def get(self, channel_id) -> ChannelContext:
+        """The channel's context, empty if nothing was shown there"""
+        context = self._contexts.get(channel_id)
+        if context is None or channel_id in self._partial:
+            row = await self.db.run(_context_read, channel_id)
+            # Something may have been shown while the disk was read
+            context = self._contexts.get(channel_id)
+            if context is None:
+                context = ChannelContext(*row) if row else ChannelContext()
+                self._keep(channel_id, context)
+            elif row and channel_id in self._partial:
+                # Only part of it was shown since the restart, the rest is on disk
+                if context.beer is None:
+                    context.beer = row[0]
+                if context.checkin is None:
+                    context.checkin = row[1]
+            self._partial.discard(channel_id)
+            self.loaded += 1 if row else 0
+        else:
+            self._contexts.move_to_end(channel_id)
+        return context
+
+    async def beer(self, channel_id):
+        """The last beer id shown in a channel or None"""
+        return (await self.get(channel_id)).beer
+
+    async def checkin(self, channel_id):
+        """The last checkin id shown in a channel or None"""
+        return (await self.get(channel_id)).checkin
+
+    def remember(self, channel_id, beer=None, checkin=None):
+        """Records what was just shown in a channel"""
+        context = self._contexts.get(channel_id)
+        if context is None:
+            # The saved row is merged in when it's read or written
+            context = ChannelContext()
+            self._partial.add(channel_id)
+        if beer is not None:
+            context.beer = int(beer)
+        if checkin is not None:
+            context.checkin = int(checkin)
+        context.updated = time.time()
+        self._keep(channel_id, context)
+        self._dirty.add(channel_id)
+        if self._flusher is None:
+            self._flusher = asyncio.ensure_future(self._flush_later())
+
+    def _keep(self, channel_id, context):
+        self._contexts[channel_id] = context
+        self._contexts.move_to_end(channel_id)
+        while len(self._contexts) > self.max_size:
+            # Anything evicted before its flush is written along with the rest
+            old_id, old = self._contexts.popitem(last=False)
+            self._partial.discard(old_id)
+            if old_id in self._dirty:
+                self._dirty.discard(old_id)
+                self.db.submit(_context_write, [(old_id, old.beer, old.checkin, old.updated)], None)
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.flush_delay)
+        finally:
+            self._flusher = None
+            self.flush()
+
+    def flush(self):
+        """Writes every changed channel in one transaction"""
+        if not self._dirty:
+            return
+        rows = []
+        for channel_id in self._dirty:
+            context = self._contexts[channel_id]
+            rows.append((channel_id, context.beer, context.checkin, context.updated))
+        self._dirty.clear()
+        self.db.submit(_context_write, rows, self.max_stored)
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+        self.flush()
+        await self.db.flush()
+
+    def stats(self):
+        return "{!s}/{!s} channels in memory, {!s} read back from disk, {!s} unsaved".format(
+            len(self._contexts), self.max_size, self.loaded, len(self._dirty)
+        )
+
+
+def _context_read(con, channel_id):
+    return con.execute("SELECT beer_id, checkin_id, updated FROM channel_context "
+                       "WHERE channel_id = ?", (channel_id,)).fetchone()
+
+
+def _context_write(con, rows, max_stored):
+    # A channel remembered before its saved row was read only knows part of it
+    con.executemany("INSERT INTO channel_context (channel_id, beer_id, checkin_id, updated) "
+                    "VALUES (?, ?, ?, ?) ON CONFLICT (channel_id) DO UPDATE SET "
+                    "beer_id = coalesce(excluded.beer_id, beer_id), "
+                    "checkin_id = coalesce(excluded.checkin_id, checkin_id), "
+                    "updated = excluded.updated", rows)
+    if max_stored:
+        con.execute("DELETE FROM channel_context WHERE channel_id NOT IN "
+                    "(SELECT channel_id FROM channel_context ORDER BY updated DESC LIMIT ?)", (max_stored,))
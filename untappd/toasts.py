@@ -0,0 +1,156 @@
+import asyncio
+from collections import deque
+
+# What a single toast attempt can come back with
+TOASTED = "toasted"
+UNTOASTED = "untoasted"  # It was already toasted, so the call took it back
+RETRY = "retry"  # Worth trying again in a moment
+FAILED = "failed"
+
+
+class ToastQueue:
+    """Toasts checkins on a few background workers instead of in whatever
+    coroutine asked. The same person toasting the same checkin again while
+    it's queued shares the queued toast, each person has at most per_user
+    toasts in progress, transient failures are retried with backoff and
+    anything worth telling the person is sent to them in one message per
+    report_delay seconds. Toasts over someone's limit wait in their own
+    line and a retry waits on a timer, so neither holds up a worker.
+
+    toast(user, checkin) makes one attempt and returns (outcome, message)
+    report(user, lines) tells a user how their toasts went"""
+
+    def __init__(self, toast, report, workers: int = 4, per_user: int = 1,
+                 max_queued: int = 500, retries: int = 3, backoff: float = 2.0,
+                 report_delay: float = 5.0):
+        self._toast = toast
+        self._report = report
+        self.worker_count = workers
+        self.per_user = per_user
+        self.retries = retries
+        self.backoff = backoff
+        self.report_delay = report_delay
+        self.max_queued = max_queued
+        self._ready = asyncio.Queue()  # keys that can be tried now
+        self._jobs = {}  # (user id, checkin) -> [user, future, retries, retoasted]
+        self._waiting = {}  # user id -> deque of keys over their limit
+        self._running = {}  # user id -> toasts being tried or waiting to retry
+        self._timers = {}  # key -> handle for a retry
+        self._reports = {}  # user id -> (user, lines)
+        self._workers = []
+        self._report_tasks = set()
+        self.toasted = 0
+        self.failed = 0
+        self.shared = 0
+
+    def start(self):
+        for _ in range(self.worker_count):
+            self._workers.append(asyncio.create_task(self._work()))
+
+    async def stop(self):
+        """Stops the workers, failing anything still queued"""
+        for task in self._workers + list(self._report_tasks):
+            task.cancel()
+        await asyncio.gather(*self._workers, *self._report_tasks, return_exceptions=True)
+        self._workers = []
+        for timer in self._timers.values():
+            timer.cancel()
+        for job in self._jobs.values():
+            if not job[1].done():
+                job[1].set_result(False)
+        self._jobs.clear()
+        self._waiting.clear()
+        self._running.clear()
+        self._timers.clear()
+
+    def toast(self, user, checkin):
+        """Queues a toast, returns a future that resolves to whether it worked"""
+        key = (user.id, int(checkin))
+        if key in self._jobs:
+            self.shared += 1
+            return self._jobs[key][1]
+        future = asyncio.get_running_loop().create_future()
+        if len(self._jobs) >= self.max_queued:
+            future.set_result(False)
+            self._report_later(user, "Too many toasts are waiting right now, "
+                                     "try checkin {!s} again later".format(checkin))
+            return future
+        self._jobs[key] = [user, future, 0, False]
+        self._waiting.setdefault(user.id, deque()).append(key)
+        self._release(user.id)
+        return future
+
+    def _release(self, user_id):
+        """Lets someone's next toasts go, up to their limit"""
+        waiting = self._waiting.get(user_id)
+        while waiting and self._running.get(user_id, 0) < self.per_user:
+            self._running[user_id] = self._running.get(user_id, 0) + 1
+            self._ready.put_nowait(waiting.popleft())
+        if not waiting:
+            self._waiting.pop(user_id, None)
+
+    def _retry(self, key):
+        self._timers.pop(key, None)
+        self._ready.put_nowait(key)
+
+    async def _work(self):
+        while True:
+            key = await self._ready.get()
+            job = self._jobs[key]
+            user, future = job[0], job[1]
+            try:
+                outcome, message = await self._attempt(job, key[1])
+            except asyncio.CancelledError:
+                if not future.done():
+                    future.set_result(False)
+                raise
+            except Exception as exc:  # pylint: disable=broad-except
+                outcome, message = FAILED, "Toast of {!s} failed: {!s}".format(key[1], exc)
+            if outcome == RETRY and job[2] < self.retries:
+                # Keep their place but give the worker back while waiting
+                delay = self.backoff * 2 ** job[2]
+                job[2] += 1
+                self._timers[key] = asyncio.get_running_loop().call_later(delay, self._retry, key)
+                continue
+            del self._jobs[key]
+            self._running[user.id] -= 1
+            if not self._running[user.id]:
+                del self._running[user.id]
+            self._release(user.id)
+            success = outcome == TOASTED
+            if success:
+                self.toasted += 1
+            else:
+                self.failed += 1
+            if not future.done():
+                future.set_result(success)
+            if message:
+                self._report_later(user, message)
+
+    async def _attempt(self, job, checkin):
+        while True:
+            outcome, message = await self._toast(job[0], checkin)
+            if outcome == UNTOASTED and not job[3]:
+                # Toasts toggle, so toast again to put it back
+                job[3] = True
+                continue
+            return outcome, message
+
+    def _report_later(self, user, line):
+        if user.id in self._reports:
+            self._reports[user.id][1].append(line)
+            return
+        self._reports[user.id] = (user, [line])
+        task = asyncio.create_task(self._send_report(user.id))
+        self._report_tasks.add(task)
+        task.add_done_callback(self._report_tasks.discard)
+
+    async def _send_report(self, user_id):
+        await asyncio.sleep(self.report_delay)
+        user, lines = self._reports.pop(user_id)
+        await self._report(user, lines)
+
+    def stats(self):
+        return "{!s} queued, {!s} toasted, {!s} failed, {!s} duplicates shared".format(
+            len(self._jobs), self.toasted, self.failed, self.shared
+        )
@@ -0,0 +1,205 @@
+import asyncio
+import copy
+import hashlib
+import time
+import urllib.parse
+
+# Request priorities for the rate limiter. Lower goes first.
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Read-only endpoints whose identical concurrent requests can share one call.
+# Anything with a side effect (toasts, friend requests, wishlist changes)
+# must always go out on its own.
+COALESCED_ENDPOINTS = (
+    "beer/info/",
+    "brewery/info/",
+    "checkin/view/",
+    "search/beer",
+    "user/checkins/",
+    "user/info/",
+)
+
+
+def endpoint_of(url):
+    """Returns the API endpoint of an Untappd URL, ie. beer/info/1234"""
+    path = urllib.parse.urlsplit(url).path
+    return path.split("/v4/", 1)[-1]
+
+
+def token_digest(token):
+    """A short stand-in for an access token that is safe to keep around"""
+    return hashlib.sha256(str(token).encode()).hexdigest()[:16]
+
+
+def request_key(url):
+    """Returns a hashable key for a read-only request or None when the
+    request must not be shared. Secrets never end up in the key but two
+    different users' tokens still produce different keys"""
+    endpoint = endpoint_of(url)
+    if not endpoint.startswith(COALESCED_ENDPOINTS):
+        return None
+    params = []
+    for name, value in urllib.parse.parse_qsl(urllib.parse.urlsplit(url).query):
+        if name == "client_secret":
+            continue
+        if name == "access_token":
+            value = token_digest(value)
+        params.append((name, value))
+    return endpoint, tuple(sorted(params))
+
+
+def budget_key(url):
+    """Returns which hourly budget a request is charged to. Untappd counts
+    authorized calls against the user's token and the rest against the
+    app's client id"""
+    return params_budget_key(dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(url).query)))
+
+
+def params_budget_key(params):
+    """budget_key for the auth parameters of a request that isn't built yet"""
+    if "access_token" in params:
+        return "token:" + token_digest(params["access_token"])
+    return "client:" + params.get("client_id", "")
+
+
+class TokenBucket:
+    """Tokens left in one hourly budget, refilled evenly over the hour"""
+
+    __slots__ = ("limit", "tokens", "updated")
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.tokens = float(limit)
+        self.updated = time.monotonic()
+
+    def refill(self, period: float):
+        now = time.monotonic()
+        self.tokens = min(float(self.limit),
+                          self.tokens + (now - self.updated) * self.limit / period)
+        self.updated = now
+
+
+class RateLimiter:
+    """Schedules Untappd calls against per key token buckets that are kept
+    in step with the X-Ratelimit headers. When a budget runs low background
+    work waits for interactive commands, and when it runs out callers queue
+    for the next token or are turned away instead of hitting the API"""
+
+    def __init__(self, limit: int = 100, period: float = 3600, reserve: float = 0.2,
+                 interactive_wait: float = 40, background_wait: float = 600):
+        self.limit = limit
+        self.period = period
+        self.reserve = reserve
+        self.max_wait = {INTERACTIVE: interactive_wait, BACKGROUND: background_wait}
+        self.buckets = {}
+        self.queued = 0
+        self.denied = 0
+        self._interactive_waiting = {}
+
+    def bucket(self, key):
+        if key not in self.buckets:
+            self.buckets[key] = TokenBucket(self.limit)
+        return self.buckets[key]
+
+    def remaining(self, key):
+        """Calls believed to be left in a budget"""
+        bucket = self.bucket(key)
+        bucket.refill(self.period)
+        return int(bucket.tokens)
+
+    def has_spare(self, key):
+        """Whether background work could run now without eating into the
+        reserve kept for people running commands"""
+        bucket = self.bucket(key)
+        bucket.refill(self.period)
+        return bucket.tokens >= max(1.0, bucket.limit * self.reserve) + 1
+
+    async def acquire(self, key, priority: int = INTERACTIVE):
+        """Waits for a token in key's budget. Returns False if none will be
+        available within the priority's maximum wait"""
+        bucket = self.bucket(key)
+        floor = 1.0
+        if priority != INTERACTIVE:
+            floor = max(1.0, bucket.limit * self.reserve)
+        deadline = time.monotonic() + self.max_wait.get(priority, 0)
+        queued = False
+        if priority == INTERACTIVE:
+            self._interactive_waiting[key] = self._interactive_waiting.get(key, 0) + 1
+        try:
+            while True:
+                bucket.refill(self.period)
+                blocked = priority != INTERACTIVE and self._interactive_waiting.get(key)
+                if bucket.tokens >= floor and not blocked:
+                    bucket.tokens -= 1
+                    return True
+                wait = max(0.5, (floor - bucket.tokens) * self.period / bucket.limit)
+                if blocked:
+                    wait = 1.0
+                if time.monotonic() + wait > deadline:
+                    self.denied += 1
+                    return False
+                if not queued:
+                    queued = True
+                    self.queued += 1
+                await asyncio.sleep(min(wait, 5.0))
+        finally:
+            if priority == INTERACTIVE:
+                self._interactive_waiting[key] -= 1
+                if not self._interactive_waiting[key]:
+                    del self._interactive_waiting[key]
+
+    def update(self, key, headers):
+        """Brings a bucket in line with what Untappd says is left"""
+        bucket = self.bucket(key)
+        try:
+            if "X-Ratelimit-Limit" in headers:
+                bucket.limit = max(1, int(headers["X-Ratelimit-Limit"]))
+            if "X-Ratelimit-Remaining" in headers:
+                bucket.tokens = float(int(headers["X-Ratelimit-Remaining"]))
+                bucket.updated = time.monotonic()
+        except ValueError:
+            pass
+
+    def stats(self):
+        lowest = ""
+        if self.buckets:
+            key = min(self.buckets, key=self.remaining)
+            lowest = ", lowest has {!s} left".format(self.remaining(key))
+        return "{!s} budgets{!s}, {!s} calls queued, {!s} turned away".format(
+            len(self.buckets), lowest, self.queued, self.denied
+        )
+
+
+class SingleFlight:
+    """Lets concurrent callers asking for the same thing await one call"""
+
+    def __init__(self):
+        self._calls = {}
+        self.started = 0
+        self.shared = 0
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def do(self, key, func):
+        """Awaits func() unless a call for key is already running, in which
+        case that call's result is shared. Every caller, the one that made
+        the call too, gets its own copy of the result"""
+        task = self._calls.get(key)
+        if task is not None:
+            self.shared += 1
+        else:
+            self.started += 1
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        result = await asyncio.shield(task)
+        # Callers are allowed to modify what they get back, so nobody gets
+        # the task's own result and it stays clean for the others
+        return copy.deepcopy(result)
+
+    def stats(self):
+        return "{!s} calls made, {!s} callers shared one, {!s} in flight".format(
+            self.started, self.shared, len(self._calls)
+        )
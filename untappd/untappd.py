@@ -6,9 +6,25 @@ import discord
 from redbot.core import commands
 from redbot.core import checks
 from redbot.core import Config
+from redbot.core.data_manager import cog_data_path
 import urllib.parse
 import asyncio
 import re
+import time
+
+from .cache import BeerCache, TTLCache, normalize_query
+from .feeds import Feeds
+from .beerindex import BeerIndex
+from .history import CheckinHistory
+from .ledger import ProjectLedger
+from .menus import MenuRegistry
+from .outbox import Outbox
+from .progress import ProgressMessage
+from .settings import Settings
+from .storage import ApiCache, ChannelContexts, CheckinMessages, Database
+from .toasts import FAILED, RETRY, TOASTED, UNTOASTED, ToastQueue
+from .transport import BACKGROUND, INTERACTIVE, RateLimiter, SingleFlight
+from .transport import budget_key, params_budget_key, request_key
 
 # noinspection PyUnresolvedReferences
 
@@ -22,6 +38,86 @@ import re
 
 BaseCog = getattr(commands, "Cog", object)
 
+# One pooled session is shared by every Untappd and project sheet call.
+# Connections are kept alive between commands so chained lookups skip the
+# TCP and TLS handshakes.
+HTTP_CONNECTION_LIMIT = 20
+HTTP_CONNECTIONS_PER_HOST = 8
+HTTP_DNS_CACHE_SECONDS = 300
+HTTP_KEEPALIVE_SECONDS = 60
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=30, connect=10, sock_read=20)
+
+# Beer details rarely change so they're shared between users for a while.
+# A user's own rating and checkin count go stale as soon as they drink it,
+# so those are kept for less time.
+BEER_CACHE_SIZE = 512
+BEER_CACHE_TTL = 1800
+BEER_CACHE_PERSONAL_TTL = 300
+
+# Search results are cached by normalized query. Searches that find nothing
+# are remembered briefly so a typo repeated a few times costs one call.
+SEARCH_CACHE_SIZE = 256
+SEARCH_CACHE_TTL = 3600
+SEARCH_CACHE_EMPTY_TTL = 120
+
+# How many beers a reaction menu looks up at once while waiting for a pick,
+# and how long a pick waits for its lookup to finish before asking again
+MENU_PREFETCH_CONCURRENCY = 2
+MENU_PREFETCH_WAIT = 5
+
+# Limits for adding a range of checkins to the drinking project at once
+BULK_DDP_MAX_CHECKINS = 100
+BULK_DDP_MAX_PAGES = 10
+BULK_DDP_CONCURRENCY = 4
+
+# How long the local copy of a drinking project's stats is trusted, and how
+# often a few of the oldest are checked against the sheet
+LEDGER_MAX_AGE = 6 * 3600
+LEDGER_RECONCILE_INTERVAL = 600
+LEDGER_RECONCILE_BATCH = 10
+
+# Checkin feeds. Each subscriber is polled every few minutes to every few
+# hours depending on how much they check in, with all polls together kept
+# under FEED_POLLS_PER_HOUR
+FEED_MIN_INTERVAL = 300
+FEED_MAX_INTERVAL = 6 * 3600
+FEED_POLLS_PER_HOUR = 30
+FEED_MAX_POSTS = 5
+
+# Checkin history mirror. Within HISTORY_FRESH_SECONDS of the last sync a
+# user's recent checkins come straight from the mirror, after that one
+# small min_id fetch catches it up. People who authorized the bot have
+# their older checkins filled in a page at a time, HISTORY_BACKFILL_SPACING
+# seconds apart, taking turns. Someone whose budget is spent waits
+# HISTORY_BACKFILL_BUSY seconds before their next turn, and someone whose
+# token fails or who has no checkins yet HISTORY_BACKFILL_FAILED
+HISTORY_FRESH_SECONDS = 120
+HISTORY_BACKFILL_SPACING = 60
+HISTORY_BACKFILL_BUSY = 600
+HISTORY_BACKFILL_FAILED = 6 * 3600
+
+# Beers whose names findbeer can recognise without searching Untappd, at
+# most BEER_INDEX_CANDIDATES matches are compared with the query
+BEER_INDEX_CANDIDATES = 20
+
+# Responses kept on disk across restarts, by endpoint, with how many
+# seconds they stay usable. Anything fetched with a user's token includes
+# their own counts and is trusted for less time.
+DISK_CACHE_MAX_AGES = {
+    "beer/info/": 86400,
+    "search/beer": 21600,
+    "user/info/": 600,
+}
+DISK_CACHE_PERSONAL_MAX_AGE = 300
+DISK_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# How many posted checkins can still be toasted by reacting to them
+TOASTABLE_MESSAGES = 10000
+
+# Channels whose last beer and checkin are kept in memory for commands
+# run without arguments. Older ones are read back from disk when needed
+CHANNEL_CONTEXTS = 5000
+
 
 class Untappd(BaseCog):
     """Untappd cog that lets the bot look up beer
@@ -41,8 +137,77 @@ class Untappd(BaseCog):
             "CONFIG": False
         }
         self.config.register_global(**default_config)
-        self.channels = {}
+        self.settings = Settings(self.config)
         self.is_chatty = False  # Lets some debugging / annoying PMs happen
+        self.session = None
+        self.db = Database(cog_data_path(self) / "untappd.db")
+        self.api_cache = ApiCache(self.db, DISK_CACHE_MAX_AGES,
+                                  DISK_CACHE_PERSONAL_MAX_AGE, DISK_CACHE_MAX_BYTES)
+        self.checkin_messages = CheckinMessages(self.db, TOASTABLE_MESSAGES)
+        self.channels = ChannelContexts(self.db, CHANNEL_CONTEXTS)
+        self.beer_cache = BeerCache(BEER_CACHE_SIZE, BEER_CACHE_TTL,
+                                    BEER_CACHE_PERSONAL_TTL)
+        self.search_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+        self.inflight = SingleFlight()
+        self.ratelimit = RateLimiter()
+        self.menus = MenuRegistry()
+        self.toasts = ToastQueue(lambda user, checkin: toast_checkin(self, user, checkin),
+                                 report_toasts)
+        self.outbox = Outbox(self.db, lambda url, payload: post_to_project(self, url, payload),
+                             lambda entry, answer: settle_submission(self, entry, answer))
+        self.ledger = ProjectLedger(self.db, LEDGER_MAX_AGE)
+        self.reconciler = None
+        self.indexing = None
+        self.unsent = None
+        self.feeds = Feeds(self.db, FEED_MIN_INTERVAL, FEED_MAX_INTERVAL, FEED_POLLS_PER_HOUR)
+        self.poller = None
+        self.history = CheckinHistory(self.db, HISTORY_FRESH_SECONDS)
+        self.backfill = None
+        self.beer_index = BeerIndex(self.db, BEER_INDEX_CANDIDATES)
+
+    async def cog_load(self):
+        """Loads the settings and opens the HTTP session used for the
+        life of the cog"""
+        await self.settings.load()
+        # Reactions on older posts are matched by their footer until this finishes
+        self.indexing = asyncio.create_task(self.checkin_messages.load())
+        self.indexing.add_done_callback(lambda task: report_task_failure("checkin message index", task))
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_CONNECTION_LIMIT,
+            limit_per_host=HTTP_CONNECTIONS_PER_HOST,
+            ttl_dns_cache=HTTP_DNS_CACHE_SECONDS,
+            keepalive_timeout=HTTP_KEEPALIVE_SECONDS
+        )
+        self.session = aiohttp.ClientSession(connector=connector,
+                                             timeout=HTTP_TIMEOUT)
+        self.toasts.start()
+        self.outbox.start()
+        # Nothing is delivered until the submissions left over from last time are queued
+        self.unsent = asyncio.create_task(self.outbox.load())
+        self.unsent.add_done_callback(lambda task: report_task_failure("project outbox load", task))
+        self.reconciler = asyncio.create_task(reconcile_ledger(self))
+        self.poller = asyncio.create_task(poll_feeds(self))
+        self.backfill = asyncio.create_task(backfill_history(self))
+
+    async def cog_unload(self):
+        """Closes the HTTP session and its pooled connections"""
+        await self.toasts.stop()
+        if self.unsent:
+            self.unsent.cancel()
+        await self.outbox.stop()
+        if self.indexing:
+            self.indexing.cancel()
+        if self.reconciler:
+            self.reconciler.cancel()
+        if self.poller:
+            self.poller.cancel()
+        if self.backfill:
+            self.backfill.cancel()
+        self.menus.stop()
+        if self.session:
+            await self.session.close()
+        await self.channels.close()
+        await self.db.close()
 
     @commands.group(invoke_without_command=False)
     async def groupdrink(self, ctx):
@@ -54,7 +219,10 @@ class Untappd(BaseCog):
     @checks.mod_or_permissions(manage_messages=True)
     async def sheet_url(self, ctx, url):
         """The published web app URL that accepts GETs and POSTs"""
-        await self.config.set_raw(ctx.guild.id, "project_url", value=url)
+        if url != self.settings.project_url(ctx.guild.id):
+            # A new project starts from nothing
+            self.ledger.forget(ctx.guild.id)
+        await self.settings.set_raw(ctx.guild.id, "project_url", value=url)
         await ctx.send("The project endpoint URL has been set")
 
     @groupdrink.command()
@@ -62,7 +230,7 @@ class Untappd(BaseCog):
     @checks.mod_or_permissions(manage_messages=True)
     async def finish(self, ctx):
         """The published web app URL that accepts GETs and POSTs"""
-        await self.config.set_raw(ctx.guild.id, "project_url", value="")
+        await self.settings.set_raw(ctx.guild.id, "project_url", value="")
         await ctx.send("The drinking project has been temporarily"
                        " suspended.")
 
@@ -83,16 +251,16 @@ class Untappd(BaseCog):
             await ctx.send("Reducing the maximum size to "
                            "10 due to emoji constraints")
         if is_pm:
-            await self.config.max_items_in_list.set(new_size)
+            await self.settings.set_raw("max_items_in_list", value=new_size)
         else:
-            await self.config.set_raw(server, "max_items_in_list", value=new_size)
+            await self.settings.set_raw(server, "max_items_in_list", value=new_size)
         await ctx.send("Maximum list size is now {!s}".format(new_size))
 
     @untappd.command()
     @checks.mod_or_permissions(manage_messages=True)
     async def supporter_emoji(self, ctx, emoji: str):
         """The emoji to use for supporters"""
-        await self.config.supporter_emoji.set(emoji)
+        await self.settings.set_raw("supporter_emoji", value=emoji)
         await ctx.send("Profiles of supporters will now display ("
                        + str(emoji) + ")")
 
@@ -100,7 +268,7 @@ class Untappd(BaseCog):
     @checks.mod_or_permissions(manage_messages=True)
     async def moderator_emoji(self, ctx, emoji: str):
         """The emoji to use for super users"""
-        await self.config.moderator_emoji.set(emoji)
+        await self.settings.set_raw("moderator_emoji", value=emoji)
         await ctx.send("Profiles of super users will now display ("
                        + str(emoji) + ")")
 
@@ -108,7 +276,7 @@ class Untappd(BaseCog):
     @checks.mod_or_permissions(manage_messages=True)
     async def app_emoji(self, ctx, emoji: str):
         """The emoji to use for super users"""
-        await self.config.app_emoji.set(emoji)
+        await self.settings.set_raw("app_emoji", value=emoji)
         await ctx.send("App deep links will now use ("
                        + str(emoji) + ")")
 
@@ -116,7 +284,7 @@ class Untappd(BaseCog):
     @checks.mod_or_permissions(manage_messages=True)
     async def toast_emoji(self, ctx, emoji: str):
         """The emoji to use for super users"""
-        await self.config.toast_emoji.set(emoji)
+        await self.settings.set_raw("toast_emoji", value=emoji)
         await ctx.send("People who react to checkins with {!s} will be toasting!".format(emoji))
 
     @untappd.command()
@@ -127,16 +295,50 @@ class Untappd(BaseCog):
             await ctx.send_help()
         else:
             author = ctx.author.id
-            await self.config.set_raw(ctx.guild.id, author, "nick", value=keywords)
+            await self.settings.set_raw(ctx.guild.id, author, "nick", value=keywords)
+            if self.feeds.get(ctx.guild.id, author):
+                self.feeds.subscribe(ctx.guild.id, author, keywords)
             await ctx.send("When you look yourself up on untappd"
                            " I will use `" + keywords + "`")
 
+    @untappd.command()
+    @commands.guild_only()
+    @checks.mod_or_permissions(manage_messages=True)
+    async def feedchannel(self, ctx, channel: discord.TextChannel = None):
+        """Set the channel subscribed checkins are posted in. Leave it
+        off to turn feeds off"""
+        if channel is None:
+            await self.settings.clear_raw(ctx.guild.id, "feed_channel")
+            await ctx.send("Checkin feeds are off")
+        else:
+            await self.settings.set_raw(ctx.guild.id, "feed_channel", value=channel.id)
+            await ctx.send("Subscribed checkins will be posted in {!s}".format(channel.mention))
+
+    @untappd.command()
+    @commands.guild_only()
+    async def feed(self, ctx, switch: str = "on"):
+        """Post your new checkins in the feed channel, or `off` to stop"""
+        if switch.lower() == "off":
+            if self.feeds.unsubscribe(ctx.guild.id, ctx.author.id):
+                await ctx.send("I'll stop posting your checkins")
+            else:
+                await ctx.send("You weren't subscribed")
+            return
+        channel_id = self.settings.feed_channel(ctx.guild.id)
+        if not channel_id:
+            await ctx.send("This server doesn't have a feed channel, a mod can set "
+                           "one with `untappd feedchannel`")
+            return
+        profile = self.settings.profile(ctx.guild.id, ctx.author)
+        self.feeds.subscribe(ctx.guild.id, ctx.author.id, profile)
+        await ctx.send("New checkins by `{!s}` will show up in <#{!s}>".format(profile, channel_id))
+
     @untappd.command()
     async def authme(self, ctx):
         """Starts the authorization process for a user"""
         auth_url = ("https://untappd.com/oauth/authenticate/?client_id="
                     "{!s}&response_type=token&redirect_url={!s}").format(
-            await self.config.client_id(),
+            self.settings.client_id,
             "https://aardwolf.github.io/tokenrevealer.html"
         )
         auth_string = ("Please authenticate with untappd then follow the"
@@ -157,7 +359,7 @@ class Untappd(BaseCog):
             await ctx.send_help()
         else:
             author = ctx.message.author.id
-            await self.config.set_raw(author, "token", value=keyword)
+            await self.settings.set_raw(author, "token", value=keyword)
             await ctx.author.send("Token saved, thank you")
             if isinstance(ctx.message.channel, discord.TextChannel):
                 try:
@@ -172,11 +374,11 @@ class Untappd(BaseCog):
     async def unauthme(self, ctx):
         """Removes the authorization token for a user"""
         author = ctx.author.id
-        try:
-            await self.config.get_raw(author)  # Will throw KeyError if author not in config
-            await self.config.clear_raw(author, "token")
+        if self.settings.token(author):
+            await self.settings.clear_raw(author, "token")
+            self.history.forget(author)
             response = "Authorization removed"
-        except KeyError:
+        else:
             response = "It doesn't look like you were authorized before"
         await ctx.send(response)
 
@@ -185,7 +387,7 @@ class Untappd(BaseCog):
         """Accepts existing friend requests from user specified or
         sends a friend request to the user specified"""
 
-        keys = await get_auth(ctx.author.id, self.config)
+        keys = get_auth(ctx.author.id, self.settings)
         if "access_token" not in keys:
             await ctx.send("You must first authorize me to act as you"
                            " using `untappd authme`")
@@ -193,7 +395,7 @@ class Untappd(BaseCog):
 
         guild = str(ctx.guild.id) if ctx.guild else 0
 
-        credentials = await check_credentials(self.config)
+        credentials = check_credentials(self.settings)
         if not credentials:
             await ctx.send("The owner has not set the API information "
                            "and should use the `untappd_apikey` command")
@@ -203,10 +405,7 @@ class Untappd(BaseCog):
             # If user has set a nickname, use that - but only if it's not a PM
             if guild:
                 user = ctx.message.mentions[0]
-                try:
-                    profile = await self.config.get_raw(guild, user.id, "nick")
-                except KeyError:
-                    profile = user.display_name
+                profile = self.settings.profile(guild, user)
 
         if not profile:
             await ctx.send("Friend who? Give me a name!")
@@ -219,7 +418,7 @@ class Untappd(BaseCog):
         uid = 0
         url = ("https://api.untappd.com/v4/user/info/{!s}?{!s}"
                ).format(profile, qstr)
-        j = await get_data_from_untappd(ctx.author, url)
+        j = await get_data_from_untappd(self, ctx.author, url)
         if "meta" in j:
             if int(j["meta"]["code"]) == 200:
                 if "user" in j["response"]:
@@ -239,7 +438,7 @@ class Untappd(BaseCog):
         # Step 2: Accept any pending requests
         url = ("https://api.untappd.com/v4/friend/accept/{!s}?{!s}"
                ).format(uid, qstr)
-        j = await get_data_from_untappd(ctx.author, url)
+        j = await get_data_from_untappd(self, ctx.author, url)
         if "meta" in j:
             if int(j['meta']['code']) == 200:
                 # This is probably the case where it worked!
@@ -258,7 +457,7 @@ class Untappd(BaseCog):
         url = ("https://api.untappd.com/v4/friend/request/{!s}?{!s}"
                ).format(uid, qstr)
 
-        j = await get_data_from_untappd(ctx.author, url)
+        j = await get_data_from_untappd(self, ctx.author, url)
         if "meta" in j:
             if int(j["meta"]["code"]) == 200:
                 if "target_user" in j['response']:
@@ -294,13 +493,13 @@ class Untappd(BaseCog):
 
         beerid = 0
         default_beer = False
-        credentials = await check_credentials(self.config)
+        credentials = check_credentials(self.settings)
         if not credentials:
             await ctx.send("The owner has not set the API information "
                            "and should use the `untappd_apikey` command")
             return
 
-        keys = await get_auth(ctx.author.id, self.config)
+        keys = get_auth(ctx.author.id, self.settings)
         if "access_token" not in keys:
             await ctx.send("You must first authorize me to act as you"
                            " using `untappd authme`")
@@ -309,26 +508,23 @@ class Untappd(BaseCog):
         if keywords:
             keywords = " ".join(keywords)
         else:
-            channel = ctx.channel.id
-            if channel in self.channels:
-                if self.channels[channel]:
-                    if "beer" in self.channels[channel]:
-                        beerid = self.channels[channel]["beer"]
-                        default_beer = True
+            beerid = await self.channels.beer(ctx.channel.id)
+            if beerid:
+                default_beer = True
             if not beerid:
                 await ctx.send_help()
                 return
 
         await ctx.channel.typing()
         if not beerid and keywords.isdigit():
-            beer = await get_beer_by_id(self.config, ctx, keywords)
+            beer = await get_beer_by_id(self, ctx, keywords, personal=False)
             if isinstance(beer, str):
                 await ctx.send("Wishlist add failed - {!s}".
                                format(beer))
                 return
             beerid = keywords
         elif not beerid:
-            beers = await search_beer(self.config, ctx, keywords, limit=1)
+            beers = await search_beer(self, ctx, keywords, limit=1)
             if isinstance(beers["items"], list) and len(beers["items"]) > 0:
                 beerid = beers["items"][0]["beer"]["bid"]
             else:
@@ -348,7 +544,7 @@ class Untappd(BaseCog):
                    ).format(qstr)
             # print("Using URL: {!s}".format(url))
 
-            j = await get_data_from_untappd(ctx.author, url)
+            j = await get_data_from_untappd(self, ctx.author, url)
             if "meta" in j:
                 if int(j["meta"]["code"]) == 200:
                     if default_beer:
@@ -383,13 +579,13 @@ class Untappd(BaseCog):
 
         beerid = 0
         default_beer = False
-        credentials = await check_credentials(self.config)
+        credentials = check_credentials(self.settings)
         if not credentials:
             await ctx.send("The owner has not set the API information "
                            "and should use the `untappd_apikey` command")
             return
 
-        keys = await get_auth(ctx.author.id, self.config)
+        keys = get_auth(ctx.author.id, self.settings)
         if "access_token" not in keys:
             await ctx.send("You must first authorize me to act as you"
                            " using `untappd authme`")
@@ -398,26 +594,23 @@ class Untappd(BaseCog):
         if keywords:
             keywords = " ".join(keywords)
         else:
-            channel = ctx.channel.id
-            if channel in self.channels:
-                if self.channels[channel]:
-                    if "beer" in self.channels[channel]:
-                        beerid = self.channels[channel]["beer"]
-                        default_beer = True
+            beerid = await self.channels.beer(ctx.channel.id)
+            if beerid:
+                default_beer = True
             if not beerid:
                 await ctx.send_help()
                 return
 
         await ctx.channel.typing()
         if not beerid and keywords.isdigit():
-            beer = await get_beer_by_id(self.config, ctx, keywords)
+            beer = await get_beer_by_id(self, ctx, keywords, personal=False)
             if isinstance(beer, str):
                 await ctx.send("Wishlist remove failed - {!s}".
                                format(beer))
                 return
             beerid = keywords
         elif not beerid:
-            beers = await search_beer(self.config, ctx, keywords, limit=1)
+            beers = await search_beer(self, ctx, keywords, limit=1)
             if isinstance(beers["items"], list) and len(beers["items"]) > 0:
                 beerid = beers["items"][0]["beer"]["bid"]
             else:
@@ -437,7 +630,7 @@ class Untappd(BaseCog):
             url = ("https://api.untappd.com/v4/user/wishlist/delete?{!s}"
                    ).format(qstr)
 
-            j = await get_data_from_untappd(ctx.author, url)
+            j = await get_data_from_untappd(self, ctx.author, url)
             if "meta" in j:
                 if int(j["meta"]["code"]) == 200:
                     if default_beer:
@@ -469,13 +662,13 @@ class Untappd(BaseCog):
 
         response = ""  # type: str
         embed = None
-        credentials = await check_credentials(self.config)
+        credentials = check_credentials(self.settings)
         if not credentials:
             await ctx.send("The owner has not set the API information "
                            "and should use the `untappd_apikey` command")
             return
 
-        keys = await get_auth(ctx.author.id, self.config)
+        keys = get_auth(ctx.author.id, self.settings)
         if "access_token" not in keys:
             await ctx.send("You must first authorize me to act as you"
                            " using `untappd authme`")
@@ -492,7 +685,7 @@ class Untappd(BaseCog):
             if keywords.isdigit():
                 beerid = keywords
             else:
-                beers = await search_beer(self.config, ctx, keywords, limit=1)
+                beers = await search_beer(self, ctx, keywords, limit=1)
                 if isinstance(beers, str):
                     await ctx.send(
                         "Lookup of `{!s}` didn't result in a beer list: {!s}".
@@ -509,10 +702,13 @@ class Untappd(BaseCog):
                     return
 
             if beerid:
-                beer = await get_beer_by_id(self.config, ctx, beerid)
+                had = await mirrored_had(self, ctx.author, beerid)
+                beer = await get_beer_by_id(self, ctx, beerid, personal=had is None)
                 if isinstance(beer, str):
                     await ctx.send(beer)
                     return
+                if had is not None:
+                    beer["stats"]["user_count"], beer["auth_rating"] = had
                 description = ""
                 if beer["stats"]["user_count"]:
                     description = "You have had '**{!s}**' by **{!s}** {!s} time{!s}".format(
@@ -567,9 +763,9 @@ class Untappd(BaseCog):
         look up that beer"""
         beer_list = []
         response = ""
-        list_limit = await list_size(self.config, ctx.guild)
+        list_limit = list_size(self.settings, ctx.guild)
 
-        credentials = await check_credentials(self.config)
+        credentials = check_credentials(self.settings)
         if not credentials:
             await ctx.send("The owner has not set the API information "
                            "and should use the `untappd_apikey` command")
@@ -583,10 +779,10 @@ class Untappd(BaseCog):
 
         await ctx.channel.typing()
         if keywords.isdigit():
-            embed = await lookup_beer(self.config, ctx, self.channels, keywords)
+            embed = await lookup_beer(self, ctx, self.channels, keywords)
             # await ctx.send( embed=embed)
         else:
-            results = await search_beer_to_embed(self.config, ctx, self.channels, keywords,
+            results = await search_beer_to_embed(self, ctx, self.channels, keywords,
                                                  limit=list_limit)
             if isinstance(results, dict):
                 embed = results["embed"]
@@ -604,7 +800,7 @@ class Untappd(BaseCog):
             message = await ctx.send(response)
 
         if len(beer_list) > 1:
-            await embed_menu(self.bot, self.config, ctx, self.channels, beer_list,
+            await embed_menu(self, ctx, self.channels, beer_list,
                              message, 60)
             # Raised to 60 second wait
 
@@ -614,9 +810,9 @@ class Untappd(BaseCog):
         look up that beer"""
         beer_list = []
         response = ""
-        list_limit = await list_size(self.config, ctx.guild)
+        list_limit = list_size(self.settings, ctx.guild)
 
-        credentials = await check_credentials(self.config)
+        credentials = check_credentials(self.settings)
         if not credentials:
             await ctx.send("The owner has not set the API information "
                            "and should use the `untappd_apikey` command")
@@ -630,10 +826,10 @@ class Untappd(BaseCog):
 
         await ctx.channel.typing()
         if keywords.isdigit():
-            embed = await lookup_beer(self.config, ctx, self.channels, keywords)
+            embed = await lookup_beer(self, ctx, self.channels, keywords)
             # await ctx.send( embed=embed)
         else:
-            results = await search_beer_to_embed(self.config, ctx, self.channels, keywords,
+            results = await search_beer_to_embed(self, ctx, self.channels, keywords,
                                                  limit=list_limit, homebrew=True)
             if isinstance(results, dict):
                 embed = results["embed"]
@@ -651,7 +847,7 @@ class Untappd(BaseCog):
             message = await ctx.send(response)
 
         if len(beer_list) > 1:
-            await embed_menu(self.bot, self.config, ctx, self.channels, beer_list,
+            await embed_menu(self, ctx, self.channels, beer_list,
                              message, 60)
             # Raised to 60 second wait
 
@@ -659,7 +855,7 @@ class Untappd(BaseCog):
     async def findbeer1(self, ctx, *keywords):
         result_text = ""
         await ctx.channel.typing()
-        results = await search_beer_to_embed(self.config, ctx, self.channels,
+        results = await search_beer_to_embed(self, ctx, self.channels,
                                              " ".join(keywords), limit=1)
         if isinstance(results, dict):
             embed = results["embed"]
@@ -678,7 +874,7 @@ class Untappd(BaseCog):
         else:
             guild = 0
 
-        credentials = await check_credentials(self.config)
+        credentials = check_credentials(self.settings)
         if not credentials:
             await ctx.send("The owner has not set the API information "
                            "and should use the `untappd_apikey` command")
@@ -690,20 +886,16 @@ class Untappd(BaseCog):
             if ctx.guild:
                 user = ctx.message.mentions[0]
                 # print("looking up {!s}".format(user.id))
-                try:
-                    profile = await self.config.get_raw(guild, user.id, "nick")
-                except KeyError:
-                    profile = user.display_name
+                profile = self.settings.profile(guild, user)
 
         if not profile:
-            try:
-                profile = await self.config.get_raw(guild, author.id, "nick")
-            except KeyError:
-                profile = author.display_name
+            profile = self.settings.profile(guild, author)
 
         await ctx.channel.typing()
-        results = await get_checkins(self.config, ctx, self.channels, profile=profile, count=1)
-        if (isinstance(results, dict)) and ("embed" in results):
+        results = await get_checkins(self, ctx, self.channels, profile=profile, count=1)
+        if isinstance(results, dict) and "checkin" in results:
+            await send_checkin(self, ctx, self.channels, results["checkin"], result_text)
+        elif (isinstance(results, dict)) and ("embed" in results):
             embed = results["embed"]
             await ctx.send(result_text, embed=embed)
         else:
@@ -721,7 +913,7 @@ class Untappd(BaseCog):
         author = ctx.author
         guild = str(ctx.guild.id) if ctx.guild else 0
 
-        credentials = await check_credentials(self.config)
+        credentials = check_credentials(self.settings)
         if not credentials:
             await ctx.send("The owner has not set the API information "
                            "and should use the `untappd_apikey` command")
@@ -731,22 +923,16 @@ class Untappd(BaseCog):
             # If user has set a nickname, use that - but only if it's not a PM
             if ctx.guild:
                 user = ctx.message.mentions[0]
-                try:
-                    profile = await self.config.get_raw(guild, user.id, "nick")
-                except KeyError:
-                    profile = user.display_name
+                profile = self.settings.profile(guild, user)
 
         if not profile:
-            try:
-                profile = await self.config.get_raw(guild, author.id, "nick")
-            except KeyError:
-                profile = None
+            profile = self.settings.nick(guild, author.id)
         if not profile:
             profile = author.display_name
             print("Using '{}'".format(profile))
         await ctx.channel.typing()
-        results = await profile_lookup(self.config, ctx, profile,
-                                       limit=await list_size(self.config, ctx.guild))
+        results = await profile_lookup(self, ctx, profile,
+                                       limit=list_size(self.settings, ctx.guild))
         if isinstance(results, dict):
             if "embed" in results:
                 embed = results["embed"]
@@ -759,7 +945,7 @@ class Untappd(BaseCog):
         else:
             message = await ctx.send(result_text)
         if len(beer_list) > 1:
-            await embed_menu(self.bot, self.config, ctx, self.channels,
+            await embed_menu(self, ctx, self.channels,
                              beer_list, message, 30, type_="checkin")
         return
 
@@ -769,38 +955,76 @@ class Untappd(BaseCog):
         """Sets the id and secret that you got from applying for
             an untappd api"""
         if len(keywords) == 2:
-            await self.config.client_id.set(keywords[0])
-            await self.config.client_secret.set(keywords[1])
-            await self.config.CONFIG.set(True)
+            await self.settings.set_raw("client_id", value=keywords[0])
+            await self.settings.set_raw("client_secret", value=keywords[1])
+            await self.settings.set_raw("CONFIG", value=True)
             await ctx.send("API set")
         else:
             await ctx.send("I am expecting two words, the id and "
                            "the secret only")
 
+    @untappd.command()
+    @checks.is_owner()
+    async def projectqueue(self, ctx):
+        """Shows the drinking project submissions waiting to go out"""
+        await ctx.send("```\nProject outbox: {!s}\nProject ledger: {!s}\n```".format(
+            self.outbox.stats(), await self.ledger.stats()))
+
+    @untappd.command()
+    @checks.is_owner()
+    async def feedstats(self, ctx):
+        """Shows how the checkin feeds are being polled"""
+        await ctx.send("```\nFeeds: {!s}\n```".format(self.feeds.stats()))
+
+    @untappd.command()
+    @checks.is_owner()
+    async def cachestats(self, ctx):
+        """Shows how well the lookup caches are working"""
+        await ctx.send(("```\nBeers: {!s}\nSearches: {!s}\nDisk: {!s}\nIn flight: {!s}\n"
+                        "Rate limits: {!s}\nToasts: {!s}\nMenus: {!s}\nChannels: {!s}\n"
+                        "History: {!s}\nBeer index: {!s}\n```").format(
+            self.beer_cache.stats(), self.search_cache.stats(), await self.api_cache.stats(),
+            self.inflight.stats(), self.ratelimit.stats(), self.toasts.stats(),
+            self.menus.stats(), self.channels.stats(), await self.history.stats(),
+            await self.beer_index.stats()))
+
+    @untappd.command()
+    @checks.is_owner()
+    async def purgecache(self, ctx):
+        """Forgets every cached Untappd response, on disk and in memory"""
+        dropped = await self.api_cache.purge()
+        self.beer_cache.clear()
+        self.search_cache.clear()
+        await ctx.send("Dropped {!s} stored response{!s}".format(dropped, add_s(dropped)))
+
     @commands.Cog.listener()
-    async def on_reaction_add(self, react: discord.Reaction, person: discord.User):
+    async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
         """
-        When someone reacts to a thing, process it.
+        Hands picks on open menus to the menu registry, and when someone
+        reacts to a checkin the cog posted, toasts it if the reaction is
+        the toast emoji. Runs for every reaction the bot sees, so anything
+        else is turned away with a dict lookup or two.
 
-        :param react: The reaction object
-        :param person: The user object for the person reacting
+        :param payload: The raw reaction event
         """
-        emoji = react.emoji
-        # Process the emoji
-        # eid = emoji.id if react.custom_emoji else str(emoji)
-        toast_emoji = await self.config.toast_emoji()
-        if emoji == toast_emoji:
-            # Find the checkin ID to use
-            if len(react.message.embeds) > 0:
-                footer = react.message.embeds[0].footer.text
-                match = re.search('Checkin ([0-9]+) /', footer)
-                if match:
-                    success = await do_toast(self.config, person, checkin=match.group(1))
-                    if success and self.is_chatty:
-                        try:
-                            await person.send("Toasted {!s}".format(match.group(1)))
-                        except (discord.Forbidden, discord.HTTPException):
-                            return
+        if self.menus.dispatch(payload.message_id, payload.user_id, str(payload.emoji)):
+            return
+        if str(payload.emoji) != self.settings.toast_emoji or payload.user_id == self.bot.user.id:
+            return
+        checkin = self.checkin_messages.get(payload.message_id)
+        if checkin is None:
+            # Posted before the index existed, or it hasn't loaded yet
+            checkin = await checkin_from_footer(self, payload)
+        if checkin is None:
+            return
+        person = self.bot.get_user(payload.user_id)
+        if person is None:
+            try:
+                person = await self.bot.fetch_user(payload.user_id)
+            except discord.HTTPException:
+                return
+        # Nobody is waiting on the answer, the queue tells them if it failed
+        self.toasts.toast(person, checkin)
 
     @commands.command()
     async def toast(self, ctx, *keywords):
@@ -813,11 +1037,7 @@ class Untappd(BaseCog):
                 checkin = int(word)
 
         if not checkin:
-            channel = ctx.channel.id
-            if channel in self.channels:
-                if self.channels[channel]:
-                    if "checkin" in self.channels[channel]:
-                        checkin = self.channels[channel]["checkin"]
+            checkin = await self.channels.checkin(ctx.channel.id)
 
         if not checkin:
             await ctx.send("I haven't seen a checkin for this channel "
@@ -825,7 +1045,7 @@ class Untappd(BaseCog):
                            "which to toast.")
             return
 
-        success = await do_toast(self.config, ctx.author, checkin=checkin)
+        success = await do_toast(self, ctx.author, checkin=checkin)
         if success:
             success = await add_react(ctx.message, '✅')
             if not success:
@@ -840,16 +1060,13 @@ class Untappd(BaseCog):
         author = ctx.author
         checkin = 0
 
-        credentials = await check_credentials(self.config)
+        credentials = check_credentials(self.settings)
         if not credentials:
             await ctx.send("The owner has not set the API information "
                            "and should use the `untappd_apikey` command")
             return
 
-        try:
-            auth_token = await self.config.get_raw(author.id, "token")
-        except KeyError:
-            auth_token = None
+        auth_token = self.settings.token(author.id)
 
         for word in keywords:
             if word.isdigit():
@@ -860,12 +1077,11 @@ class Untappd(BaseCog):
             return
 
         await ctx.channel.typing()
-        embed = await get_checkin(self.config, ctx, self.channels,
-                                  checkin=checkin, auth_token=auth_token)
-        if isinstance(embed, str):
-            await ctx.send(embed)
+        result = await get_checkin(self, ctx, checkin=checkin, auth_token=auth_token)
+        if isinstance(result, str):
+            await ctx.send(result)
         else:
-            await ctx.send("", embed=embed)
+            await send_checkin(self, ctx, self.channels, result)
 
     @commands.command()
     async def checkins(self, ctx, *keywords):
@@ -881,9 +1097,9 @@ class Untappd(BaseCog):
             guild = 0
         checkin_list = []
         result_text = ""
-        countnum = await list_size(self.config, server=ctx.guild)
+        countnum = list_size(self.settings, server=ctx.guild)
         # determine if a profile or number was given
-        credentials = await check_credentials(self.config)
+        credentials = check_credentials(self.settings)
         if not credentials:
             await ctx.send("The owner has not set the API information "
                            "and should use the `untappd_apikey` command")
@@ -896,10 +1112,7 @@ class Untappd(BaseCog):
             # If user has set a nickname, use that - but only if it's not a PM
             if ctx.guild:
                 user = ctx.message.mentions[0]
-                try:
-                    profile = await self.config.get_raw(guild, user.id, "nick")
-                except KeyError:
-                    profile = user.display_name
+                profile = self.settings.profile(guild, user)
 
         # The way the API works you can provide a checkin number and limit
         for word in keywords:
@@ -910,10 +1123,7 @@ class Untappd(BaseCog):
             elif not profile:
                 profile = word
         if not profile:
-            try:
-                profile = await self.config.get_raw(guild, author.id, "nick")
-            except KeyError:
-                profile = None
+            profile = self.settings.nick(guild, author.id)
         if not profile:
             profile = author.display_name
 
@@ -928,8 +1138,11 @@ class Untappd(BaseCog):
         #     countnum = 1
 
         await ctx.channel.typing()
-        results = await get_checkins(self.config, ctx, self.channels, profile=profile,
+        results = await get_checkins(self, ctx, self.channels, profile=profile,
                                      start=startnum, count=countnum)
+        if isinstance(results, dict) and "checkin" in results:
+            await send_checkin(self, ctx, self.channels, results["checkin"], result_text)
+            return
         if isinstance(results, dict):
             if "embed" in results:
                 embed = results["embed"]
@@ -942,7 +1155,7 @@ class Untappd(BaseCog):
         else:
             message = await ctx.send(result_text)
         if len(checkin_list) > 1:
-            await embed_menu(self.bot, self.config, ctx, self.channels, checkin_list, message, 30,
+            await embed_menu(self, ctx, self.channels, checkin_list, message, 30,
                              type_="checkin")
         return
 
@@ -954,14 +1167,8 @@ class Untappd(BaseCog):
         url = ""
         if ctx.guild:
             guild = str(ctx.guild.id)
-            try:
-                url = await self.config.get_raw(guild, "project_url")
-            except KeyError:
-                pass
-            try:
-                profile = await self.config.get_raw(guild, author.id, "nick")
-            except KeyError:
-                profile = author.display_name
+            url = self.settings.project_url(guild)
+            profile = self.settings.profile(guild, author)
         else:
             profile = author.display_name
 
@@ -975,7 +1182,7 @@ class Untappd(BaseCog):
         if keywords.isdigit():
             beerid = keywords
         else:
-            beers = await search_beer(self.config, ctx, keywords, limit=1)
+            beers = await search_beer(self, ctx, keywords, limit=1)
             if isinstance(beers, str):
                 await ctx.send(
                     "Lookup of `{!s}` didn't result in a beer list: {!s}".format(keywords, beers)
@@ -987,16 +1194,10 @@ class Untappd(BaseCog):
                 await ctx.send("Lookup of `{!s}` failed. So no, you haven't".format(keywords))
                 return
 
-        if beerid:
-            beer = await get_beer_by_id(self.config, ctx, beerid)
-            if isinstance(beer, str):
-                await ctx.send(beer)
-                return
-
         if not url:
             await ctx.send("Looks like there are no projects right now")
             return
-        beer = await get_beer_by_id(self.config, ctx, beerid)
+        beer = await get_beer_by_id(self, ctx, beerid, personal=False)
         if isinstance(beer, str):
             # This happens in error situations
             await ctx.send(beer)
@@ -1016,40 +1217,9 @@ class Untappd(BaseCog):
             "brewery_name": beer["brewery"]["brewery_name"],
             "collabs": collabs
         }
-        async with aiohttp.ClientSession() as sess:
-            async with sess.post(url, data=payload) as resp:
-                if resp.status == 200:
-                    try:
-                        j = await resp.json()
-                    except ValueError:
-                        await ctx.send("Error somewhere in Google")
-                        # text = await resp.read()
-                        # print(text)
-                        return
-                else:
-                    return "Query failed with code " + str(resp.status)
-
-                if j['result'] == "success":
-                    response_str = ""
-                    if "message" in j:
-                        response_str += j["message"] + " "
-                    if "hasStats" in j:
-                        response_str += "{} has {} points across {} checkins and {} found beers. ".format(
-                            profile, j["points"], j["checkins"], j["found"]
-                        )
-                    if "beerStats" in j:
-                        response_str += " {} has been found by {} people. {} has {} beers found so far. ".format(
-                            beer["beer_name"], j["beerPeople"], beer["brewery"]["brewery_name"], j["breweryPeople"])
-                    embed = await lookup_beer(self.config, ctx, self.channels, beerid)
-                    if embed:
-                        await ctx.send(response_str, embed=embed)
-                    else:
-                        await ctx.send(response_str)
-                else:
-                    if "message" in j:
-                        await ctx.send("Negatory: {}".format(j['message']))
-                    else:
-                        await ctx.send("Something went wrong finding the beer")
+        embed = await lookup_beer(self, ctx, self.channels, beerid, beer=beer)
+        await submit_to_project(self, ctx, url, payload, lambda: ctx.send(
+            "Adding {!s} to the project...".format(beer["beer_name"]), embed=embed))
 
     @commands.command()
     @commands.guild_only()
@@ -1063,63 +1233,61 @@ class Untappd(BaseCog):
         profile = ""
         if ctx.guild:
             guild = str(ctx.guild.id)
-            try:
-                url = await self.config.get_raw(guild, "project_url")
-            except KeyError:
+            url = self.settings.project_url(guild)
+            if not url:
                 await ctx.send("Project is currently not open")
                 return
         else:
             await ctx.send("This command is not available in a PM")
             return
         if not keywords:
-            try:
-                profile = await self.config.get_raw(guild, ctx.author.id, "nick")
-            except KeyError:
-                profile = ctx.author.display_name
+            profile = self.settings.profile(guild, ctx.author)
         else:
             if ctx.message.mentions:
                 # If user has set a nickname, use that - but only if it's not a PM
                 if ctx.guild:
                     user = ctx.message.mentions[0]
-                    try:
-                        profile = await self.config.get_raw(guild, user.id, "nick")
-                    except KeyError:
-                        profile = user.display_name
+                    profile = self.settings.profile(guild, user)
             else:
                 profile = '+'.join(keywords)
+        status = await self.ledger.status(ctx.guild.id, profile)
+        if status is not None:
+            await ctx.send("{} has {} points across {} checkins and {} found beers.".format(
+                profile, *status))
+            return
         payload = {
             "action": "status",
             "username": profile
         }
         async with ctx.message.channel.typing():
-            async with aiohttp.ClientSession() as sess:
-                async with sess.post(url, data=payload) as resp:
-                    if resp.status == 200:
-                        try:
-                            j = await resp.json()
-                        except ValueError:
-                            await ctx.send("Error somewhere in Google")
-                            # print(resp)
-                            # text = await resp.read()
-                            # print(text)
-                            return
-                    else:
-                        return "Query failed with code " + str(resp.status)
-
-                    if j['result'] == "success":
-                        response_str = ""
-                        if "message" in j:
-                            response_str += j["message"] + " "
-                        if "hasStats" in j:
-                            response_str += "{} has {} points across {} checkins and {} found beers.".format(
-                                profile, j["points"], j["checkins"], j["found"]
-                            )
-                        await ctx.send(response_str)
+            async with self.session.post(url, data=payload) as resp:
+                if resp.status == 200:
+                    try:
+                        j = await resp.json()
+                    except ValueError:
+                        await ctx.send("Error somewhere in Google")
+                        # print(resp)
+                        # text = await resp.read()
+                        # print(text)
+                        return
+                else:
+                    return "Query failed with code " + str(resp.status)
+
+                if j['result'] == "success":
+                    response_str = ""
+                    if "message" in j:
+                        response_str += j["message"] + " "
+                    if "hasStats" in j:
+                        response_str += "{} has {} points across {} checkins and {} found beers.".format(
+                            profile, j["points"], j["checkins"], j["found"]
+                        )
+                        self.ledger.set_status(ctx.guild.id, profile, j)
+                    await ctx.send(response_str)
+                else:
+                    if "message" in j:
+                        await ctx.send("Not Today! {}".format(j['message']))
                     else:
-                        if "message" in j:
-                            await ctx.send("Not Today! {}".format(j['message']))
-                        else:
-                            await ctx.send("Something went wrong checking status")
+                        await ctx.send("Something went wrong checking status")
 
 
     @commands.command()
@@ -1133,9 +1301,8 @@ class Untappd(BaseCog):
         """
         if ctx.guild:
             guild = str(ctx.guild.id)
-            try:
-                url = await self.config.get_raw(guild, "project_url")
-            except KeyError:
+            url = self.settings.project_url(guild)
+            if not url:
                 await ctx.send("Project is currently not open")
                 return
         else:
@@ -1145,35 +1312,44 @@ class Untappd(BaseCog):
             await ctx.send("Who drank what?")
             return
 
+        names = await self.ledger.drinkers(ctx.guild.id, beerid)
+        if names is not None:
+            response_str = "Nobody has added that beer"
+            if names:
+                response_str = "These people added that beer: " + ", ".join(names)
+            await ctx.send(response_str)
+            return
+
         payload = {
             "action": "whodrank",
             "beerid": beerid
         }
         async with ctx.message.channel.typing():
-            async with aiohttp.ClientSession() as sess:
-                async with sess.post(url, data=payload) as resp:
-                    if resp.status == 200:
-                        try:
-                            j = await resp.json()
-                        except ValueError:
-                            await ctx.send("Error somewhere in Google")
-                            # print(resp)
-                            # text = await resp.read()
-                            # print(text)
-                            return
-                    else:
-                        return "Query failed with code " + str(resp.status)
+            async with self.session.post(url, data=payload) as resp:
+                if resp.status == 200:
+                    try:
+                        j = await resp.json()
+                    except ValueError:
+                        await ctx.send("Error somewhere in Google")
+                        # print(resp)
+                        # text = await resp.read()
+                        # print(text)
+                        return
+                else:
+                    return "Query failed with code " + str(resp.status)
 
+                if "message" in j:
+                    response_str = "Nobody has added that beer"
+                    if j["message"]:
+                        response_str = "These people added that beer: " + j["message"]
+                    names = [name.strip() for name in str(j["message"] or "").split(",")]
+                    self.ledger.sync_drinkers(ctx.guild.id, beerid, [name for name in names if name])
+                    await ctx.send(response_str)
+                else:
                     if "message" in j:
-                        response_str = "Nobody has added that beer"
-                        if j["message"]:
-                            response_str = "These people added that beer: " + j["message"]
-                        await ctx.send(response_str)
+                        await ctx.send("Not Today! {}".format(j['message']))
                     else:
-                        if "message" in j:
-                            await ctx.send("Not Today! {}".format(j['message']))
-                        else:
-                            await ctx.send("Something went wrong checking status")
+                        await ctx.send("Something went wrong checking status")
 
     @commands.command()
     @commands.guild_only()
@@ -1184,21 +1360,12 @@ class Untappd(BaseCog):
         url = ""
         if ctx.guild:
             guild = str(ctx.guild.id)
-            try:
-                url = await self.config.get_raw(guild, "project_url")
-            except KeyError:
-                pass
-            try:
-                profile = await self.config.get_raw(guild, author.id, "nick")
-            except KeyError:
-                profile = author.display_name
+            url = self.settings.project_url(guild)
+            profile = self.settings.profile(guild, author)
         else:
             profile = author.display_name
 
-        try:
-            auth_token = await self.config.get_raw(author.id, "token")
-        except KeyError:
-            auth_token = None
+        auth_token = self.settings.token(author.id)
 
         await ctx.channel.typing()
         if not url:
@@ -1211,16 +1378,16 @@ class Untappd(BaseCog):
         if not checkin_id or checkin_id <= 0:
             checkin_url = ("https://api.untappd.com/v4/user/checkins/{!s}".format(profile))
             keys = dict()
-            keys["client_id"] = await self.config.client_id()
+            keys["client_id"] = self.settings.client_id
             if auth_token:
                 keys["access_token"] = auth_token
                 # print("Doing an authorized lookup")
             else:
-                keys["client_secret"] = await self.config.client_secret()
+                keys["client_secret"] = self.settings.client_secret
             keys["limit"] = 1
             qstr = urllib.parse.urlencode(keys)
             checkin_url += "?{!s}".format(qstr)
-            j = await get_data_from_untappd(ctx.author, checkin_url)
+            j = await get_data_from_untappd(self, ctx.author, checkin_url)
             if j["meta"]["code"] != 200:
                 # print("Lookup failed for url: "+url)
                 await ctx.send("Lookup failed with {!s} - {!s}".format(
@@ -1238,16 +1405,16 @@ class Untappd(BaseCog):
         else:
             # The case where a checkin id was provided
             keys = dict()
-            keys["client_id"] = await self.config.client_id()
+            keys["client_id"] = self.settings.client_id
             if auth_token:
                 keys["access_token"] = auth_token
                 # print("Doing an authorized lookup")
             else:
-                keys["client_secret"] = await self.config.client_secret()
+                keys["client_secret"] = self.settings.client_secret
             qstr = urllib.parse.urlencode(keys)
             checkin_url = "https://api.untappd.com/v4/checkin/view/{!s}?{!s}".format(checkin_id, qstr)
 
-            j = await get_data_from_untappd(ctx.author, checkin_url)
+            j = await get_data_from_untappd(self, ctx.author, checkin_url)
             if j["meta"]["code"] != 200:
                 # print("Lookup failed for url: "+url)
                 await ctx.send("Lookup failed with {!s} - {!s}".format(
@@ -1258,87 +1425,86 @@ class Untappd(BaseCog):
             checkin = j["response"]["checkin"]
 
         checkin_id = checkin["checkin_id"]
-        style = checkin["beer"]["beer_style"]
-        beer_id = checkin["beer"]["bid"]
-        beer_name = checkin["beer"]["beer_name"]
-        brewery_id = checkin["brewery"]["brewery_id"]
-        brewery = checkin["brewery"]["brewery_name"]
-        username = checkin["user"]["user_name"]
-        rating = checkin["rating_score"]
-        comment = checkin["checkin_comment"]
-        checkin_date = checkin["created_at"]
-        country = "Unknown"
-        if "country_name" in checkin["brewery"]:
-            country = checkin["brewery"]["country_name"]
-
-        beer = await get_beer_by_id(self.config, ctx, beer_id)
-        avg_rating = beer["rating_score"]
-        total_checkins = beer["stats"]["total_user_count"]
-        abv = beer["beer_abv"]
-        beer_date = beer["created_at"]
+        beer = await get_beer_by_id(self, ctx, checkin["beer"]["bid"], personal=False)
+        payload = ddp_payload(checkin, beer)
+        await submit_to_project(self, ctx, url, payload, lambda: send_checkin(
+            self, ctx, self.channels, checkin,
+            "Adding checkin {!s} to the project...".format(checkin_id), beer=beer))
 
-        # added for March 2019 -- collabs!
-        collabs = 0
-        if "collaborations_with" in beer:
-            collabs = beer["collaborations_with"]["count"]
+    @commands.command()
+    @commands.guild_only()
+    async def ddpbulk(self, ctx, first: str, last: str = ""):
+        """Add a range of your checkins to the spreadsheet. Give two
+        checkin ids or two dates (YYYY-MM-DD). Leave off the second to
+        go up to your latest checkin"""
 
-        payload = {
-            "action": "drank",
-            "checkin": checkin_id,
-            "style": style,
-            "bid": beer_id,
-            "beer_name": beer_name,
-            "brewery_id": brewery_id,
-            "brewery": brewery,
-            "username": username,
-            "rating": rating,
-            "avg_rating": avg_rating,
-            "total_checkins": total_checkins,
-            "checkin_date": checkin_date,
-            "collabs": collabs,
-            "abv": abv,
-            "comment": comment,
-            "beer_date": beer_date,
-            "country": country
-        }
-        async with aiohttp.ClientSession() as sess:
-            async with sess.post(url, data=payload) as resp:
-                if resp.status == 200:
-                    try:
-                        j = await resp.json()
-                    except ValueError:
-                        await ctx.send("Error somewhere in Google")
-                        # print(resp)
-                        # text = await resp.read()
-                        # print(text)
-                        return
-                else:
-                    return "Query failed with code " + str(resp.status)
+        url = self.settings.project_url(ctx.guild.id)
+        if not url:
+            await ctx.send("Looks like there are no projects right now")
+            return
+        try:
+            first, last = parse_checkin_range(first, last)
+        except ValueError as exc:
+            await ctx.send(str(exc))
+            return
+        profile = self.settings.profile(ctx.guild.id, ctx.author)
 
-                if j['result'] == "success":
-                    response_str = ""
-                    if "message" in j:
-                        response_str += j["message"] + " "
-                    if "hasStats" in j:
-                        response_str += "{} has {} points across {} checkins and {} found beers.".format(
-                            username, j["points"], j["checkins"], j["found"]
-                        )
-                        if "styleString" in j:
-                            response_str += "\n{}".format(j["styleString"])
-                            print(j["styleString"])
-                    # embed = await get_checkin(self.config, ctx, self.channels,
-                    #                          checkin=checkin_id, auth_token=auth_token)
-                    embed = await checkin_to_embed(self.config, ctx, self.channels, checkin)
-                    if embed:
-                        await ctx.send(response_str,
-                                       embed=embed)
-                    else:
-                        await ctx.send(response_str)
-                else:
-                    if "message" in j:
-                        await ctx.send("Negatory: {}".format(j['message']))
-                    else:
-                        await ctx.send("Something went wrong adding the checkin")
+        message = await ctx.send("Looking through {!s}'s checkins...".format(profile))
+        progress = ProgressMessage(message)
+        checkins = await checkins_in_range(self, ctx, profile, first, last, progress)
+        if isinstance(checkins, str):
+            await progress.finish(checkins)
+            return
+        if not checkins:
+            await progress.finish("{!s} has no checkins in that range".format(profile))
+            return
+
+        progress.update("Found {!s} checkin{!s}, looking up the beers...".format(
+            len(checkins), add_s(len(checkins))))
+        beers = await get_beers_by_id(self, ctx, {c["beer"]["bid"] for c in checkins})
+        payloads = []
+        problems = []
+        for checkin in checkins:
+            beer = beers.get(checkin["beer"]["bid"])
+            if isinstance(beer, dict):
+                payloads.append(ddp_payload(checkin, beer))
+            elif beer is None:
+                problems.append("{!s}: skipped {!s}, no Untappd lookups to spare right now. "
+                                "Add it later with `ddp {!s}`".format(
+                                    checkin["checkin_id"], checkin["beer"]["beer_name"],
+                                    checkin["checkin_id"]))
+            else:
+                problems.append("{!s}: couldn't look up {!s}".format(
+                    checkin["checkin_id"], checkin["beer"]["beer_name"]))
+        if not payloads:
+            await progress.finish("\n".join(["None of those beers could be looked up"] + problems))
+            return
+
+        entries = await self.outbox.add_many(ctx.author.id, ctx.channel.id, url, payloads)
+        tally = {"added": 0, "settled": 0}
+
+        async def settled(entry, answer):
+            record_submission(self, entry, answer)
+            tally["settled"] += 1
+            if answer is not None and answer.get("result") == "success":
+                tally["added"] += 1
+            else:
+                problems.append("{!s}: {!s}".format(entry.payload["checkin"],
+                                                    project_answer_text(entry.payload, answer)))
+            text = ("Added {!s} of {!s} checkin{!s} to the project, {!s} to go"
+                    "").format(tally["added"], len(checkins), add_s(len(checkins)),
+                               len(entries) - tally["settled"])
+            if tally["settled"] < len(entries):
+                progress.update(text)
+                return
+            text = "Added {!s} of {!s} checkin{!s} to the project".format(
+                tally["added"], len(checkins), add_s(len(checkins)))
+            await progress.finish("\n".join([text] + problems))
+
+        for entry in entries:
+            self.outbox.send(entry, message.id, on_settle=settled)
+        progress.update("Sending {!s} checkin{!s} to the project...".format(
+            len(entries), add_s(len(entries))))
 
     @commands.command()
     @commands.guild_only()
@@ -1349,21 +1515,12 @@ class Untappd(BaseCog):
         url = ""
         if ctx.guild:
             guild = str(ctx.guild.id)
-            try:
-                url = await self.config.get_raw(guild, "project_url")
-            except KeyError:
-                pass
-            try:
-                profile = await self.config.get_raw(guild, author.id, "nick")
-            except KeyError:
-                profile = author.display_name
+            url = self.settings.project_url(guild)
+            profile = self.settings.profile(guild, author)
         else:
             await ctx.send("This does not work in PM")
 
-        try:
-            auth_token = await self.config.get_raw(author.id, "token")
-        except KeyError:
-            auth_token = None
+        auth_token = self.settings.token(author.id)
 
         await ctx.channel.typing()
         if not url:
@@ -1373,16 +1530,16 @@ class Untappd(BaseCog):
         if not checkin_id or checkin_id <= 0:
             checkin_url = ("https://api.untappd.com/v4/user/checkins/{!s}".format(profile))
             keys = dict()
-            keys["client_id"] = await self.config.client_id()
+            keys["client_id"] = self.settings.client_id
             if auth_token:
                 keys["access_token"] = auth_token
                 # print("Doing an authorized lookup")
             else:
-                keys["client_secret"] = await self.config.client_secret()
+                keys["client_secret"] = self.settings.client_secret
             keys["limit"] = 1
             qstr = urllib.parse.urlencode(keys)
             checkin_url += "?{!s}".format(qstr)
-            j = await get_data_from_untappd(ctx.author, checkin_url)
+            j = await get_data_from_untappd(self, ctx.author, checkin_url)
             if j["meta"]["code"] != 200:
                 # print("Lookup failed for url: "+url)
                 await ctx.send("Lookup failed with {!s} - {!s}".format(
@@ -1400,16 +1557,16 @@ class Untappd(BaseCog):
         else:
             # The case where a checkin id was provided
             keys = dict()
-            keys["client_id"] = await self.config.client_id()
+            keys["client_id"] = self.settings.client_id
             if auth_token:
                 keys["access_token"] = auth_token
                 # print("Doing an authorized lookup")
             else:
-                keys["client_secret"] = await self.config.client_secret()
+                keys["client_secret"] = self.settings.client_secret
             qstr = urllib.parse.urlencode(keys)
             checkin_url = "https://api.untappd.com/v4/checkin/view/{!s}?{!s}".format(checkin_id, qstr)
 
-            j = await get_data_from_untappd(ctx.author, checkin_url)
+            j = await get_data_from_untappd(self, ctx.author, checkin_url)
             if j["meta"]["code"] != 200:
                 # print("Lookup failed for url: "+url)
                 await ctx.send("Lookup failed with {!s} - {!s}".format(
@@ -1423,33 +1580,8 @@ class Untappd(BaseCog):
             "action": "undrank",
             "checkin": checkin_id,
         }
-        async with aiohttp.ClientSession() as sess:
-            async with sess.post(url, data=payload) as resp:
-                if resp.status == 200:
-                    try:
-                        j = await resp.json()
-                    except ValueError:
-                        await ctx.send("Error somewhere in Google")
-                        text = await resp.read()
-                        print(text)
-                        return
-                else:
-                    return "Query failed with code " + str(resp.status)
-
-                if j['result'] == "success":
-                    response_str = ""
-                    if "message" in j:
-                        response_str += j["message"] + " "
-                    if "hasStats" in j:
-                        response_str += "{} has {} points across {} checkins and {} found beers.".format(
-                            j["username"], j["points"], j["checkins"], j["found"]
-                        )
-                    await ctx.send(response_str)
-                else:
-                    if "message" in j:
-                        await ctx.send(j["message"])
-                    else:
-                        await ctx.send("Something went wrong adding the checkin")
+        await submit_to_project(self, ctx, url, payload, lambda: ctx.send(
+            "Taking checkin {!s} out of the project...".format(checkin_id)))
 
 
     @commands.command()
@@ -1461,14 +1593,8 @@ class Untappd(BaseCog):
         url = ""
         if ctx.guild:
             guild = str(ctx.guild.id)
-            try:
-                url = await self.config.get_raw(guild, "project_url")
-            except KeyError:
-                pass
-            try:
-                profile = await self.config.get_raw(guild, author.id, "nick")
-            except KeyError:
-                profile = author.display_name
+            url = self.settings.project_url(guild)
+            profile = self.settings.profile(guild, author)
         else:
             profile = author.display_name
 
@@ -1481,72 +1607,343 @@ class Untappd(BaseCog):
             "beerid": beer_id,
             "username": profile
         }
-        async with ctx.channel.typing():
-            async with aiohttp.ClientSession() as sess:
-                async with sess.post(url, data=payload) as resp:
-                    if resp.status == 200:
-                        try:
-                            j = await resp.json()
-                        except ValueError:
-                            await ctx.send("Error somewhere in Google")
-                            text = await resp.read()
-                            print(text)
-                            return
-                    else:
-                        return "Query failed with code " + str(resp.status)
-
-                    if j['result'] == "success":
-                        response_str = ""
-                        if "message" in j:
-                            response_str += j["message"] + " "
-                        if "hasStats" in j:
-                            response_str += "{} has {} points across {} checkins and {} found beers.".format(
-                                j["username"], j["points"], j["checkins"], j["found"]
-                            )
-                        await ctx.send(response_str)
-                    else:
-                        if "message" in j:
-                            await ctx.send(j["message"])
-                        else:
-                            await ctx.send("Something went un-finding the beer")
+        await submit_to_project(self, ctx, url, payload, lambda: ctx.send(
+            "Taking beer {!s} out of the project...".format(beer_id)))
+
+
+def parse_checkin_range(first: str, last: str = ""):
+    """Reads the ends of a ddpbulk range, either checkin ids or dates.
+    Raises ValueError with something to tell the user"""
+    bounds = []
+    for text in (first, last):
+        if not text:
+            bounds.append(None)
+        elif text.isdigit():
+            bounds.append(int(text))
+        else:
+            try:
+                bounds.append(datetime.strptime(text, "%Y-%m-%d").date())
+            except ValueError:
+                raise ValueError("`{!s}` isn't a checkin id or a date like 2019-03-31".format(text))
+    if bounds[1] is not None and type(bounds[0]) is not type(bounds[1]):
+        raise ValueError("Give two checkin ids or two dates, not one of each")
+    if bounds[1] is not None and bounds[1] < bounds[0]:
+        bounds.reverse()
+    return bounds[0], bounds[1]
+
+
+async def checkins_in_range(cog, ctx, profile, first, last=None, progress=None,
+                            priority: int = BACKGROUND):
+    """Pages back through a user's checkins by max_id, returning the ones
+    between first and last, oldest first. The ends are checkin ids or
+    dates from parse_checkin_range. Gives up after BULK_DDP_MAX_PAGES
+    pages. Returns a string if a lookup failed, which at background
+    priority includes there being no calls to spare"""
+    by_date = not isinstance(first, int)
+    keys = get_auth(ctx.author.id, cog.settings)
+    keys["limit"] = 50
+    if last and not by_date:
+        keys["max_id"] = last
+    found = {}
+    for _ in range(BULK_DDP_MAX_PAGES):
+        url = "https://api.untappd.com/v4/user/checkins/{!s}?{!s}".format(
+            profile, urllib.parse.urlencode(keys))
+        resp = await get_data_from_untappd(cog, ctx.author, url, priority)
+        if resp["meta"]["code"] == 429 and priority != INTERACTIVE:
+            return ("There aren't enough Untappd lookups to spare for a bulk add right now, "
+                    "try again later or with a smaller range")
+        if resp["meta"]["code"] != 200:
+            return "Lookup failed with {!s} - {!s}".format(
+                resp["meta"]["code"], resp["meta"].get("error_detail"))
+        items = resp["response"].get("checkins", {}).get("items") or []
+        for checkin in items:
+            if by_date:
+                position = datetime.strptime(checkin["created_at"], "%a, %d %b %Y %H:%M:%S %z").date()
+            else:
+                position = checkin["checkin_id"]
+            if position < first:
+                items = []
+                break
+            if (last is None or position <= last) and len(found) < BULK_DDP_MAX_CHECKINS:
+                found[checkin["checkin_id"]] = checkin
+        max_id = resp["response"].get("pagination", {}).get("max_id")
+        if not items or not max_id or len(found) >= BULK_DDP_MAX_CHECKINS:
+            break
+        keys["max_id"] = max_id
+        if progress is not None:
+            progress.update("Looking through {!s}'s checkins, found {!s} so far...".format(
+                profile, len(found)))
+    return sorted(found.values(), key=lambda checkin: checkin["checkin_id"])
+
+
+async def get_beers_by_id(cog, ctx, beerids, priority: int = BACKGROUND):
+    """Looks up several beers at once, at most BULK_DDP_CONCURRENCY at a
+    time. Returns a dict of beer id to what get_beer_by_id returned, None
+    for beers skipped because no calls could be spared at priority"""
+    semaphore = asyncio.Semaphore(BULK_DDP_CONCURRENCY)
+
+    async def fetch(beerid):
+        async with semaphore:
+            return beerid, await get_beer_by_id(cog, ctx, beerid, personal=False, priority=priority)
+
+    return dict(await asyncio.gather(*(fetch(beerid) for beerid in beerids)))
+
+
+def ddp_payload(checkin: dict, beer: dict):
+    """The drinking project form for a checkin and its beer"""
+    country = "Unknown"
+    if "country_name" in checkin["brewery"]:
+        country = checkin["brewery"]["country_name"]
+
+    # added for March 2019 -- collabs!
+    collabs = 0
+    if "collaborations_with" in beer:
+        collabs = beer["collaborations_with"]["count"]
+
+    return {
+        "action": "drank",
+        "checkin": checkin["checkin_id"],
+        "style": checkin["beer"]["beer_style"],
+        "bid": checkin["beer"]["bid"],
+        "beer_name": checkin["beer"]["beer_name"],
+        "brewery_id": checkin["brewery"]["brewery_id"],
+        "brewery": checkin["brewery"]["brewery_name"],
+        "username": checkin["user"]["user_name"],
+        "rating": checkin["rating_score"],
+        "avg_rating": beer["rating_score"],
+        "total_checkins": beer["stats"]["total_user_count"],
+        "checkin_date": checkin["created_at"],
+        "collabs": collabs,
+        "abv": beer["beer_abv"],
+        "comment": checkin["checkin_comment"],
+        "beer_date": beer["created_at"],
+        "country": country
+    }
+
+
+async def submit_to_project(cog, ctx, url, payload: dict, acknowledge):
+    """Stores a drinking project submission, then acknowledges it with the
+    message acknowledge() sends. That message is edited with the project's
+    answer once the outbox has delivered it"""
+    entry = await cog.outbox.add(ctx.author.id, ctx.channel.id, url, payload)
+    message = None
+    try:
+        message = await acknowledge()
+    finally:
+        cog.outbox.send(entry, getattr(message, "id", None))
+    return message
+
 
+async def post_to_project(cog, url, payload: dict):
+    """Posts to a guild's drinking project script. Returns its answer, or
+    None if it couldn't be reached and the post should be tried again"""
+    try:
+        async with cog.session.post(url, data=payload) as resp:
+            if resp.status != 200:
+                return None
+            try:
+                answer = await resp.json()
+            except (ValueError, aiohttp.ContentTypeError):
+                # Google sends an HTML error page when the script falls over
+                return None
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return None
+    return answer if isinstance(answer, dict) else None
+
+
+# What to say when the project turns a submission down without a reason
+PROJECT_FAILURES = {
+    "drank": "Something went wrong adding the checkin",
+    "found": "Something went wrong finding the beer",
+    "undrank": "Something went wrong removing the checkin",
+    "unfind": "Something went wrong un-finding the beer",
+}
 
-async def do_toast(config, author, checkin: int):
-    """Toast a specific checkin"""
 
-    keys = await get_auth(author.id, config)
-    # keys["client_id"] = await self.config.client_id()
-    # keys["access_token"] = auth_token
+def project_answer_text(payload: dict, answer: dict):
+    """Turns the project's answer to a submission into something to say"""
+    action = payload["action"]
+    if answer is None:
+        return "I couldn't get through to the project so that didn't go in. Try again later"
+    if answer.get("result") != "success":
+        if "message" not in answer:
+            return PROJECT_FAILURES.get(action, "Something went wrong")
+        if action in ("drank", "found"):
+            return "Negatory: {}".format(answer["message"])
+        return answer["message"]
+
+    response_str = ""
+    if "message" in answer:
+        response_str += answer["message"] + " "
+    if "hasStats" in answer:
+        response_str += "{} has {} points across {} checkins and {} found beers. ".format(
+            payload.get("username") or answer.get("username"),
+            answer["points"], answer["checkins"], answer["found"]
+        )
+        if "styleString" in answer:
+            response_str += "\n{}".format(answer["styleString"])
+    if action == "found" and "beerStats" in answer:
+        response_str += "{} has been found by {} people. {} has {} beers found so far.".format(
+            payload["beer_name"], answer["beerPeople"], payload["brewery_name"], answer["breweryPeople"])
+    return response_str.strip() or "Done!"
+
+
+def record_submission(cog, entry, answer):
+    """Mirrors a delivered submission into the guild's project ledger"""
+    channel = cog.bot.get_channel(entry.channel_id)
+    guild = getattr(channel, "guild", None)
+    if guild is not None and answer is not None:
+        cog.ledger.record(guild.id, entry.payload, answer)
+
+
+async def poll_feeds(cog):
+    """Polls subscribed feeds one at a time as they come due, never
+    closer together than the feeds' spacing"""
+    await cog.feeds.load()
+    last_poll = 0.0
+    while True:
+        now = time.time()
+        subscription = cog.feeds.next_due()
+        start = max(last_poll + cog.feeds.spacing,
+                    subscription.next_poll if subscription else now + cog.feeds.spacing)
+        if start > now:
+            # Look again now and then in case someone subscribes meanwhile
+            await asyncio.sleep(min(start - now, cog.feeds.spacing))
+            continue
+        last_poll = now
+        try:
+            cursor, found = await poll_feed(cog, subscription)
+        except Exception:  # pylint: disable=broad-except
+            cursor, found = None, None
+        cog.feeds.polled(subscription, cursor, found)
+
+
+async def poll_feed(cog, subscription):
+    """Posts a subscriber's checkins since the last poll to the feed
+    channel. Returns the new cursor and how many checkins there were,
+    with None for the count if the poll failed"""
+    channel_id = cog.settings.feed_channel(subscription.guild_id)
+    channel = cog.bot.get_channel(channel_id) if channel_id else None
+    if channel is None:
+        return None, 0
+
+    keys = get_auth(subscription.user_id, cog.settings)
+    if subscription.cursor:
+        keys["min_id"] = subscription.cursor
+        keys["limit"] = 25
+    else:
+        # The first poll only finds where to start from
+        keys["limit"] = 1
+    url = "https://api.untappd.com/v4/user/checkins/{!s}?{!s}".format(
+        subscription.profile, urllib.parse.urlencode(keys))
+    resp = await get_data_from_untappd(cog, None, url, BACKGROUND)
+    if resp["meta"]["code"] != 200:
+        return None, None
+    items = resp["response"].get("checkins", {}).get("items") or []
+    cog.history.record_page(subscription.profile, items, min_id=subscription.cursor, limit=keys["limit"],
+                            owner=history_owner(subscription.user_id, cog.settings))
+    newest = max([checkin["checkin_id"] for checkin in items] + [subscription.cursor or 0])
+    if not subscription.cursor:
+        return newest or None, 0
+    checkins = sorted((checkin for checkin in items if checkin["checkin_id"] > subscription.cursor),
+                      key=lambda checkin: checkin["checkin_id"])
+    for checkin in checkins[-FEED_MAX_POSTS:]:
+        beer = cog.beer_cache.get(checkin["beer"]["bid"], personal=False)
+        message = await channel.send(embed=checkin_to_embed(None, None, checkin, beer))
+        cog.checkin_messages.add(message.id, checkin["checkin_id"])
+        cog.channels.remember(channel.id, beer=checkin["beer"]["bid"], checkin=checkin["checkin_id"])
+    if len(checkins) > FEED_MAX_POSTS:
+        await channel.send("...and {!s} more from {!s}".format(
+            len(checkins) - FEED_MAX_POSTS, subscription.profile))
+    return newest, len(checkins)
+
+
+async def reconcile_ledger(cog):
+    """Every so often checks the stalest stats in the ledger against
+    the sheet's status action"""
+    while True:
+        await asyncio.sleep(LEDGER_RECONCILE_INTERVAL)
+        try:
+            for guild_id, username in await cog.ledger.stale(LEDGER_RECONCILE_BATCH):
+                url = cog.settings.project_url(guild_id)
+                if not url:
+                    continue
+                answer = await post_to_project(cog, url, {"action": "status", "username": username})
+                if answer and answer.get("result") == "success" and "hasStats" in answer:
+                    await cog.ledger.reconcile(guild_id, username, answer)
+        except Exception:  # pylint: disable=broad-except
+            # Try again next time round
+            pass
+
+
+async def settle_submission(cog, entry, answer):
+    """Edits a submission's acknowledgement with the project's answer, or
+    says it in the channel if the acknowledgement is gone"""
+    record_submission(cog, entry, answer)
+    text = project_answer_text(entry.payload, answer)[:2000]
+    channel = cog.bot.get_channel(entry.channel_id)
+    if channel is None:
+        return
+    if entry.message_id:
+        try:
+            await channel.get_partial_message(entry.message_id).edit(content=text)
+            return
+        except discord.HTTPException:
+            pass
+    try:
+        await channel.send("<@{!s}> {!s}".format(entry.user_id, text)[:2000])
+    except discord.HTTPException:
+        pass
+
+
+async def do_toast(cog, author, checkin: int):
+    """Toast a specific checkin, returns whether it worked. Anything that
+    went wrong is PM'd to the author"""
+    return await cog.toasts.toast(author, checkin)
+
+
+async def toast_checkin(cog, author, checkin: int):
+    """Makes one toast call for the toast queue and says how it went"""
+
+    keys = get_auth(author.id, cog.settings)
     if "access_token" not in keys:
-        return ("You have not authorized the bot to act as you, use"
-                "`untappd authme` to start the process")
+        return FAILED, ("You have not authorized the bot to act as you, use "
+                        "`untappd authme` to start the process")
 
     qstr = urllib.parse.urlencode(keys)
     url = "https://api.untappd.com/v4/checkin/toast/{!s}?{!s}".format(checkin, qstr)
-    # print("Using URL: {!s}".format(url))
-
-    resp = await get_data_from_untappd(author, url)
-    if resp['meta']['code'] == 500:
-        await author.send("Toast failed, probably because you aren't friends with this person. Fix this by using "
-                          "`untappd friend <person>`")
-    elif resp["meta"]["code"] == 200:
-        if "result" in resp["response"]:
-            if resp["response"]["result"] == "success":
-                if resp["response"]["like_type"] == "toast":
-                    return True
-                elif resp["response"]["like_type"] == "un-toast":
-                    return await do_toast(config, author, checkin)
-        else:
-            await author.send("Toast failed for some reason")
-    else:
-        # print("Lookup failed for url: "+url)
-        await author.send("Toast failed with {!s} - {!s}".format(resp["meta"]["code"], resp["meta"]["error_detail"]))
+
+    resp = await get_data_from_untappd(cog, author, url)
+    code = resp["meta"]["code"]
+    if code == 500:
+        return FAILED, ("Toast of {!s} failed, probably because you aren't friends with this "
+                        "person. Fix this by using `untappd friend <person>`".format(checkin))
+    if code == 200:
+        if resp["response"].get("result") == "success":
+            if resp["response"].get("like_type") == "toast":
+                return TOASTED, "Toasted {!s}".format(checkin) if cog.is_chatty else None
+            if resp["response"].get("like_type") == "un-toast":
+                return UNTOASTED, None
+        return FAILED, "Toast of {!s} failed for some reason".format(checkin)
+    if code in (429, 502, 503, 504):
+        return RETRY, "Toast of {!s} failed with {!s} - {!s}".format(
+            checkin, code, resp["meta"].get("error_detail"))
+    return FAILED, "Toast of {!s} failed with {!s} - {!s}".format(
+        checkin, code, resp["meta"].get("error_detail"))
+
+
+async def report_toasts(user, lines):
+    """PMs someone what happened to their toasts"""
+    try:
+        await user.send("\n".join(lines))
+    except (discord.Forbidden, discord.HTTPException):
+        pass
 
 
-async def check_credentials(config):
+def check_credentials(settings):
     """Confirms bot owner set credentials"""
-    client_id = await config.client_id()
-    secret = await config.client_secret()
+    client_id = settings.client_id
+    secret = settings.client_secret
     return client_id and secret
 
 
@@ -1554,27 +1951,46 @@ def setup(bot):
     bot.add_cog(Untappd(bot))
 
 
-async def get_auth(author_id, config):
+def history_owner(author_id, settings):
+    """Whose view of the history mirror a lookup with get_auth reads and
+    writes, 0 for the view without a token"""
+    return author_id if settings.token(author_id) else 0
+
+
+def get_auth(author_id, settings):
     """Returns auth dictionary given a context"""
-    client_id = await config.client_id()
-    keys = {"client_id": client_id}
-    try:
-        keys["access_token"] = await config.get_raw(author_id, "token")
-    except KeyError:
-        keys["client_secret"] = await config.client_secret()
+    keys = {"client_id": settings.client_id}
+    token = settings.token(author_id)
+    if token:
+        keys["access_token"] = token
+    else:
+        keys["client_secret"] = settings.client_secret
     return keys
 
 
-async def get_beer_by_id(config, ctx, beerid):
-    """Use the untappd API to return a beer dict for a beer id"""
-
-    keys = await get_auth(ctx.author.id, config)
+async def get_beer_by_id(cog, ctx, beerid, personal: bool = True,
+                         priority: int = INTERACTIVE):
+    """Use the untappd API to return a beer dict for a beer id
+    Set personal to False when the caller's own rating and
+    checkin count aren't needed, which lets any cached copy be used.
+    Background lookups return None rather than dip into the calls
+    reserved for commands"""
+
+    keys = get_auth(ctx.author.id, cog.settings)
+    user_key = ctx.author.id if "access_token" in keys else None
+    beer = cog.beer_cache.get(beerid, user_key, personal=personal)
+    if beer:
+        return beer
+    if priority != INTERACTIVE and not cog.ratelimit.has_spare(params_budget_key(keys)):
+        return None
     qstr = urllib.parse.urlencode(keys)
     url = "https://api.untappd.com/v4/beer/info/{!s}?{!s}".format(
         beerid, qstr
     )
-    resp = await get_data_from_untappd(ctx.author, url)
+    resp = await get_data_from_untappd(cog, ctx.author, url, priority)
     if resp['meta']['code'] == 200:
+        cog.beer_cache.store(resp['response']['beer'], user_key)
+        cog.beer_index.add_beer(resp['response']['beer'])
         return resp['response']['beer']
     else:
         return "Query failed with code {!s}: {!s}".format(
@@ -1583,19 +1999,18 @@ async def get_beer_by_id(config, ctx, beerid):
         )
 
 
-async def lookup_beer(config, ctx, channels, beerid: int):
-    """Look up a beer by id, returns an embed"""
+async def lookup_beer(cog, ctx, channels, beerid: int, beer: dict = None):
+    """Look up a beer by id, returns an embed
+    A beer that was already fetched can be passed in to skip the lookup"""
 
-    beer = await get_beer_by_id(config, ctx, beerid)
+    if not beer:
+        beer = await get_beer_by_id(cog, ctx, beerid)
     if not beer:
         return embedme("Problem looking up a beer by id")
     elif isinstance(beer, str):
         return embedme(beer)
     embed = beer_to_embed(beer)
-    channel = ctx.channel.id
-    if channel not in channels:
-        channels[channel] = {}
-    channels[channel]["beer"] = beer["bid"]
+    channels.remember(ctx.channel.id, beer=beer["bid"])
     return embed
 
 
@@ -1686,20 +2101,20 @@ def beer_to_embed(beer, rating=None):
     return embed
 
 
-async def get_checkin(config, ctx, channels, checkin: int, auth_token: str = None):
-    """Look up a specific checkin"""
+async def get_checkin(cog, ctx, checkin: int, auth_token: str = None):
+    """Look up a specific checkin, returns the checkin or an error string"""
 
     keys = dict()
-    keys["client_id"] = await config.client_id()
+    keys["client_id"] = cog.settings.client_id
     if auth_token:
         keys["access_token"] = auth_token
         # print("Doing an authorized lookup")
     else:
-        keys["client_secret"] = await config.client_secret()
+        keys["client_secret"] = cog.settings.client_secret
     qstr = urllib.parse.urlencode(keys)
     url = "https://api.untappd.com/v4/checkin/view/{!s}?{!s}".format(checkin, qstr)
 
-    resp = await get_data_from_untappd(ctx.author, url)
+    resp = await get_data_from_untappd(cog, ctx.author, url)
     if resp['meta']['code'] != 200:
         # print("Lookup failed for url: "+url)
         return "Lookup failed with {!s} - {!s}".format(
@@ -1708,71 +2123,196 @@ async def get_checkin(config, ctx, channels, checkin: int, auth_token: str = Non
 
     if "response" in resp:
         if "checkin" in resp["response"]:
-            user_checkin = resp["response"]["checkin"]
-            return await checkin_to_embed(config, ctx, channels, user_checkin)
-    return embedme("Unplanned for error looking up checkin")
+            return resp["response"]["checkin"]
+    return "Unplanned for error looking up checkin"
 
 
-async def get_checkins(config, ctx, channels, profile: str = None,
+async def get_checkins(cog, ctx, channels, profile: str = None,
                        start: int = None, count: int = 0):
     """Given some information get checkins of a user"""
     embed = None
+    checkin = None
     checkin_list = []
     if not profile:
         return "No profile was provided or calculated"
-    count = count or await list_size(config, ctx.guild)
-
-    keys = await get_auth(ctx.author.id, config)
-    if count:
-        keys["limit"] = count
-    if start:
-        keys["max_id"] = start
-    keys["client_id"] = await config.client_id()
-    qstr = urllib.parse.urlencode(keys)
-    url = "https://api.untappd.com/v4/user/checkins/{!s}?{!s}".format(
-        profile, qstr
-    )
-    # print("Looking up: {!s}".format(url))
-    resp = await get_data_from_untappd(ctx.author, url)
-    if resp["meta"]["code"] != 200:
-        # print("Lookup failed for url: "+url)
-        return "Lookup failed with {!s} - {!s}".format(
-            resp["meta"]["code"],
-            resp["meta"]["error_detail"]
+    count = count or list_size(cog.settings, ctx.guild)
+
+    checkins = await mirrored_checkins(cog, ctx, profile, count, start)
+    if checkins is None:
+        keys = get_auth(ctx.author.id, cog.settings)
+        if count:
+            keys["limit"] = count
+        if start:
+            keys["max_id"] = start
+        keys["client_id"] = cog.settings.client_id
+        qstr = urllib.parse.urlencode(keys)
+        url = "https://api.untappd.com/v4/user/checkins/{!s}?{!s}".format(
+            profile, qstr
         )
-
-    try:
-        if resp["response"]["checkins"]["count"] == 1:
-            embed = await checkin_to_embed(
-                config, ctx, channels, resp["response"]["checkins"]["items"][0])
-        elif resp["response"]["checkins"]["count"] > 1:
+        # print("Looking up: {!s}".format(url))
+        resp = await get_data_from_untappd(cog, ctx.author, url)
+        if resp["meta"]["code"] != 200:
+            # print("Lookup failed for url: "+url)
+            return "Lookup failed with {!s} - {!s}".format(
+                resp["meta"]["code"],
+                resp["meta"]["error_detail"]
+            )
+        try:
             checkins = resp["response"]["checkins"]["items"]
-            checkin_text = checkins_to_string(count, checkins)
-            checkin_list = checkins
-            embed = discord.Embed(title=profile, description=checkin_text[:2048])
-    except KeyError:
-        return "No checkins found for user"
+        except KeyError:
+            return "No checkins found for user"
+        cog.history.record_page(profile, checkins, max_id=start or None, limit=count,
+                                owner=history_owner(ctx.author.id, cog.settings))
+
+    if len(checkins) == 1:
+        checkin = checkins[0]
+        embed = checkin_to_embed(ctx, channels, checkin)
+    elif len(checkins) > 1:
+        checkin_text = checkins_to_string(count, checkins)
+        checkin_list = checkins
+        embed = discord.Embed(title=profile, description=checkin_text[:2048])
 
     result = dict()
     result["embed"] = embed
+    if checkin:
+        # Callers should use send_checkin to show the whole thing
+        result["checkin"] = checkin
     if checkin_list:
         result["list"] = checkin_list
     return result
 
 
-async def search_beer(config, ctx, query, limit=None, homebrew: bool = False):
+async def mirrored_had(cog, author, beerid):
+    """(times had, latest rating) for a beer from someone's own mirrored
+    history, None if the mirror doesn't have all of it"""
+    history = cog.history.range_for(author.id)
+    if history is None or not history.complete:
+        return None
+    if not cog.history.is_fresh(history) and not await sync_history(cog, author, history):
+        return None
+    return await cog.history.had(history, beerid)
+
+
+async def mirrored_checkins(cog, ctx, profile, count: int, start=None):
+    """A page of checkins from the history mirror as the caller's token
+    sees them, catching it up first if it's gone stale. None if the mirror
+    can't answer"""
+    owner = history_owner(ctx.author.id, cog.settings)
+    history = cog.history.range(profile, owner)
+    if history is None:
+        return None
+    if not start and not cog.history.is_fresh(history):
+        if not await sync_history(cog, ctx.author, history):
+            return None
+    return await cog.history.recent(profile, count, start or None, owner)
+
+
+async def sync_history(cog, author, history):
+    """Fetches whatever was checked in since the top of a mirrored run,
+    which must be the author's own view of it. Returns whether it worked"""
+    if history.owner != history_owner(author.id, cog.settings):
+        return False
+    keys = get_auth(author.id, cog.settings)
+    keys["min_id"] = history.newest
+    keys["limit"] = 50
+    url = "https://api.untappd.com/v4/user/checkins/{!s}?{!s}".format(
+        history.username, urllib.parse.urlencode(keys))
+    resp = await get_data_from_untappd(cog, author, url)
+    if resp["meta"]["code"] != 200:
+        return False
+    items = resp["response"].get("checkins", {}).get("items") or []
+    cog.history.record_page(history.username, items, min_id=history.newest, limit=50,
+                            owner=history.owner)
+    return True
+
+
+async def backfill_history(cog):
+    """Fills in the mirror for people who authorized the bot, one page of
+    one person's older checkins at a time, from their own hourly budget.
+    Everyone takes turns, and anyone who can't make progress sits out a
+    while so they don't hold up everyone after them"""
+    await cog.history.load()
+    resting = {}  # user id -> when their next turn can be
+    last = 0
+    while True:
+        await asyncio.sleep(HISTORY_BACKFILL_SPACING)
+        try:
+            now = time.monotonic()
+            waiting = sorted(
+                user_id for user_id in cog.settings.token_holders()
+                if resting.get(user_id, 0) <= now
+                and not getattr(cog.history.range_for(user_id), "complete", False))
+            if not waiting:
+                continue
+            # The next one after whoever went last, round and round
+            user_id = next((user_id for user_id in waiting if user_id > last), waiting[0])
+            last = user_id
+            rest = await backfill_page(cog, user_id, cog.history.range_for(user_id))
+            if rest:
+                resting[user_id] = time.monotonic() + rest
+            else:
+                resting.pop(user_id, None)
+        except Exception:  # pylint: disable=broad-except
+            # Try again next time round
+            pass
+
+
+async def backfill_page(cog, user_id, history=None):
+    """Mirrors one page of someone's checkins with their token, the newest
+    page if nothing is mirrored yet and otherwise the page below the run.
+    Returns how many seconds to leave them be if that couldn't be done"""
+    keys = get_auth(user_id, cog.settings)
+    keys["limit"] = 50
+    if history is not None:
+        keys["max_id"] = history.oldest
+    # With a token and no user name Untappd answers for the token's owner
+    url = "https://api.untappd.com/v4/user/checkins?{!s}".format(urllib.parse.urlencode(keys))
+    if not cog.ratelimit.has_spare(budget_key(url)):
+        return HISTORY_BACKFILL_BUSY
+    resp = await get_data_from_untappd(cog, None, url, BACKGROUND)
+    if resp["meta"]["code"] != 200:
+        return HISTORY_BACKFILL_FAILED
+    items = resp["response"].get("checkins", {}).get("items") or []
+    if history is not None:
+        username = history.username
+    elif items:
+        username = items[0]["user"]["user_name"]
+    else:
+        # Nothing checked in yet, so there's no run to start
+        return HISTORY_BACKFILL_FAILED
+    cog.history.record_page(username, items, max_id=keys.get("max_id"), limit=50,
+                            owner=user_id, own=True)
+    return 0
+
+
+async def search_beer(cog, ctx, query, limit=None, homebrew: bool = False):
     """Given a query string and some other
     information returns an embed of results"""
 
-    keys = await get_auth(ctx.author.id, config)
-    keys["q"] = query
+    keys = get_auth(ctx.author.id, cog.settings)
+    # Authorized results say whether the user has had each beer,
+    # so those can only be reused for the same user
+    scope = ctx.author.id if "access_token" in keys else None
+    normalized = normalize_query(query)
+    results = cog.search_cache.get((scope, normalized, limit, homebrew))
+    if results is not None:
+        return results
+
+    keys["q"] = " ".join(str(query).replace("+", " ").split())
     keys["limit"] = limit
     qstr = urllib.parse.urlencode(keys)
 
     url = "https://api.untappd.com/v4/search/beer?%s" % qstr
     #    print(url)
-    resp = await get_data_from_untappd(ctx.author, url)
+    resp = await get_data_from_untappd(cog, ctx.author, url)
     if resp["meta"]["code"] == 200:
+        # One search answers both the beer and the homebrew question
+        for is_homebrew, section in ((False, "beers"), (True, "homebrew")):
+            if section in resp['response']:
+                found = resp['response'][section]
+                cog.beer_index.add_search(found.get("items", []), is_homebrew)
+                ttl = None if found.get("count") else SEARCH_CACHE_EMPTY_TTL
+                cog.search_cache.set((scope, normalized, limit, is_homebrew), found, ttl=ttl)
         if homebrew:
             return resp['response']['homebrew']
         else:
@@ -1783,24 +2323,31 @@ async def search_beer(config, ctx, query, limit=None, homebrew: bool = False):
                        resp["meta"]["error_detail"]))
 
 
-async def search_beer_to_embed(config, ctx, channels, query, limit=None, homebrew: bool = False):
-    """Searches for a beer and returns an embed"""
-    beers = await search_beer(config, ctx, query, limit, homebrew)
+async def search_beer_to_embed(cog, ctx, channels, query, limit=None, homebrew: bool = False):
+    """Searches for a beer and returns an embed. A query that names one
+    beer and its brewery in the local index is answered without
+    searching Untappd"""
+    bid = await cog.beer_index.find(query, homebrew)
+    if bid is not None:
+        embed = await lookup_beer(cog, ctx, channels, bid)
+        return {"embed": answered_by(embed, "local index")}
+    beers = await search_beer(cog, ctx, query, limit, homebrew)
     if isinstance(beers, str):
         # I'm not sure what happens when a naked embed gets returned.
         # return embedme(beers)
         return beers
 
     response = ""
-    list_limit = limit or await list_size(config, None)
+    list_limit = limit or list_size(cog.settings, None)
     result_text = "Your search returned {!s} beers:\n".format(
         beers["count"]
     )
     beer_list = []
     if beers['count'] == 1:
-        return await lookup_beer(
-            config, ctx, channels,
+        embed = await lookup_beer(
+            cog, ctx, channels,
             beers['items'][0]['beer']['bid'])
+        return {"embed": answered_by(embed, "Untappd search")}
     elif beers['count'] > 1:
         firstnum = 1
 
@@ -1837,34 +2384,41 @@ async def search_beer_to_embed(config, ctx, channels, query, limit=None, homebre
 
     embed = discord.Embed(title=response, description=result_text[:2048])
     result = dict()
-    result["embed"] = embed
+    result["embed"] = answered_by(embed, "Untappd search")
     if beer_list:
         result["beer_list"] = beer_list
     return result
 
 
-async def profile_lookup(config, ctx, profile, limit=5):
+def answered_by(embed, source):
+    """Notes in the footer where a search's answer came from"""
+    footer = embed.footer.text if embed.footer and embed.footer.text else ""
+    embed.set_footer(text="{!s} | {!s}".format(footer.strip(), source) if footer else source)
+    return embed
+
+
+async def profile_lookup(cog, ctx, profile, limit=5):
     """Looks up a profile in untappd by username"""
     query = urllib.parse.quote_plus(profile)
     api_key = "client_id={}&client_secret={}".format(
-        await config.client_id(),
-        await config.client_secret())
+        cog.settings.client_id,
+        cog.settings.client_secret)
 
     url = "https://api.untappd.com/v4/user/info/" + query + "?" + api_key
 
     # TODO: Honor is_private flag on private profiles.
 
-    resp = await get_data_from_untappd(ctx.author, url)
+    resp = await get_data_from_untappd(cog, ctx.author, url)
     if resp["meta"]["code"] == 400:
         return "The profile '{!s}' does not exist".format(profile)
     elif resp['meta']['code'] == 200:
-        embed, beer_list = await user_to_embed(config, resp['response']['user'], limit)
+        embed, beer_list = user_to_embed(cog.settings, resp['response']['user'], limit)
         result = {"embed": embed}
         if beer_list:
             result["beer_list"] = beer_list
         return result
         # Coded as an enhancement request but managed through Discord means
-        # friendly = await is_friendly(self, config, ctx, profile)
+        # friendly = is_friendly(cog.settings, ctx, profile)
         # if friendly:
         #     embed.add_field(name="Friendly",
         #                     value="Accepts friend requests from Discordians",
@@ -1874,7 +2428,7 @@ async def profile_lookup(config, ctx, profile, limit=5):
             resp["meta"]["code"], resp["meta"]["error_detail"])
 
 
-async def user_to_embed(config, user, limit=5):
+def user_to_embed(settings, user, limit=5):
     """Takes the user portion of a json response and returns an embed \
 and a checkin list"""
     beer_list = []
@@ -1885,9 +2439,9 @@ and a checkin list"""
     name_str = user['user_name']
     flair_str = ""
     if user['is_supporter']:
-        flair_str += await config.supporter_emoji()
+        flair_str += settings.supporter_emoji
     if user['is_moderator']:
-        flair_str += await config.moderator_emoji()
+        flair_str += settings.moderator_emoji
     embed = discord.Embed(title=name_str,
                           description=recent_message[:2048]
                                       or "No recent beers visible",
@@ -1922,35 +2476,18 @@ and a checkin list"""
     return embed, beer_list
 
 
-async def is_friendly(config, ctx, profile: str):
+def is_friendly(settings, ctx, profile: str):
     """Checks if user set themselves to accept friend requests"""
-    if ctx.guild:
-        server = str(ctx.guild.id)
-    else:
+    if not ctx.guild:
         return False
 
     member = ctx.guild.get_member_named(profile)
-    if member:
-        try:
-            friendme = await config.get_raw(server, str(member.id), "friendme") == 1
-            return friendme
-        except KeyError:
-            pass
-    if server:
-        # See if they set a nickname
-        try:
-            authors = await config.get_raw(server)
-            try:
-                for author in authors:
-                    nick = await config.get_raw(server, author, "nick")
-                    if nick == profile:
-                        friendme = await config.get_raw(server, author, "friendme") == 1
-                        return friendme
-            except (KeyError, TypeError):
-                pass
-        except KeyError:
-            pass
-
+    if member and settings.friendme(ctx.guild.id, member.id):
+        return True
+    # See if they set a nickname
+    owner = settings.nick_owner(ctx.guild.id, profile)
+    if owner:
+        return settings.friendme(ctx.guild.id, owner)
     return False
 
 
@@ -1973,35 +2510,41 @@ EMOJI = {
 }
 
 
-async def embed_menu(client, config, ctx, channels, beer_list: list, message, timeout: int = 30,
+async def embed_menu(cog, ctx, channels, beer_list: list, message, timeout: int = 30,
                      type_: str = "beer", paging: bool = False, reacted: bool = False):
     """Says the message with the embed and adds menu for reactions"""
     emoji = []
-    limit = await list_size(config, ctx.guild)
+    limit = list_size(cog.settings, ctx.guild)
 
     if not message:
         await ctx.send("I didn't get a handle to an existing message.")
         return
 
+    prefetch = prefetch_menu_beers(cog, ctx, beer_list[:limit], type_)
+
     for num, beer in zip(range(1, limit + 1), beer_list): # pylint: disable=unused-variable
         emoji.append(EMOJI[num])
-        await message.add_reaction(EMOJI[num])
-
-    def check(reaction, person):
-        if reaction.emoji and reaction.emoji in emoji:
-            return person == ctx.author
-        return False
 
+    # The menu takes picks as soon as it's open. The reactions go on in the
+    # background and in order, discord.py would only queue them up anyway
+    picked = cog.menus.open(message.id, ctx.author.id, emoji, timeout)
+    adding = asyncio.ensure_future(add_reactions(message, emoji))
     try:
-        react, user = await client.wait_for('reaction_add', timeout=timeout, check=check) # pylint: disable=unused-variable
-    except asyncio.TimeoutError:
+        react = await picked
+    finally:
+        adding.cancel()
+        cog.menus.close(message.id)
+
+    if react is None:
         # await ctx.send("Timed out, cleaning up")
+        for task in prefetch:
+            task.cancel()
         try:
             try:
                 await message.clear_reactions()
             except discord.Forbidden:
                 for e in emoji:
-                    await message.remove_reaction(e, client.user)
+                    await message.remove_reaction(e, cog.bot.user)
         except discord.Forbidden:
             pass
         return None
@@ -2012,24 +2555,56 @@ async def embed_menu(client, config, ctx, channels, beer_list: list, message, ti
         except discord.Forbidden:
             await ctx.send("I wanted to clean up but I am not allowed")
 
-        reacts = {v: k for k, v in EMOJI.items()}
-        react = reacts[react.emoji]
-        react -= 1
+        beer = None
+        for num, task in enumerate(prefetch):
+            if num != react:
+                task.cancel()
+        if react < len(prefetch):
+            # The picked lookup has already spent its call, so wait for it
+            # rather than ask Untappd again. Only a failed or slow one is
+            # looked up afresh below
+            try:
+                beer = await asyncio.wait_for(asyncio.shield(prefetch[react]), MENU_PREFETCH_WAIT)
+            except Exception:  # pylint: disable=broad-except
+                # Timed out or failed
+                prefetch[react].cancel()
+        if isinstance(beer, str):
+            beer = None
         if len(beer_list) > react:
             new_embed = ""
             if type_ == "beer":
-                new_embed = await lookup_beer(config, ctx, channels,
-                                              beer_list[react])
+                new_embed = await lookup_beer(cog, ctx, channels,
+                                              beer_list[react], beer=beer)
             elif type_ == "checkin":
-                new_embed = await checkin_to_embed(config, ctx, channels, beer_list[react])
+                await send_checkin(cog, ctx, channels, beer_list[react], beer=beer)
             if isinstance(new_embed, discord.Embed):
                 await ctx.send(embed=new_embed)
         return None
 
-    # await embed_menu(client, config, ctx, channels, beer_list, message, timeout=timeout, reacted=True,
+    # await embed_menu(cog, ctx, channels, beer_list, message, timeout=timeout, reacted=True,
     # type_=type_, paging=paging)
 
 
+def prefetch_menu_beers(cog, ctx, menu_items: list, type_: str = "beer"):
+    """Starts looking up the beers behind a menu while the user decides.
+    Returns one task per menu item, each resolving to a beer or None"""
+
+    semaphore = asyncio.Semaphore(MENU_PREFETCH_CONCURRENCY)
+
+    async def prefetch(beerid, personal):
+        async with semaphore:
+            return await get_beer_by_id(cog, ctx, beerid, personal=personal,
+                                        priority=BACKGROUND)
+
+    tasks = []
+    for item in menu_items:
+        if type_ == "checkin":
+            tasks.append(asyncio.ensure_future(prefetch(item["beer"]["bid"], False)))
+        else:
+            tasks.append(asyncio.ensure_future(prefetch(item, True)))
+    return tasks
+
+
 def checkins_to_string(count: int, checkins: list):
     """Takes a list of checkins and returns a string"""
     # checkin_text = ("**checkin** - **beerID** - **beer (caps)**\n\t**brewery** - **badges** - **when**\n")
@@ -2052,11 +2627,16 @@ def checkins_to_string(count: int, checkins: list):
     return checkin_text
 
 
-async def checkin_to_embed(config, ctx, channels, checkin):
-    """Given a checkin object return an embed of that checkin's information"""
+def checkin_to_embed(ctx, channels, checkin, beer: dict = None):
+    """Given a checkin object return an embed of that checkin's information
+    The checkin itself is enough for a first look. Pass the beer from
+    get_beer_by_id to add its description, average rating, stats
+    and collaborations. Without channels nothing is remembered about
+    where it was shown and ctx isn't used"""
 
-    # Get the base beer information
-    beer = await get_beer_by_id(config, ctx, checkin["beer"]["bid"])
+    if not isinstance(beer, dict):
+        beer = None
+    details = beer or checkin["beer"]
     # titleStr = "Checkin {!s}".format(checkin["checkin_id"])
     url = "https://untappd.com/user/{!s}/checkin/{!s}".format(checkin["user"]["user_name"], checkin["checkin_id"])
     # deep_checkin_link = "[{!s}](untappd://checkin/{!s})".format(
@@ -2075,7 +2655,8 @@ async def checkin_to_embed(config, ctx, channels, checkin):
     # )
     checkin_time = datetime.strptime(checkin["created_at"], "%a, %d %b %Y %H:%M:%S %z")
 
-    embed = discord.Embed(title=title, description=beer["beer_description"][:2048], url=url, timestamp=checkin_time)
+    description = beer["beer_description"][:2048] if beer else ""
+    embed = discord.Embed(title=title, description=description, url=url, timestamp=checkin_time)
     if checkin["media"]["count"] >= 1:
         embed.set_thumbnail(
             url=checkin["media"]["items"][0]["photo"]["photo_img_md"]
@@ -2094,15 +2675,19 @@ async def checkin_to_embed(config, ctx, channels, checkin):
     title = "Rating"
     if checkin["rating_score"]:
         title += " - {!s}".format(checkin["rating_score"])
-    rating = "**{!s}** Average ({!s})".format(round(beer['rating_score'], 2), human_number(beer['rating_count']))
-    embed.add_field(name=title, value=rating)
-    embed.add_field(name="Style", value=beer["beer_style"])
-    embed.add_field(name="ABV", value=(beer["beer_abv"] or "N/A"))
-    embed.add_field(name="IBU", value=(beer["beer_ibu"] or "N/A"))
-    checkin_text = "{!s} checkins from {!s} users".format(human_number(beer["stats"]["total_count"]),
-                                                          human_number(beer["stats"]["total_user_count"]))
-    embed.add_field(name="Checkins", value=checkin_text)
-    if "collaborations_with" in beer:
+    if beer:
+        rating = "**{!s}** Average ({!s})".format(round(beer['rating_score'], 2), human_number(beer['rating_count']))
+        embed.add_field(name=title, value=rating)
+    elif checkin["rating_score"]:
+        embed.add_field(name="Rating", value=str(checkin["rating_score"]))
+    embed.add_field(name="Style", value=(details.get("beer_style") or "N/A"))
+    embed.add_field(name="ABV", value=(details.get("beer_abv") or "N/A"))
+    embed.add_field(name="IBU", value=(details.get("beer_ibu") or "N/A"))
+    if beer:
+        checkin_text = "{!s} checkins from {!s} users".format(human_number(beer["stats"]["total_count"]),
+                                                              human_number(beer["stats"]["total_user_count"]))
+        embed.add_field(name="Checkins", value=checkin_text)
+    if beer and "collaborations_with" in beer:
         collab_text = ""
         collabs = beer['collaborations_with']['items']
         for num, collab in zip(range(10), collabs): # pylint: disable=unused-variable
@@ -2127,22 +2712,35 @@ async def checkin_to_embed(config, ctx, channels, checkin):
     #    embed.add_field(name="DeepBeer", value=deep_beer_link)
     #    embed.add_field(name="DeepBrewery", value=deep_brewery_link)
     embed.set_footer(text="Checkin {!s} / Beer {!s}".format(checkin["checkin_id"], checkin["beer"]["bid"]))
-    channel = ctx.channel.id
-    if channel not in channels:
-        channels[channel] = {}
-    channels[channel]["checkin"] = checkin["checkin_id"]
-    channels[channel]["beer"] = checkin["beer"]["bid"]
+    if channels is not None:
+        channels.remember(ctx.channel.id, beer=checkin["beer"]["bid"], checkin=checkin["checkin_id"])
 
     return embed
 
 
-async def list_size(config, server=None):
+async def send_checkin(cog, ctx, channels, checkin, content: str = "", beer: dict = None):
+    """Posts a checkin straight away from what the checkin says, then
+    fills in the rest of the beer's details once they've been looked up.
+    Returns the message"""
+
+    bid = checkin["beer"]["bid"]
+    if not beer:
+        beer = cog.beer_cache.get(bid, personal=False)
+    message = await ctx.send(content, embed=checkin_to_embed(ctx, channels, checkin, beer))
+    cog.checkin_messages.add(message.id, checkin["checkin_id"])
+    if not beer:
+        beer = await get_beer_by_id(cog, ctx, bid, personal=False)
+        if isinstance(beer, dict):
+            try:
+                await message.edit(embed=checkin_to_embed(ctx, channels, checkin, beer))
+            except discord.HTTPException:
+                pass
+    return message
+
+
+def list_size(settings, server=None):
     """Returns a list size if configured for the server or the default size"""
-    try:
-        size = await config.get_raw(server.id, "max_items_in_list")
-    except (KeyError, AttributeError):
-        size = await config.max_items_in_list()
-    return size
+    return settings.list_size(server.id if server else None)
 
 
 def embedme(error_text, title="Error encountered"):
@@ -2237,24 +2835,97 @@ def brewery_location(brewery):
     return format(', '.join(brewery_loca))
 
 
-async def get_data_from_untappd(author, url):
-    """Perform a GET against the provided URL, returns a response
+def report_task_failure(what, task):
+    """Done callback for background tasks nobody awaits"""
+    if not task.cancelled() and task.exception() is not None:
+        print("Untappd: {!s} failed: {!r}".format(what, task.exception()))
+
+
+async def checkin_from_footer(cog, payload):
+    """Finds the checkin a message of ours shows from its embed footer,
+    for messages the checkin message index doesn't know"""
+    channel = cog.bot.get_channel(payload.channel_id)
+    if channel is None:
+        return None
+    message = discord.utils.get(cog.bot.cached_messages, id=payload.message_id)
+    if message is None:
+        try:
+            message = await channel.fetch_message(payload.message_id)
+        except discord.HTTPException:
+            return None
+    if message.author.id != cog.bot.user.id or not message.embeds:
+        return None
+    match = re.search('Checkin ([0-9]+) /', message.embeds[0].footer.text or "")
+    if not match:
+        return None
+    cog.checkin_messages.add(message.id, match.group(1))
+    return int(match.group(1))
+
+
+async def get_data_from_untappd(cog, author, url, priority: int = INTERACTIVE):
+    """Perform a GET against the provided URL using the cog's session,
+    returns a response. Identical lookups already in flight at the same
+    priority are shared, a command never waits behind a background one.
+    Background work should pass a lower priority so commands go first.
     NOTE: Provided URL is already formatted"""
 
+    key = request_key(url)
+    if key is None:
+        return await fetch_from_untappd(cog, author, url, priority)
+    return await cog.inflight.do((key, priority),
+                                 lambda: read_through_untappd(cog, author, url, key, priority))
+
+
+async def read_through_untappd(cog, author, url, key, priority: int = INTERACTIVE):
+    """Answers a read-only request from the disk cache when it can,
+    otherwise fetches it and stores the answer"""
+
+    resp = await cog.api_cache.get(key)
+    if resp is not None:
+        return resp
+    resp = await fetch_from_untappd(cog, author, url, priority)
+    if resp["meta"]["code"] == 200:
+        cog.api_cache.put(key, resp)
+    return resp
+
+
+async def fetch_from_untappd(cog, author, url, priority: int = INTERACTIVE):
+    """Does the actual GET for get_data_from_untappd once the rate
+    limiter has a call to spare"""
+
+    budget = budget_key(url)
+    if not await cog.ratelimit.acquire(budget, priority):
+        return untappd_error(429, "Too many Untappd lookups this hour, "
+                                  "please try again in a few minutes")
     try:
-        async with aiohttp.ClientSession() as sess:
-            async with sess.get(url) as resp:
-                headers = resp.headers
-                if "X-Ratelimit-Remaining" in headers:
-                    if int(headers["X-Ratelimit-Remaining"]) < 10:
-                        await author.send(
-                            ("Warning: **{!s}** API calls left for you this hour "
-                             "and some commands use multiple calls. Sorry."
-                             ).format(headers["X-Ratelimit-Remaining"])
-                        )
-                return await resp.json()
-    except aiohttp.ClientError as exc:
-        return "Untappd call failed with {!s}".format(exc)
+        async with cog.session.get(url) as resp:
+            headers = resp.headers
+            cog.ratelimit.update(budget, headers)
+            if "X-Ratelimit-Remaining" in headers and priority == INTERACTIVE:
+                if int(headers["X-Ratelimit-Remaining"]) < 10:
+                    await author.send(
+                        ("Warning: **{!s}** API calls left for you this hour "
+                         "and some commands use multiple calls. Sorry."
+                         ).format(headers["X-Ratelimit-Remaining"])
+                    )
+            return await resp.json()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+        return untappd_error(503, "Untappd call failed with {!s}".format(exc))
+
+
+def untappd_error(code: int, detail: str):
+    """Returns a response shaped like an Untappd error so callers can
+    report it the same way as any other failed lookup"""
+    return {"meta": {"code": code, "error_detail": detail}, "response": {}}
+
+
+async def add_reactions(message, emoji: list):
+    """Adds reactions in order, stopping at the first one that fails"""
+    for react in emoji:
+        try:
+            await message.add_reaction(react)
+        except (discord.Forbidden, discord.NotFound, discord.HTTPException):
+            return
 
 
 async def add_react(message, react):